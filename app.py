@@ -5,6 +5,7 @@ Integrated frontend and backend web application
 
 import os
 import sys
+import json
 import base64
 from datetime import datetime
 import glob
@@ -20,6 +21,7 @@ from flask_dance.contrib.google import make_google_blueprint, google
 # Import backend functionality
 sys.path.append(os.path.join(os.path.dirname(__file__), 'src'))
 from generate_item import analyze_image, get_image_hash
+import keyword_tagger
 
 def extract_item_info(analysis_text):
     """Extract item name and category from analysis text with detailed features."""
@@ -28,11 +30,12 @@ def extract_item_info(analysis_text):
     
     text_lower = analysis_text.lower()
     
-    # Extract detailed features
-    color = extract_color(text_lower)
-    material = extract_material(text_lower)
-    style_details = extract_style_details(text_lower)
-    item_type = extract_item_type(text_lower)
+    # Extract detailed features (one keyword scan shared by every vocabulary)
+    found = keyword_tagger.scan(text_lower)
+    color = _color_name(found)
+    material = keyword_tagger.first_tag('material', found, "Unknown")
+    style_details = keyword_tagger.first_tag('style', found, "Unknown")
+    item_type = keyword_tagger.first_tag('item_type', found, "Item")
     
     # Create a detailed name
     name_parts = []
@@ -55,20 +58,7 @@ def extract_item_info(analysis_text):
         item_name = " ".join(name_parts)
     
     # Determine category
-    if any(word in text_lower for word in ['dress']):
-        category = 'Dresses'
-    elif any(word in text_lower for word in ['blouse', 'top', 'shirt', 't-shirt', 'sweater', 'hoodie', 'tank', 'crop', 'blazer', 'cardigan', 'pullover', 'polo', 'camisole', 'tunic']):
-        category = 'Tops'
-    elif any(word in text_lower for word in ['pants', 'skirt', 'jeans', 'shorts', 'trousers', 'leggings', 'capri', 'cargo', 'chinos']):
-        category = 'Bottoms'
-    elif any(word in text_lower for word in ['shoes', 'sneaker', 'boot', 'sandals', 'loafer', 'heel', 'sneakers', 'boots', 'flats', 'pumps', 'oxfords', 'mules', 'clogs', 'slippers']):
-        category = 'Shoes'
-    elif any(word in text_lower for word in ['jacket', 'coat', 'blazer', 'cardigan', 'sweater', 'hoodie', 'vest', 'windbreaker', 'trench', 'parka', 'bomber', 'denim jacket', 'leather jacket']):
-        category = 'Outerwear'
-    elif any(word in text_lower for word in ['bag', 'handbag', 'backpack', 'purse', 'tote', 'clutch', 'satchel', 'hat', 'cap', 'scarf', 'belt', 'glove', 'accessory', 'jewelry', 'watch', 'sunglasses', 'necklace', 'bracelet', 'earrings', 'ring']):
-        category = 'Accessories'
-    else:
-        category = 'Accessories'
+    category = keyword_tagger.first_tag('category', found, 'Accessories')
     
     return {
         "item_name": item_name,
@@ -77,130 +67,26 @@ def extract_item_info(analysis_text):
         "style": style_details
     }
 
+def _color_name(found):
+    """Display color for a keyword scan result."""
+    color = keyword_tagger.first_tag('color', found)
+    return color.capitalize() if color else "Unknown"
+
 def extract_color(text_lower):
     """Extract color information from analysis text."""
-    color_keywords = {
-        'black': ['black', 'dark', 'charcoal', 'ebony'],
-        'white': ['white', 'cream', 'ivory', 'off-white'],
-        'blue': ['blue', 'navy', 'royal blue', 'sky blue', 'light blue', 'dark blue', 'powder blue', 'cobalt'],
-        'red': ['red', 'crimson', 'burgundy', 'maroon', 'scarlet', 'cherry'],
-        'green': ['green', 'emerald', 'forest green', 'mint', 'olive', 'sage', 'lime'],
-        'yellow': ['yellow', 'gold', 'mustard', 'lemon', 'amber'],
-        'pink': ['pink', 'rose', 'magenta', 'fuchsia', 'salmon'],
-        'purple': ['purple', 'violet', 'lavender', 'plum', 'mauve'],
-        'orange': ['orange', 'peach', 'coral', 'tangerine', 'apricot'],
-        'brown': ['brown', 'tan', 'beige', 'khaki', 'taupe', 'camel', 'mocha', 'chocolate'],
-        'gray': ['gray', 'grey', 'silver', 'slate', 'ash', 'pewter'],
-        'denim': ['denim', 'jean', 'indigo']
-    }
-    
-    for color, keywords in color_keywords.items():
-        for keyword in keywords:
-            if keyword in text_lower:
-                return color.capitalize()
-    
-    return "Unknown"
+    return _color_name(keyword_tagger.scan(text_lower))
 
 def extract_material(text_lower):
     """Extract material information from analysis text."""
-    material_keywords = {
-        'Cotton': ['cotton', 'cotton blend'],
-        'Wool': ['wool', 'woolen', 'wool blend'],
-        'Silk': ['silk', 'silk blend'],
-        'Denim': ['denim', 'jean'],
-        'Leather': ['leather', 'leather-like'],
-        'Knit': ['knit', 'knitted', 'knitwear'],
-        'Linen': ['linen', 'linen blend'],
-        'Polyester': ['polyester', 'poly blend'],
-        'Cashmere': ['cashmere'],
-        'Velvet': ['velvet', 'velvety'],
-        'Suede': ['suede', 'sueded'],
-        'Chiffon': ['chiffon'],
-        'Satin': ['satin', 'satin-like'],
-        'Mesh': ['mesh', 'net'],
-        'Fleece': ['fleece', 'fleecy']
-    }
-    
-    for material, keywords in material_keywords.items():
-        for keyword in keywords:
-            if keyword in text_lower:
-                return material
-    
-    return "Unknown"
+    return keyword_tagger.first_tag('material', keyword_tagger.scan(text_lower), "Unknown")
 
 def extract_style_details(text_lower):
     """Extract specific style details from analysis text."""
-    style_keywords = {
-        'Striped': ['striped', 'stripes', 'pinstriped'],
-        'Polka Dot': ['polka dot', 'dotted', 'spots'],
-        'Floral': ['floral', 'flower', 'botanical'],
-        'Plaid': ['plaid', 'tartan', 'checkered'],
-        'Solid': ['solid', 'plain'],
-        'Cropped': ['cropped', 'crop'],
-        'Oversized': ['oversized', 'oversize', 'loose'],
-        'Fitted': ['fitted', 'tailored', 'slim'],
-        'Long Sleeve': ['long sleeve', 'long-sleeve'],
-        'Short Sleeve': ['short sleeve', 'short-sleeve'],
-        'Sleeveless': ['sleeveless', 'tank'],
-        'Button-up': ['button-up', 'button up', 'buttoned'],
-        'Hoodie': ['hoodie', 'hooded'],
-        'Turtleneck': ['turtleneck', 'mock neck'],
-        'V-neck': ['v-neck', 'v neck'],
-        'Crew Neck': ['crew neck', 'crew-neck'],
-        'High Waist': ['high waist', 'high-waist'],
-        'Low Rise': ['low rise', 'low-rise'],
-        'Wide Leg': ['wide leg', 'wide-leg'],
-        'Skinny': ['skinny', 'slim fit'],
-        'Bootcut': ['bootcut', 'boot cut'],
-        'Straight': ['straight', 'straight leg'],
-        'A-line': ['a-line', 'a line'],
-        'Pencil': ['pencil', 'pencil skirt'],
-        'Maxi': ['maxi', 'long'],
-        'Mini': ['mini', 'short'],
-        'Midi': ['midi', 'mid-length']
-    }
-    
-    for style, keywords in style_keywords.items():
-        for keyword in keywords:
-            if keyword in text_lower:
-                return style
-    
-    return "Unknown"
+    return keyword_tagger.first_tag('style', keyword_tagger.scan(text_lower), "Unknown")
 
 def extract_item_type(text_lower):
     """Extract specific item type from analysis text."""
-    item_keywords = {
-        'Shirt': ['shirt', 'button-up', 'button up', 'dress shirt', 'blouse'],
-        'T-shirt': ['t-shirt', 'tee', 't shirt'],
-        'Sweater': ['sweater', 'pullover', 'jumper'],
-        'Hoodie': ['hoodie', 'hooded sweatshirt'],
-        'Cardigan': ['cardigan'],
-        'Blazer': ['blazer', 'sport coat'],
-        'Tank Top': ['tank top', 'tank', 'camisole'],
-        'Crop Top': ['crop top', 'crop'],
-        'Jeans': ['jeans', 'denim'],
-        'Pants': ['pants', 'trousers'],
-        'Skirt': ['skirt'],
-        'Shorts': ['shorts'],
-        'Dress': ['dress'],
-        'Jacket': ['jacket', 'coat'],
-        'Sneakers': ['sneakers', 'sneaker', 'athletic shoes'],
-        'Boots': ['boots', 'boot'],
-        'Heels': ['heels', 'high heels', 'pumps'],
-        'Flats': ['flats', 'flat shoes'],
-        'Sandals': ['sandals', 'sandal'],
-        'Bag': ['bag', 'handbag', 'purse', 'tote'],
-        'Hat': ['hat', 'cap'],
-        'Scarf': ['scarf'],
-        'Belt': ['belt']
-    }
-    
-    for item_type, keywords in item_keywords.items():
-        for keyword in keywords:
-            if keyword in text_lower:
-                return item_type
-    
-    return "Item"
+    return keyword_tagger.first_tag('item_type', keyword_tagger.scan(text_lower), "Item")
 
 def get_weather_icon(weather_condition):
     """Get appropriate weather icon based on condition"""
@@ -233,22 +119,20 @@ def get_current_date():
     # Format: "Oct 16" (without year)
     return now.strftime("%b %d")
 
+# Short display names for closet categories
+CATEGORY_DISPLAY_NAMES = {
+    'Dresses': "Dress",
+    'Tops': "Top",
+    'Bottoms': "Bottom",
+    'Shoes': "Shoes",
+    'Outerwear': "Jacket",
+    'Accessories': "Accessory",
+}
+
 def get_category_name(text_lower):
     """Get a simple category name for the item."""
-    if any(word in text_lower for word in ['dress']):
-        return "Dress"
-    elif any(word in text_lower for word in ['blouse', 'top', 'shirt', 't-shirt', 'sweater', 'hoodie', 'tank', 'crop', 'blazer', 'cardigan', 'pullover', 'polo', 'camisole', 'tunic']):
-        return "Top"
-    elif any(word in text_lower for word in ['pants', 'skirt', 'jeans', 'shorts', 'trousers', 'leggings', 'capri', 'cargo', 'chinos']):
-        return "Bottom"
-    elif any(word in text_lower for word in ['shoes', 'sneaker', 'boot', 'sandals', 'loafer', 'heel', 'sneakers', 'boots', 'flats', 'pumps', 'oxfords', 'mules', 'clogs', 'slippers']):
-        return "Shoes"
-    elif any(word in text_lower for word in ['jacket', 'coat', 'blazer', 'cardigan', 'sweater', 'hoodie', 'vest', 'windbreaker', 'trench', 'parka', 'bomber', 'denim jacket', 'leather jacket']):
-        return "Jacket"
-    elif any(word in text_lower for word in ['bag', 'handbag', 'backpack', 'purse', 'tote', 'clutch', 'satchel', 'hat', 'cap', 'scarf', 'belt', 'glove', 'accessory', 'jewelry', 'watch', 'sunglasses', 'necklace', 'bracelet', 'earrings', 'ring']):
-        return "Accessory"
-    else:
-        return "Item"
+    category = keyword_tagger.first_tag('category', keyword_tagger.scan(text_lower))
+    return CATEGORY_DISPLAY_NAMES.get(category, "Item")
 
 def find_similar_outfit_in_collections(outfit_items, collections):
     """Find similar outfit in collections based on item combinations"""
@@ -295,7 +179,7 @@ from generate_visualisation import generate_image, sanitize_prompt
 
 
 # Import new services
-from database import init_database, create_user, get_user_subscription, save_chat_message, get_chat_messages, save_uploaded_image, get_user_images, save_outfit, get_user_outfits
+from database import init_database, release_connections, create_user, get_user_subscription, save_chat_message, get_chat_messages, save_uploaded_image, get_user_images, get_user_images_page, save_outfit, get_user_outfits, item_description
 from weather_service import get_weather_data, get_weather_recommendation, get_weekly_forecast
 from chat_service import process_chat_message, get_recommended_outfits_from_closet
 from payment_service import create_checkout_session, get_subscription_status
@@ -316,6 +200,9 @@ OCCASION_TYPES = [
     'Preppy',      # プレッピー - 清潔感、上品カジュアル
 ]
 
+# Outfits generated by the 5 AM job (also the size of the memoised search each outfit is picked from)
+DAILY_OUTFIT_COUNT = 4
+
 # Load environment variables - prioritize .env.local
 # Get the directory where this app.py file is located
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -349,6 +236,11 @@ def create_app():
     # Initialize database
     init_database()
     
+    # Each request runs on its own thread; hand its connections back to the pool when it ends
+    @app.teardown_appcontext
+    def release_db_connections(exc):
+        release_connections()
+    
     # Add custom Jinja filters
     import json as json_module
     @app.template_filter('from_json')
@@ -558,8 +450,11 @@ def create_app():
         return outfits
     
 
-    def generate_single_outfit(weather=None, outfit_type="manual"):
-        """Generate a single outfit recommendation"""
+    def generate_single_outfit(weather=None, outfit_type="manual", seed=None, index=0, forecast=None):
+        """
+        Generate a single outfit recommendation (the index-th of the outfits picked with `seed`).
+        `forecast` (a get_weather_data dict) filters the closet with the numeric warmth model.
+        """
         vancouver_time = get_vancouver_time()
         timestamp = vancouver_time.strftime("%Y%m%d_%H%M%S")
         output_dir = app.config['OUTPUT_FOLDER']
@@ -573,17 +468,28 @@ def create_app():
             print("Not enough items in closet to generate outfit")
             return None
                     
-        # Select one outfit based on weather
-        criteria = {'weather': weather} if weather else None
+        # Select one outfit based on weather. A caller's seed (the daily job's date) is shared by
+        # its DAILY_OUTFIT_COUNT calls, which reuse one memoised search; without one the timestamp
+        # seeds a one-off search for just the outfits up to `index`, kept out of the memo
+        criteria = {'weather': weather} if weather else {}
+        if forecast:
+            criteria.update({key: forecast[key] for key in ('temperature', 'humidity', 'wind_speed', 'condition')
+                             if forecast.get(key) is not None})
+        criteria = criteria or None
+        one_off = seed is None
+        if one_off:
+            seed = int(timestamp.replace('_', ''))
 
         try:
-            outfit_files_list = select_multiple_outfits(num=1, closet_dir=closet_dir, criteria=criteria)
+            outfit_files_list = select_multiple_outfits(num=index + 1 if one_off else DAILY_OUTFIT_COUNT,
+                                                        closet_dir=closet_dir, criteria=criteria, seed=seed,
+                                                        memoise=not one_off)
 
-            if not outfit_files_list or len(outfit_files_list) == 0:
+            if not outfit_files_list or len(outfit_files_list) <= index:
                 print("No outfits selected")
                 return None
                 
-            files = outfit_files_list[0]
+            files = outfit_files_list[index]
             outfit_key = get_outfit_key(files)
         except Exception as e:
             print(f"Error selecting outfits: {e}")
@@ -724,11 +630,12 @@ def create_app():
         
         print(f"Weather: {weather_condition}, {weather_temp}°C")
         
-        # Generate 4 outfits
+        # Generate 4 outfits (one search seeded by the date, then one outfit per call)
         generated_count = 0
-        for i in range(4):
+        for i in range(DAILY_OUTFIT_COUNT):
             print(f"\nGenerating outfit {i+1}/4...")
-            outfit = generate_single_outfit(weather=weather_condition, outfit_type=f"daily_{today_str}")
+            outfit = generate_single_outfit(weather=weather_condition, outfit_type=f"daily_{today_str}",
+                                            seed=int(today_str), index=i, forecast=weather_data)
             
             if outfit:
                 generated_count += 1
@@ -831,9 +738,19 @@ def create_app():
             
             weather = request.args.get('weather', 'moderate')
             occasion = request.args.get('occasion', 'casual')
+            # Numeric forecast (?temperature=8&humidity=85&wind_speed=20) ranks items with the warmth model
+            forecast = None
+            temperature = request.args.get('temperature', type=float)
+            if temperature is not None:
+                forecast = {
+                    'temperature': temperature,
+                    'humidity': request.args.get('humidity', 60, type=float),
+                    'wind_speed': request.args.get('wind_speed', 10, type=float),
+                    'condition': weather,
+                }
             
             # Get outfit recommendations
-            outfits = get_recommended_outfits_from_closet(user_id, weather, occasion)
+            outfits = get_recommended_outfits_from_closet(user_id, occasion=occasion, weather=weather, forecast=forecast)
             
             return jsonify({
                 'success': True,
@@ -918,43 +835,101 @@ def create_app():
         """Get closet contents with category info from database"""
         try:
             user_id = session.get('user_id', 1)
-            items = get_user_images(user_id)
+            # Keyset pagination: pass back next_cursor as ?cursor= to get the following page.
+            # Optional ?category=Tops&color=Blue filters are applied in SQL
+            try:
+                page = get_user_images_page(
+                    user_id,
+                    cursor=request.args.get('cursor'),
+                    page_size=request.args.get('page_size', 100, type=int),
+                    category=request.args.get('category'),
+                    color=request.args.get('color')
+                )
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            items = page['items']
             
             # Convert database items to the format expected by frontend
+            # (name/category/description come from typed columns, no JSON parsing needed)
             formatted_items = []
             for item in items:
-                try:
-                    analysis = json.loads(item.get('analysis', '{}'))
-                    formatted_items.append({
-                        'id': item.get('id'),
-                        'filename': item.get('filename'),
-                        'original_name': item.get('original_name'),
-                        'image_url': item.get('url'),
-                        'analysis': item.get('analysis'),
-                        'name': analysis.get('item_name', item.get('original_name', 'Clothing Item')),
-                        'category': analysis.get('category', 'Clothing'),
-                        'description': analysis.get('description', 'Clothing item')
-                    })
-                except Exception as e:
-                    # Fallback for items without proper analysis
-                    formatted_items.append({
-                        'id': item.get('id'),
-                        'filename': item.get('filename'),
-                        'original_name': item.get('original_name'),
-                        'image_url': item.get('url'),
-                        'analysis': item.get('analysis'),
-                        'name': item.get('original_name', 'Clothing Item'),
-                        'category': 'Clothing',
-                        'description': 'Clothing item'
-                    })
+                formatted_items.append({
+                    'id': item.get('id'),
+                    'filename': item.get('filename'),
+                    'original_name': item.get('original_name'),
+                    'image_url': item.get('url'),
+                    'analysis': item.get('analysis'),
+                    'name': item.get('item_name') or item.get('original_name') or 'Clothing Item',
+                    'category': item.get('category') or 'Clothing',
+                    'description': item.get('description_excerpt') or 'Clothing item'
+                })
             
             return jsonify({
                 'success': True,
-                'items': formatted_items
+                'items': formatted_items,
+                'next_cursor': page['next_cursor']
             })
         except Exception as e:
             return jsonify({'error': f'Failed to load closet: {str(e)}'}), 500
-    
+
+    @app.route('/debug/db-stats')
+    def debug_db_stats():
+        """Per-statement SQLite timings (only when DB_QUERY_STATS=1 or in debug mode)"""
+        import database
+        if not (database.QUERY_STATS_ENABLED or app.debug):
+            return jsonify({'error': 'Query stats are disabled (set DB_QUERY_STATS=1)'}), 404
+        if request.args.get('reset'):
+            # Anyone can read the stats while DB_QUERY_STATS=1; only debug mode may wipe them
+            if not app.debug:
+                return jsonify({'error': 'Resetting query stats is only allowed in debug mode'}), 403
+            database.reset_query_stats()
+        return jsonify(database.get_query_stats())
+
+    @app.route('/api/closet/stats')
+    def closet_stats():
+        """Category/color counts, item total and latest upload time for the user's closet"""
+        try:
+            from database import get_closet_stats
+            user_id = session.get('user_id', 1)
+            return jsonify({
+                'success': True,
+                'stats': get_closet_stats(user_id)
+            })
+        except Exception as e:
+            return jsonify({'error': f'Failed to load closet stats: {str(e)}'}), 500
+
+    @app.route('/api/closet/search')
+    def search_closet():
+        """Full-text search over the user's closet (?q=wool navy), best matches first"""
+        try:
+            from database import search_user_items
+            user_id = session.get('user_id', 1)
+            query = request.args.get('q', '').strip()
+            if not query:
+                return jsonify({'error': 'Missing search query (?q=)'}), 400
+
+            items = search_user_items(user_id, query, limit=request.args.get('limit', 50, type=int))
+            formatted_items = []
+            for item in items:
+                formatted_items.append({
+                    'id': item.get('id'),
+                    'filename': item.get('filename'),
+                    'original_name': item.get('original_name'),
+                    'image_url': item.get('url'),
+                    'name': item.get('item_name') or item.get('original_name') or 'Clothing Item',
+                    'category': item.get('category') or 'Clothing',
+                    'color': item.get('color'),
+                    'description': item.get('description_excerpt') or 'Clothing item'
+                })
+
+            return jsonify({
+                'success': True,
+                'query': query,
+                'items': formatted_items
+            })
+        except Exception as e:
+            return jsonify({'error': f'Failed to search closet: {str(e)}'}), 500
+
     
     @app.route('/output/<filename>')
     def serve_output(filename):
@@ -1162,7 +1137,8 @@ def create_app():
                         filename=unique_filename,
                         original_name="chat_upload.jpg",
                         url=image_url,
-                        analysis=json.dumps(clothing_info)
+                        analysis=json.dumps(clothing_info),
+                        content_hash=get_image_hash(upload_path)
                     )
                     
                     print(f"✅ Image saved to closet: {unique_filename}")
@@ -1181,9 +1157,7 @@ def create_app():
                         closet_context = "\n\nUser's existing closet items:\n"
                         for item in closet_items_data[-10:]:  # Last 10 items
                             if item.get('analysis'):
-                                import json
-                                analysis = json.loads(item['analysis'])
-                                closet_context += f"- {analysis.get('item_name', 'Item')}: {analysis.get('description', '')}\n"
+                                closet_context += f"- {item.get('item_name') or 'Item'}: {item_description(item)}\n"
                     
                     # Get weather context
                     weather_data = get_weather_data('Vancouver')
@@ -1269,9 +1243,7 @@ Keep response to 3-4 sentences, friendly and actionable."""
                         item_descriptions = []
                         for item in closet_items[:10]:  # Limit to 10 items to avoid token limit
                             if item.get('analysis'):
-                                import json
-                                analysis = json.loads(item['analysis'])
-                                item_desc = f"{analysis.get('item_name', 'Item')} ({analysis.get('category', 'Clothing')})"
+                                item_desc = f"{item.get('item_name') or 'Item'} ({item.get('category') or 'Clothing'})"
                                 item_descriptions.append(item_desc)
                         closet_context += ", ".join(item_descriptions)
                     
@@ -1463,39 +1435,32 @@ Remember: Your goal is to help users look their best while building their confid
             # Create URL path for accessing the image
             image_url = f"/data/clothes/input/{unique_filename}"
             
-            # Duplicate detection: compare hash with existing files
+            # Duplicate detection: one indexed lookup on the stored content hash
+            new_hash = None
             try:
                 new_hash = get_image_hash(upload_path)
-                closet_dir = app.config['UPLOAD_FOLDER']
                 import json
-                from database import get_user_images
+                from database import find_image_by_hash
                 user_id = session.get("user_id", 1)
-                existing = get_user_images(user_id) or []
-                for item in existing:
+                item = find_image_by_hash(user_id, new_hash)
+                if item:
+                    # Duplicate found: remove newly saved file and return duplicate flag
                     try:
-                        # Compare against file content in closet
-                        existing_path = os.path.join(closet_dir, item.get('filename', ''))
-                        if os.path.exists(existing_path):
-                            if get_image_hash(existing_path) == new_hash:
-                                # Duplicate found: remove newly saved file and return duplicate flag
-                                try:
-                                    os.remove(upload_path)
-                                except Exception:
-                                    pass
-                                existing_analysis = {}
-                                if item.get('analysis'):
-                                    try:
-                                        existing_analysis = json.loads(item['analysis'])
-                                    except Exception:
-                                        existing_analysis = {}
-                                return jsonify({
-                                    "success": True,
-                                    "duplicate": True,
-                                    "analysis": existing_analysis,
-                                    "existing_filename": item.get('filename')
-                                })
+                        os.remove(upload_path)
                     except Exception:
-                        continue
+                        pass
+                    existing_analysis = {}
+                    if item.get('analysis'):
+                        try:
+                            existing_analysis = json.loads(item['analysis'])
+                        except Exception:
+                            existing_analysis = {}
+                    return jsonify({
+                        "success": True,
+                        "duplicate": True,
+                        "analysis": existing_analysis,
+                        "existing_filename": item.get('filename')
+                    })
             except Exception as dup_err:
                 print(f"Duplicate check error: {dup_err}")
             
@@ -1539,7 +1504,8 @@ Remember: Your goal is to help users look their best while building their confid
                         filename=unique_filename,
                         original_name=filename,
                         url=image_url,
-                        analysis=json.dumps(clothing_info)
+                        analysis=json.dumps(clothing_info),
+                        content_hash=new_hash
                     )
                     
                     return jsonify({
@@ -1568,7 +1534,8 @@ Remember: Your goal is to help users look their best while building their confid
                         filename=unique_filename,
                         original_name=filename,
                         url=image_url,
-                        analysis=json.dumps(clothing_info)
+                        analysis=json.dumps(clothing_info),
+                        content_hash=new_hash
                     )
                     
                     return jsonify({
@@ -1642,12 +1609,21 @@ Remember: Your goal is to help users look their best while building their confid
         """Get user's collections"""
         try:
             user_id = session.get("user_id", 1)
-            from database import get_user_collections
+            from database import get_user_collections_page
             
-            collections = get_user_collections(user_id)
+            # Keyset pagination: pass back next_cursor as ?cursor= to get the following page
+            try:
+                page = get_user_collections_page(
+                    user_id,
+                    cursor=request.args.get('cursor'),
+                    page_size=request.args.get('page_size', 100, type=int)
+                )
+            except ValueError as e:
+                return jsonify({"success": False, "error": str(e)}), 400
             return jsonify({
                 "success": True,
-                "collections": collections
+                "collections": page['items'],
+                "next_cursor": page['next_cursor']
             })
         except Exception as e:
             return jsonify({
@@ -1902,7 +1878,11 @@ Remember: Your goal is to help users look their best while building their confid
             # Use the standard style_agent which is simpler and proven
             from style_agent import select_multiple_outfits
             criteria = {'weather': weather_condition} if weather_condition else None
-            outfits = select_multiple_outfits(num=1, closet_dir=app.config['UPLOAD_FOLDER'], criteria=criteria)
+            # A fresh seed per request, so each bonus outfit is a new pick; it is never asked for again,
+            # so it stays out of the memo
+            seed = int(datetime.now().strftime('%Y%m%d%H%M%S%f'))
+            outfits = select_multiple_outfits(num=1, closet_dir=app.config['UPLOAD_FOLDER'], criteria=criteria,
+                                              seed=seed, memoise=False)
             
             if not outfits:
                 return jsonify({
@@ -2077,7 +2057,28 @@ Remember: Your goal is to help users look their best while building their confid
             name='Generate daily outfit recommendations',
             replace_existing=True
         )
-        
+
+        # Trim old chat/weather rows and release freed pages before the 5 AM job runs
+        from database import run_retention
+        scheduler.add_job(
+            func=run_retention,
+            trigger=CronTrigger(hour=4, minute=30, timezone='America/Vancouver'),
+            id='db_retention',
+            name='Apply database retention and incremental vacuum',
+            replace_existing=True
+        )
+
+        # Optional nightly online backup (DB_BACKUP_SCHEDULE=1), copied in small steps alongside live traffic
+        if os.getenv('DB_BACKUP_SCHEDULE', '').lower() in ('1', 'true', 'yes'):
+            from database import backup_database
+            scheduler.add_job(
+                func=backup_database,
+                trigger=CronTrigger(hour=4, minute=0, timezone='America/Vancouver'),
+                id='db_backup',
+                name='Back up the database',
+                replace_existing=True
+            )
+
         scheduler.start()
         print("\n" + "=" * 60)
         print("📅 Scheduler started: Daily outfits will be generated at 5:00 AM")
@@ -19,11 +19,12 @@ from dotenv import load_dotenv
 # Import backend functionality
 sys.path.append(os.path.join(os.path.dirname(__file__), 'src'))
 from generate_item import analyze_image, get_image_hash
+import keyword_tagger
 from style_agent import select_outfit, load_closet_txts, select_multiple_outfits
 from generate_visualisation import generate_image, sanitize_prompt
 
 # Import services
-from database import init_database, create_user, get_user_subscription, save_chat_message, get_chat_messages, save_uploaded_image, get_user_images, save_outfit, get_user_outfits
+from database import init_database, release_connections, create_user, get_user_subscription, save_chat_message, get_chat_messages, save_uploaded_image, get_user_images, get_user_images_page, save_outfit, get_user_outfits, item_description
 from weather_service import get_weather_data, get_weather_recommendation, get_weekly_forecast
 from chat_service import process_chat_message, get_recommended_outfits_from_closet
 
@@ -53,6 +54,11 @@ def create_app():
     # Initialize database
     init_database()
     
+    # Each request runs on its own thread; hand its connections back to the pool when it ends
+    @app.teardown_appcontext
+    def release_db_connections(exc):
+        release_connections()
+    
     # Add custom Jinja filters
     import json as json_module
     @app.template_filter('from_json')
@@ -227,39 +233,39 @@ def create_app():
         """Get closet contents with category info from database"""
         try:
             user_id = session.get('user_id', 1)
-            items = get_user_images(user_id)
+            # Keyset pagination: pass back next_cursor as ?cursor= to get the following page.
+            # Optional ?category=Tops&color=Blue filters are applied in SQL
+            try:
+                page = get_user_images_page(
+                    user_id,
+                    cursor=request.args.get('cursor'),
+                    page_size=request.args.get('page_size', 100, type=int),
+                    category=request.args.get('category'),
+                    color=request.args.get('color')
+                )
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            items = page['items']
             
             # Convert database items to the format expected by frontend
+            # (name/category/description come from typed columns, no JSON parsing needed)
             formatted_items = []
             for item in items:
-                try:
-                    analysis = json.loads(item.get('analysis', '{}'))
-                    formatted_items.append({
-                        'id': item.get('id'),
-                        'filename': item.get('filename'),
-                        'original_name': item.get('original_name'),
-                        'image_url': item.get('url'),
-                        'analysis': item.get('analysis'),
-                        'name': analysis.get('item_name', item.get('original_name', 'Clothing Item')),
-                        'category': analysis.get('category', 'Clothing'),
-                        'description': analysis.get('description', 'Clothing item')
-                    })
-                except Exception as e:
-                    # Fallback for items without proper analysis
-                    formatted_items.append({
-                        'id': item.get('id'),
-                        'filename': item.get('filename'),
-                        'original_name': item.get('original_name'),
-                        'image_url': item.get('url'),
-                        'analysis': item.get('analysis'),
-                        'name': item.get('original_name', 'Clothing Item'),
-                        'category': 'Clothing',
-                        'description': 'Clothing item'
-                    })
+                formatted_items.append({
+                    'id': item.get('id'),
+                    'filename': item.get('filename'),
+                    'original_name': item.get('original_name'),
+                    'image_url': item.get('url'),
+                    'analysis': item.get('analysis'),
+                    'name': item.get('item_name') or item.get('original_name') or 'Clothing Item',
+                    'category': item.get('category') or 'Clothing',
+                    'description': item.get('description_excerpt') or 'Clothing item'
+                })
             
             return jsonify({
                 'success': True,
-                'items': formatted_items
+                'items': formatted_items,
+                'next_cursor': page['next_cursor']
             })
         except Exception as e:
             return jsonify({'error': f'Failed to load closet: {str(e)}'}), 500
@@ -380,7 +386,8 @@ def create_app():
                         filename=unique_filename,
                         original_name="chat_upload.jpg",
                         url=image_url,
-                        analysis=json.dumps(clothing_info)
+                        analysis=json.dumps(clothing_info),
+                        content_hash=get_image_hash(upload_path)
                     )
                     
                     print(f"✅ Image saved to closet: {unique_filename}")
@@ -396,9 +403,7 @@ def create_app():
                         closet_context = "\n\nUser's existing closet items:\n"
                         for item in closet_items_data[-10:]:  # Last 10 items
                             if item.get('analysis'):
-                                import json
-                                analysis = json.loads(item['analysis'])
-                                closet_context += f"- {analysis.get('item_name', 'Item')}: {analysis.get('description', '')}\n"
+                                closet_context += f"- {item.get('item_name') or 'Item'}: {item_description(item)}\n"
                     
                     # Get weather context
                     weather_data = get_weather_data('Vancouver')
@@ -483,9 +488,7 @@ Keep response to 3-4 sentences, friendly and actionable."""
                         item_descriptions = []
                         for item in closet_items[:10]:  # Limit to 10 items to avoid token limit
                             if item.get('analysis'):
-                                import json
-                                analysis = json.loads(item['analysis'])
-                                item_desc = f"{analysis.get('item_name', 'Item')} ({analysis.get('category', 'Clothing')})"
+                                item_desc = f"{item.get('item_name') or 'Item'} ({item.get('category') or 'Clothing'})"
                                 item_descriptions.append(item_desc)
                         closet_context += ", ".join(item_descriptions)
                     
@@ -559,11 +562,12 @@ def extract_item_info(analysis_text):
     
     text_lower = analysis_text.lower()
     
-    # Extract detailed features
-    color = extract_color(text_lower)
-    material = extract_material(text_lower)
-    style_details = extract_style_details(text_lower)
-    item_type = extract_item_type(text_lower)
+    # Extract detailed features (one keyword scan shared by every vocabulary)
+    found = keyword_tagger.scan(text_lower)
+    color = _color_name(found)
+    material = keyword_tagger.first_tag('material', found, "Unknown")
+    style_details = keyword_tagger.first_tag('style', found, "Unknown")
+    item_type = keyword_tagger.first_tag('item_type', found, "Item")
     
     # Create a detailed name
     name_parts = []
@@ -586,20 +590,7 @@ def extract_item_info(analysis_text):
         item_name = " ".join(name_parts)
     
     # Determine category
-    if any(word in text_lower for word in ['dress']):
-        category = 'Dresses'
-    elif any(word in text_lower for word in ['blouse', 'top', 'shirt', 't-shirt', 'sweater', 'hoodie', 'tank', 'crop', 'blazer', 'cardigan', 'pullover', 'polo', 'camisole', 'tunic']):
-        category = 'Tops'
-    elif any(word in text_lower for word in ['pants', 'skirt', 'jeans', 'shorts', 'trousers', 'leggings', 'capri', 'cargo', 'chinos']):
-        category = 'Bottoms'
-    elif any(word in text_lower for word in ['shoes', 'sneaker', 'boot', 'sandals', 'loafer', 'heel', 'sneakers', 'boots', 'flats', 'pumps', 'oxfords', 'mules', 'clogs', 'slippers']):
-        category = 'Shoes'
-    elif any(word in text_lower for word in ['jacket', 'coat', 'blazer', 'cardigan', 'sweater', 'hoodie', 'vest', 'windbreaker', 'trench', 'parka', 'bomber', 'denim jacket', 'leather jacket']):
-        category = 'Outerwear'
-    elif any(word in text_lower for word in ['bag', 'handbag', 'backpack', 'purse', 'tote', 'clutch', 'satchel', 'hat', 'cap', 'scarf', 'belt', 'glove', 'accessory', 'jewelry', 'watch', 'sunglasses', 'necklace', 'bracelet', 'earrings', 'ring']):
-        category = 'Accessories'
-    else:
-        category = 'Accessories'
+    category = keyword_tagger.first_tag('category', found, 'Accessories')
     
     return {
         "item_name": item_name,
@@ -608,130 +599,26 @@ def extract_item_info(analysis_text):
         "style": style_details
     }
 
+def _color_name(found):
+    """Display color for a keyword scan result."""
+    color = keyword_tagger.first_tag('color', found)
+    return color.capitalize() if color else "Unknown"
+
 def extract_color(text_lower):
     """Extract color information from analysis text."""
-    color_keywords = {
-        'black': ['black', 'dark', 'charcoal', 'ebony'],
-        'white': ['white', 'cream', 'ivory', 'off-white'],
-        'blue': ['blue', 'navy', 'royal blue', 'sky blue', 'light blue', 'dark blue', 'powder blue', 'cobalt'],
-        'red': ['red', 'crimson', 'burgundy', 'maroon', 'scarlet', 'cherry'],
-        'green': ['green', 'emerald', 'forest green', 'mint', 'olive', 'sage', 'lime'],
-        'yellow': ['yellow', 'gold', 'mustard', 'lemon', 'amber'],
-        'pink': ['pink', 'rose', 'magenta', 'fuchsia', 'salmon'],
-        'purple': ['purple', 'violet', 'lavender', 'plum', 'mauve'],
-        'orange': ['orange', 'peach', 'coral', 'tangerine', 'apricot'],
-        'brown': ['brown', 'tan', 'beige', 'khaki', 'taupe', 'camel', 'mocha', 'chocolate'],
-        'gray': ['gray', 'grey', 'silver', 'slate', 'ash', 'pewter'],
-        'denim': ['denim', 'jean', 'indigo']
-    }
-    
-    for color, keywords in color_keywords.items():
-        for keyword in keywords:
-            if keyword in text_lower:
-                return color.capitalize()
-    
-    return "Unknown"
+    return _color_name(keyword_tagger.scan(text_lower))
 
 def extract_material(text_lower):
     """Extract material information from analysis text."""
-    material_keywords = {
-        'Cotton': ['cotton', 'cotton blend'],
-        'Wool': ['wool', 'woolen', 'wool blend'],
-        'Silk': ['silk', 'silk blend'],
-        'Denim': ['denim', 'jean'],
-        'Leather': ['leather', 'leather-like'],
-        'Knit': ['knit', 'knitted', 'knitwear'],
-        'Linen': ['linen', 'linen blend'],
-        'Polyester': ['polyester', 'poly blend'],
-        'Cashmere': ['cashmere'],
-        'Velvet': ['velvet', 'velvety'],
-        'Suede': ['suede', 'sueded'],
-        'Chiffon': ['chiffon'],
-        'Satin': ['satin', 'satin-like'],
-        'Mesh': ['mesh', 'net'],
-        'Fleece': ['fleece', 'fleecy']
-    }
-    
-    for material, keywords in material_keywords.items():
-        for keyword in keywords:
-            if keyword in text_lower:
-                return material
-    
-    return "Unknown"
+    return keyword_tagger.first_tag('material', keyword_tagger.scan(text_lower), "Unknown")
 
 def extract_style_details(text_lower):
     """Extract specific style details from analysis text."""
-    style_keywords = {
-        'Striped': ['striped', 'stripes', 'pinstriped'],
-        'Polka Dot': ['polka dot', 'dotted', 'spots'],
-        'Floral': ['floral', 'flower', 'botanical'],
-        'Plaid': ['plaid', 'tartan', 'checkered'],
-        'Solid': ['solid', 'plain'],
-        'Cropped': ['cropped', 'crop'],
-        'Oversized': ['oversized', 'oversize', 'loose'],
-        'Fitted': ['fitted', 'tailored', 'slim'],
-        'Long Sleeve': ['long sleeve', 'long-sleeve'],
-        'Short Sleeve': ['short sleeve', 'short-sleeve'],
-        'Sleeveless': ['sleeveless', 'tank'],
-        'Button-up': ['button-up', 'button up', 'buttoned'],
-        'Hoodie': ['hoodie', 'hooded'],
-        'Turtleneck': ['turtleneck', 'mock neck'],
-        'V-neck': ['v-neck', 'v neck'],
-        'Crew Neck': ['crew neck', 'crew-neck'],
-        'High Waist': ['high waist', 'high-waist'],
-        'Low Rise': ['low rise', 'low-rise'],
-        'Wide Leg': ['wide leg', 'wide-leg'],
-        'Skinny': ['skinny', 'slim fit'],
-        'Bootcut': ['bootcut', 'boot cut'],
-        'Straight': ['straight', 'straight leg'],
-        'A-line': ['a-line', 'a line'],
-        'Pencil': ['pencil', 'pencil skirt'],
-        'Maxi': ['maxi', 'long'],
-        'Mini': ['mini', 'short'],
-        'Midi': ['midi', 'mid-length']
-    }
-    
-    for style, keywords in style_keywords.items():
-        for keyword in keywords:
-            if keyword in text_lower:
-                return style
-    
-    return "Unknown"
+    return keyword_tagger.first_tag('style', keyword_tagger.scan(text_lower), "Unknown")
 
 def extract_item_type(text_lower):
     """Extract specific item type from analysis text."""
-    item_keywords = {
-        'Shirt': ['shirt', 'button-up', 'button up', 'dress shirt', 'blouse'],
-        'T-shirt': ['t-shirt', 'tee', 't shirt'],
-        'Sweater': ['sweater', 'pullover', 'jumper'],
-        'Hoodie': ['hoodie', 'hooded sweatshirt'],
-        'Cardigan': ['cardigan'],
-        'Blazer': ['blazer', 'sport coat'],
-        'Tank Top': ['tank top', 'tank', 'camisole'],
-        'Crop Top': ['crop top', 'crop'],
-        'Jeans': ['jeans', 'denim'],
-        'Pants': ['pants', 'trousers'],
-        'Skirt': ['skirt'],
-        'Shorts': ['shorts'],
-        'Dress': ['dress'],
-        'Jacket': ['jacket', 'coat'],
-        'Sneakers': ['sneakers', 'sneaker', 'athletic shoes'],
-        'Boots': ['boots', 'boot'],
-        'Heels': ['heels', 'high heels', 'pumps'],
-        'Flats': ['flats', 'flat shoes'],
-        'Sandals': ['sandals', 'sandal'],
-        'Bag': ['bag', 'handbag', 'purse', 'tote'],
-        'Hat': ['hat', 'cap'],
-        'Scarf': ['scarf'],
-        'Belt': ['belt']
-    }
-    
-    for item_type, keywords in item_keywords.items():
-        for keyword in keywords:
-            if keyword in text_lower:
-                return item_type
-    
-    return "Item"
+    return keyword_tagger.first_tag('item_type', keyword_tagger.scan(text_lower), "Item")
 
 if __name__ == '__main__':
     app = create_app()
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+backup_db.py
+Online backup and verified restore of aistylist.db and, with DB_SHARDED=1, every user shard
+(safe while the app is running)
+
+    python backup_db.py                      # timestamped copy in data/backups
+    python backup_db.py --dest copy.db       # copy to a specific file
+    python backup_db.py --restore copy.db    # integrity-check copy.db, then restore it
+"""
+
+import argparse
+import os
+import sys
+
+import database
+
+def main():
+    """Main function"""
+    parser = argparse.ArgumentParser(description='Back up or restore the AIstylist database.')
+    parser.add_argument('--dest', help='Backup file to write (default: timestamped file in data/backups)')
+    parser.add_argument('--restore', metavar='BACKUP', help='Verify BACKUP and copy it over the live database')
+    parser.add_argument('--pages', type=int, default=database.BACKUP_PAGES_PER_STEP, help='Pages copied per step')
+    parser.add_argument('--sleep', type=float, default=database.BACKUP_STEP_SLEEP, help='Seconds to pause between steps')
+    args = parser.parse_args()
+
+    try:
+        if args.restore:
+            database.restore_database(args.restore)
+        else:
+            result = database.backup_database(args.dest, pages_per_step=args.pages, sleep=args.sleep)
+            problems = database.check_integrity(result['path'])
+            if not problems and result['shards']:
+                shards_dir = database.shard_backup_dir(result['path'])
+                for root, _, names in os.walk(shards_dir):
+                    problems += [p for name in names for p in database.check_integrity(os.path.join(root, name))]
+            if problems:
+                print(f"❌ Backup failed integrity check: {problems[:5]}")
+                return 1
+            print(f"✅ Backup OK: {result['bytes']:,} bytes, {result['pages']} pages, "
+                  f"{result['shards']} shards in {result['seconds']}s")
+    except Exception as e:
+        print(f"❌ {e}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
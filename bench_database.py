@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+bench_database.py
+Micro-benchmarks for database.py (runs against a throwaway database file)
+"""
+
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import database
+
+THREADS = 8            # Roughly what the threaded Flask dev server runs under load
+CALLS_PER_THREAD = 500
+SEED_IMAGES = 200
+BATCH_ROWS = 10000
+
+def setup_database():
+    """Point database.py at a fresh temporary file and seed one user's closet"""
+    tmp_dir = tempfile.mkdtemp(prefix='aistylist_bench_')
+    database.DB_PATH = os.path.join(tmp_dir, 'bench.db')
+    database.init_database()
+    for i in range(SEED_IMAGES):
+        database.save_uploaded_image(1, f"item_{i}.jpg", f"item_{i}.jpg", f"/data/clothes/input/item_{i}.jpg", '{}')
+    return tmp_dir
+
+def per_call_request(i):
+    """Old behaviour: open, query and close a brand-new connection for every helper call"""
+    conn = database.get_db_connection()
+    if i % 10 == 0:
+        conn.execute('INSERT INTO chat_messages (user_id, message, reply) VALUES (?, ?, ?)', (1, 'hi', 'hello'))
+        conn.commit()
+    else:
+        conn.execute('SELECT * FROM uploaded_images WHERE user_id = ? ORDER BY created_at DESC LIMIT 100', (1,)).fetchall()
+    conn.close()
+
+def pooled_request(i):
+    """New behaviour: reuse the thread's connection through the transaction API"""
+    if i % 10 == 0:
+        database.save_chat_message(1, 'hi', 'hello')
+    else:
+        database.get_user_images(1)
+
+def run(label, func):
+    total = THREADS * CALLS_PER_THREAD
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=THREADS) as pool:
+        list(pool.map(func, range(total)))
+    elapsed = time.perf_counter() - start
+    print(f"{label:<22} {total} calls in {elapsed:.3f}s  ({total / elapsed:,.0f} calls/s)")
+    return elapsed
+
+def bench_connections():
+    """Connection-per-call vs pooled thread-local connections under concurrent threads"""
+    print(f"=== Connection benchmark ({THREADS} threads, 90% reads / 10% writes) ===")
+    per_call = run('connection-per-call', per_call_request)
+    pooled = run('pooled (thread-local)', pooled_request)
+    print(f"Speedup: {per_call / pooled:.1f}x")
+
+REQUEST_THREADS = 2000
+
+def thread_per_request(label, func, release):
+    """Run each call on a brand-new thread, THREADS at a time, like app.run(threaded=True)"""
+    slots = threading.Semaphore(THREADS)
+    def request(i):
+        try:
+            func(i)
+            if release:
+                database.release_connections()  # What the Flask teardown does
+        finally:
+            slots.release()
+    threads = []
+    start = time.perf_counter()
+    for i in range(REQUEST_THREADS):
+        slots.acquire()
+        thread = threading.Thread(target=request, args=(i,))
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<22} {REQUEST_THREADS} requests in {elapsed:.3f}s  ({REQUEST_THREADS / elapsed:,.0f} requests/s)")
+    return elapsed
+
+def bench_request_threads():
+    """A new thread per request: thread-local connections alone vs returned to the idle pool at teardown"""
+    print(f"\n=== Thread-per-request benchmark ({THREADS} concurrent requests, 90% reads / 10% writes) ===")
+    per_call = thread_per_request('connection-per-call', per_call_request, release=False)
+    thread_local = thread_per_request('thread-local only', pooled_request, release=False)
+    database.close_idle_connections()
+    released = thread_per_request('idle pool (teardown)', pooled_request, release=True)
+    print(f"Speedup: {per_call / released:.1f}x vs per-call, {thread_local / released:.1f}x vs thread-local only")
+
+def bench_batch_insert():
+    """One commit per row vs *_many helpers (executemany in a single transaction)"""
+    print(f"\n=== Bulk insert benchmark ({BATCH_ROWS:,} chat messages) ===")
+    start = time.perf_counter()
+    for i in range(BATCH_ROWS):
+        database.save_chat_message(2, f"message {i}", f"reply {i}")
+    per_row = time.perf_counter() - start
+    print(f"{'commit per row':<22} {per_row:.3f}s  ({BATCH_ROWS / per_row:,.0f} rows/s)")
+    
+    messages = [{'user_id': 3, 'message': f"message {i}", 'reply': f"reply {i}"} for i in range(BATCH_ROWS)]
+    start = time.perf_counter()
+    database.save_chat_messages_many(messages)
+    batched = time.perf_counter() - start
+    print(f"{'save_*_many':<22} {batched:.3f}s  ({BATCH_ROWS / batched:,.0f} rows/s)")
+    
+    start = time.perf_counter()
+    with database.batch():
+        for i in range(BATCH_ROWS):
+            database.save_chat_message(4, f"message {i}", f"reply {i}")
+    deferred = time.perf_counter() - start
+    print(f"{'batch() context':<22} {deferred:.3f}s  ({BATCH_ROWS / deferred:,.0f} rows/s)")
+    print(f"Speedup: {per_row / batched:.1f}x (executemany), {per_row / deferred:.1f}x (batch)")
+
+def sharded_writer(user_id):
+    """One user's burst of chat writes, then release the thread's connections"""
+    for i in range(CALLS_PER_THREAD):
+        database.save_chat_message(user_id, f"message {i}", f"reply {i}")
+    database.close_connection()
+
+def bench_sharding():
+    """Concurrent writes from different users: one shared file vs one shard per user"""
+    print(f"\n=== Sharding benchmark ({THREADS} users writing concurrently, commit per message) ===")
+    users = range(100, 100 + THREADS)
+    results = {}
+    for label, sharded in (('single file', False), ('per-user shards', True)):
+        database.SHARDED = sharded
+        database.SHARD_DIR = tempfile.mkdtemp(prefix='aistylist_bench_shards_')
+        for user_id in users:
+            database.get_connection(user_id)  # Create shard schemas outside the timed section
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=THREADS) as pool:
+            list(pool.map(sharded_writer, users))
+        results[label] = time.perf_counter() - start
+        total = THREADS * CALLS_PER_THREAD
+        print(f"{label:<22} {total} writes in {results[label]:.3f}s  ({total / results[label]:,.0f} writes/s)")
+    database.SHARDED = False
+    print(f"Speedup: {results['single file'] / results['per-user shards']:.1f}x")
+
+COMPRESSION_ROWS = 5000
+SAMPLE_REPLY = (
+    "I'd suggest pairing your navy wool blazer with the cream chinos and white leather sneakers for a "
+    "smart-casual look. This would work well because the neutral base lets the navy stand out, and the "
+    "sneakers keep it relaxed enough for a weekend brunch. If it gets chilly, layer the grey merino crewneck "
+    "underneath. Avoid the black jeans here; they fight with the navy. "
+)
+
+COMPRESSION_THRESHOLDS = (512, 1024, 2048, 4096)
+
+def bench_compression():
+    """On-disk size and read throughput per COMPRESS_MIN_CHARS threshold, for mixed-length replies/analyses"""
+    print(f"\n=== Compression benchmark ({COMPRESSION_ROWS:,} chat replies + closet analyses, "
+          f"{len(SAMPLE_REPLY)}-{len(SAMPLE_REPLY) * 8} chars) ===")
+    # Mostly short-to-medium text with a tail of long ones
+    rng = random.Random(0)
+    repeats = [rng.choice([1, 1, 2, 2, 3, 4, 6, 8]) for _ in range(COMPRESSION_ROWS)]
+    results = {}
+    min_chars = database.COMPRESS_MIN_CHARS
+    for label, threshold in [('uncompressed', 10 ** 9)] + [(f"min {t:,} chars", t) for t in COMPRESSION_THRESHOLDS]:
+        database.COMPRESS_MIN_CHARS = threshold
+        database.DB_PATH = os.path.join(tempfile.mkdtemp(prefix='aistylist_bench_'), 'bench.db')
+        database.init_database()
+        database.save_chat_messages_many([
+            {'user_id': 1, 'message': f"question {i}", 'reply': f"{i}: " + SAMPLE_REPLY * n} for i, n in enumerate(repeats)
+        ])
+        database.save_uploaded_images_many([
+            {'user_id': 1, 'filename': f"item_{i}.jpg", 'original_name': f"item_{i}.jpg", 'url': '',
+             'analysis': json.dumps({'item_name': f"Item {i}", 'category': 'Tops', 'description': SAMPLE_REPLY * n})}
+            for i, n in enumerate(repeats)
+        ])
+        database.get_connection().execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        size = os.path.getsize(database.DB_PATH)
+        
+        start = time.perf_counter()
+        rows = 0
+        for _ in range(20):
+            rows += len(database.get_chat_messages_page(1, page_size=database.MAX_PAGE_SIZE)['items'])
+            rows += len(database.get_user_images(1, limit=database.MAX_PAGE_SIZE))
+        elapsed = time.perf_counter() - start
+        results[label] = (size, rows / elapsed)
+        base_size, base_rate = results['uncompressed']
+        print(f"{label:<22} {size / 1024 / 1024:6.2f} MB on disk ({base_size / size:.1f}x smaller), "
+              f"{rows / elapsed:,.0f} rows/s read ({rows / elapsed / base_rate:.0%} of uncompressed)")
+    database.COMPRESS_MIN_CHARS = min_chars
+
+def main():
+    setup_database()
+    bench_connections()
+    bench_request_threads()
+    bench_batch_insert()
+    bench_sharding()
+    bench_compression()
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+bench_style_agent.py
+Micro-benchmarks for the closet tagging and outfit selection code in src/ (synthetic closets, no API calls)
+"""
+
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), 'src'))
+
+import keyword_tagger
+import style_agent
+
+TAGGED_DESCRIPTIONS = 100000
+
+GARMENTS = ['dress', 'blouse', 't-shirt', 'sweater', 'hoodie', 'tank top', 'cardigan', 'jeans', 'pencil skirt',
+            'trousers', 'shorts', 'ankle boots', 'sneakers', 'loafers', 'sandals', 'trench coat', 'denim jacket',
+            'parka', 'leather tote bag', 'wool scarf', 'baseball cap', 'belt']
+COLORS = ['black', 'off-white', 'navy', 'sky blue', 'burgundy', 'forest green', 'mustard', 'blush pink', 'lavender',
+          'camel', 'charcoal', 'heather grey', 'olive', 'coral']
+FABRICS = ['cotton', 'linen blend', 'merino wool', 'silk', 'denim', 'faux leather', 'chunky knit', 'polyester',
+           'cashmere', 'fleece', 'satin', 'nylon']
+DETAILS = ['with a relaxed fit', 'with long sleeves', 'with short sleeves', 'in a cropped cut', 'with a v-neck',
+           'with a high waist', 'in a wide leg', 'with a floral print', 'with thin stripes', 'in a slim fit',
+           'with a button-up front', 'that is lightweight and breathable', 'that is thick and warm']
+
+def synthetic_descriptions(count, seed=0):
+    """Closet-analysis-like descriptions built from a fixed vocabulary, each with a unique reference"""
+    rng = random.Random(seed)
+    return [
+        f"This item is a {rng.choice(COLORS)} {rng.choice(FABRICS)} {rng.choice(GARMENTS)} "
+        f"{rng.choice(DETAILS)}. The fabric appears {rng.choice(['soft', 'structured', 'smooth'])} and the "
+        f"piece is {rng.choice(DETAILS)}. Reference sku-{i:06d}, suited to {rng.choice(['casual', 'office', 'evening'])} wear."
+        for i in range(count)
+    ]
+
+def legacy_tags(text_lower):
+    """Old behaviour: one if/elif chain of `keyword in text` loops per classifier"""
+    result = {}
+    for name, vocab in keyword_tagger.VOCABULARIES.items():
+        result[name] = None
+        for tag, keywords in vocab.items():
+            if any(keyword in text_lower for keyword in keywords):
+                result[name] = tag
+                break
+    return result
+
+def tagger_tags(text_lower):
+    """New behaviour: one scan, then each vocabulary resolved from the keyword set"""
+    found = keyword_tagger.scan(text_lower)
+    return {name: keyword_tagger.first_tag(name, found) for name in keyword_tagger.VOCABULARIES}
+
+def bench_tagger():
+    """First tag of every vocabulary (category, colors, material, style, item type, weather) per description"""
+    print(f"=== Keyword tagging benchmark ({TAGGED_DESCRIPTIONS:,} synthetic descriptions, "
+          f"{len(keyword_tagger.VOCABULARIES)} vocabularies) ===")
+    texts = [text.lower() for text in synthetic_descriptions(TAGGED_DESCRIPTIONS)]
+    results = {}
+    outputs = {}
+    for label, func in (('if/elif keyword chains', legacy_tags), ('single-pass tagger', tagger_tags)):
+        start = time.perf_counter()
+        outputs[label] = [func(text) for text in texts]
+        results[label] = time.perf_counter() - start
+        print(f"{label:<24} {results[label]:.3f}s  ({TAGGED_DESCRIPTIONS / results[label]:,.0f} descriptions/s)")
+    assert outputs['if/elif keyword chains'] == outputs['single-pass tagger'], "tagger disagrees with the keyword chains"
+    print(f"Speedup: {results['if/elif keyword chains'] / results['single-pass tagger']:.1f}x (identical tags)")
+
+SCORING_CLOSET_SIZES = (1000, 10000, 100000)
+
+def synthetic_closet(count, seed=0):
+    """Indexed closet items (as load_closet_txts returns them) for synthetic descriptions"""
+    return [dict(style_agent.describe_item(desc), file=f"item_{i}.txt", desc=desc)
+            for i, desc in enumerate(synthetic_descriptions(count, seed))]
+
+def legacy_color_harmony(colors1, colors2):
+    """Old behaviour: nested loops over both color lists with HARMONY_RULES lookups"""
+    score = 0
+    for color1 in colors1:
+        for color2 in colors2:
+            if color1 == color2:
+                score += 3
+            elif color2 in style_agent.HARMONY_RULES.get(color1, []):
+                score += 2
+            else:
+                score += 0.5
+    return score
+
+def legacy_select(candidates, outfit_items, category):
+    """Old behaviour: re-extract colors and walk nested harmony loops for every candidate, then sort"""
+    scored = []
+    for item in candidates:
+        score = 0
+        for outfit_item in outfit_items:
+            score += legacy_color_harmony(style_agent.extract_colors(item['desc']),
+                                          style_agent.extract_colors(outfit_item['desc']))
+        if category == 'Tops':
+            if any(word in item['desc'].lower() for word in ['basic', 'solid', 'neutral', 'white', 'black', 'gray']):
+                score += 2
+            if any(word in item['desc'].lower() for word in ['tank', 'camisole', 't-shirt', 'blouse']):
+                score += 1
+        scored.append((item, score))
+    scored.sort(key=lambda x: x[1], reverse=True)
+    top = scored[:3]
+    return random.choices([item for item, _ in top], weights=[max(0.1, score) for _, score in top])[0]
+
+def bench_coordination():
+    """Cost of scoring every candidate against a 3-item outfit and picking from the top 3"""
+    print("\n=== Coordination scoring benchmark (one selection, 3-item outfit, 'Tops' slot) ===")
+    for size in SCORING_CLOSET_SIZES:
+        items = synthetic_closet(size)
+        items_by_file = {item['file']: item for item in items}
+        outfit = [item['file'] for item in items[:3]]
+        rounds = max(1, 10000 // size)
+        start = time.perf_counter()
+        for _ in range(rounds):
+            legacy_select(items, items[:3], 'Tops')
+        legacy = (time.perf_counter() - start) / rounds
+        rounds = max(3, 100000 // size)
+        start = time.perf_counter()
+        for _ in range(rounds):
+            scores = style_agent.coordination_scores(items, outfit, 'Tops', items_by_file)
+            style_agent.pick_top(items, scores, random)
+        vectorized = (time.perf_counter() - start) / rounds
+        print(f"{size:>7,} items   per-item loops {legacy * 1000:9.2f} ms   "
+              f"vectorized {vectorized * 1000:7.2f} ms   ({legacy / vectorized:.0f}x)")
+
+SEARCH_CLOSET_SIZES = (500, 2000, 10000)
+SEARCH_OUTFITS = 4
+
+def greedy_outfit(items_by_category, used_items):
+    """Old select_balanced_outfit: one coordinated pick per category, then fill up to 4 items"""
+    outfit = []
+    for category in ['Dresses', 'Tops', 'Bottoms', 'Shoes', 'Outerwear', 'Accessories']:
+        category_items = [item for item in items_by_category.get(category, []) if item['file'] not in used_items]
+        if not category_items or (category == 'Dresses' and outfit):
+            continue
+        outfit.append(legacy_select(category_items, outfit, category) if outfit else random.choice(category_items))
+        if category == 'Dresses':
+            break
+    taken = set(used_items) | {item['file'] for item in outfit}
+    all_available = [item for items in items_by_category.values() for item in items if item['file'] not in taken]
+    while len(outfit) < 4 and all_available:
+        selected = legacy_select(all_available, outfit, 'Any')
+        outfit.append(selected)
+        all_available.remove(selected)
+    return [item['file'] for item in outfit]
+
+def greedy_outfits(items_by_category, num):
+    """Old behaviour: greedy assembly repeatedly, burning used items"""
+    outfits = []
+    used = set()
+    for _ in range(num):
+        outfit = greedy_outfit(items_by_category, used)
+        if not outfit:
+            break
+        outfits.append(outfit)
+        used.update(outfit)
+    return outfits
+
+def bench_outfit_search():
+    """Greedy random assembly vs top-K beam search: time for 4 outfits and their mean whole-outfit score"""
+    print(f"\n=== Outfit search benchmark ({SEARCH_OUTFITS} outfits per request) ===")
+    for size in SEARCH_CLOSET_SIZES:
+        items = synthetic_closet(size, seed=1)
+        items_by_file = {item['file']: item for item in items}
+        items_by_category = {}
+        for item in items:
+            items_by_category.setdefault(item['category'], []).append(item)
+        per_category = max(len(group) for group in items_by_category.values())
+        for label, func in (('greedy', lambda: greedy_outfits(items_by_category, SEARCH_OUTFITS)),
+                            ('beam search', lambda: [result['files'] for result in style_agent.search_outfits(
+                                items_by_category, k=SEARCH_OUTFITS)])):
+            start = time.perf_counter()
+            outfits = func()
+            elapsed = time.perf_counter() - start
+            mean_score = sum(style_agent.score_outfit([items_by_file[name] for name in outfit])
+                             for outfit in outfits) / max(1, len(outfits))
+            print(f"{size:>6,} items ({per_category:>5,} max/category)  {label:<12} {elapsed * 1000:8.1f} ms  "
+                  f"mean outfit score {mean_score:5.1f}")
+
+ASSEMBLY_CLOSET_SIZE = 10000
+ASSEMBLY_OUTFITS = 8
+
+def legacy_item_description(item_file, items_by_category):
+    """Old get_item_description: a linear scan of every category list"""
+    for category_items in items_by_category.values():
+        for item in category_items:
+            if item['file'] == item_file:
+                return item['desc']
+    return ""
+
+def legacy_layering(outfit, items_by_category, used_items, weather, rng):
+    """Old add_layering_items: a linear description lookup per outfit file and per base-layer candidate"""
+    if not (weather in ['cold', 'cool', 'chilly'] or
+            any(word in ' '.join(outfit).lower() for word in style_agent.LAYER_WORDS)):
+        return outfit.copy()
+    items_by_file = {item['file']: item for items in items_by_category.values() for item in items}
+    for item_file in outfit:
+        item_desc = legacy_item_description(item_file, items_by_category)
+        if not any(word in item_desc.lower() for word in style_agent.LAYER_WORDS):
+            continue
+        candidates = []
+        for item in items_by_category.get('Tops', []):
+            if (item['file'] not in used_items and item['file'] not in outfit
+                    and any(word in item['desc'].lower() for word in style_agent.BASE_LAYER_WORDS)):
+                outer_desc = legacy_item_description(item_file, items_by_category)
+                outer_mask = style_agent.colors_to_mask(style_agent.extract_colors(outer_desc))
+                if style_agent.coordinates_well([style_agent.colors_to_mask(style_agent.extract_colors(item['desc']))],
+                                                outer_mask)[0]:
+                    candidates.append(item)
+        if candidates:
+            scores = style_agent.coordination_scores(candidates, outfit, 'Tops', items_by_file)
+            return [style_agent.pick_top(candidates, scores, rng)['file']] + outfit
+    return outfit.copy()
+
+def bench_assembly():
+    """Layering search results at 10k items: linear scans vs the AssemblyIndex (same seed, so the same outfits)"""
+    print(f"\n=== Outfit assembly benchmark ({ASSEMBLY_CLOSET_SIZE:,} items, {ASSEMBLY_OUTFITS} outfits, cold weather) ===")
+    # Separates only, so outfits are built from tops and bottoms and the layering step runs
+    items_by_category = {}
+    for item in synthetic_closet(ASSEMBLY_CLOSET_SIZE, seed=2):
+        if item['category'] != 'Dresses':
+            items_by_category.setdefault(item['category'], []).append(item)
+    # Sweaters and cardigans as the searched tops, so every outfit needs a base layer
+    searched = dict(items_by_category, Tops=[item for item in items_by_category['Tops']
+                                             if any(word in item['text'] for word in style_agent.LAYER_WORDS)])
+    results = style_agent.search_outfits(searched, k=ASSEMBLY_OUTFITS)
+    start = time.perf_counter()
+    index = style_agent.AssemblyIndex(items_by_category)
+    build = time.perf_counter() - start
+    timings = {}
+    outputs = {}
+    for label in ('linear scans', 'assembly index'):
+        rng = random.Random(5)
+        used = set()
+        outfits = []
+        start = time.perf_counter()
+        for result in results:
+            if label == 'linear scans':
+                outfit = legacy_layering(result['files'], items_by_category, used, 'cold', rng)
+            else:
+                outfit = style_agent.add_layering_items(result['files'], items_by_category, used, 'cold', rng=rng, index=index)
+            used.update(outfit[:len(outfit) - len(result['files'])])
+            outfits.append(outfit)
+        timings[label] = time.perf_counter() - start
+        outputs[label] = outfits
+        layered = sum(len(outfit) > len(result['files']) for outfit, result in zip(outfits, results))
+        print(f"{label:<16} {timings[label] * 1000:9.1f} ms  ({timings[label] * 1000 / len(results):.2f} ms/outfit, "
+              f"{layered}/{len(results)} layered)")
+    assert outputs['linear scans'] == outputs['assembly index'], "indexed assembly picked different outfits"
+    print(f"Index build {build * 1000:.1f} ms (once per request); "
+          f"speedup {timings['linear scans'] / timings['assembly index']:.0f}x (identical outfits)")
+
+FORECAST_CLOSET_SIZE = 100000
+FORECASTS = [
+    ('cold', {'temperature': 2, 'humidity': 70, 'wind_speed': 30, 'condition': 'Light rain'}),
+    ('warm', {'temperature': 31, 'humidity': 80, 'wind_speed': 5, 'condition': 'Sunny'}),
+]
+
+def bench_forecast_filter():
+    """Per-call weather filtering of a large closet: keyword rescans vs the indexed numeric warmth model"""
+    print(f"\n=== Weather filter benchmark ({FORECAST_CLOSET_SIZE:,} items) ===")
+    items = synthetic_closet(FORECAST_CLOSET_SIZE, seed=3)
+    raw = [{'file': item['file'], 'desc': item['desc'], 'category': item['category']} for item in items]
+    for weather, forecast in FORECASTS:
+        start = time.perf_counter()
+        kept = style_agent.filter_by_weather(raw, weather)
+        keywords = time.perf_counter() - start
+        start = time.perf_counter()
+        ranked = style_agent.filter_by_forecast(items, forecast)
+        numeric = time.perf_counter() - start
+        print(f"{weather:<5} keyword rescan {keywords * 1e6 / len(items):6.2f} us/item ({len(kept):,} kept)   "
+              f"numeric model {numeric * 1e6 / len(items):5.2f} us/item ({len(ranked):,} kept, ranked)")
+
+def main():
+    bench_tagger()
+    bench_coordination()
+    bench_outfit_search()
+    bench_assembly()
+    bench_forecast_filter()
+
+if __name__ == "__main__":
+    sys.exit(main())
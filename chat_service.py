@@ -4,9 +4,34 @@ Handles chat message processing and outfit recommendations
 """
 
 import os
-import json
+import sys
+import copy
+import threading
+from collections import OrderedDict
 from typing import List, Dict, Any, Optional
-from database import save_chat_message, get_chat_messages, get_user_images
+from database import save_chat_message, save_chat_messages_many, get_chat_messages, get_user_images, get_closet_stats, get_closet_version, item_description, BackgroundWriter, add_restore_listener
+
+sys.path.append(os.path.join(os.path.dirname(__file__), 'src'))
+from style_agent import filter_by_forecast, forecast_targets, clear_recommendation_cache
+
+# CHAT_WRITE_BEHIND=1 returns replies without waiting for the chat_messages commit;
+# a background thread saves them in batches (they show up in history a few ms later)
+_chat_writer = None
+if os.getenv('CHAT_WRITE_BEHIND', '').lower() in ('1', 'true', 'yes'):
+    _chat_writer = BackgroundWriter(save_chat_messages_many, name='chat-writer')
+
+# /api/outfits results keyed by (user_id, closet version, forecast targets); a closet change bumps the version
+OUTFIT_MEMO_MAX_ENTRIES = 256
+_outfit_memo = OrderedDict()
+_outfit_memo_lock = threading.Lock()
+_outfit_memo_stats = {'hits': 0, 'misses': 0}
+
+def _persist_chat_message(user_id: int, message: str, reply: str, message_type: str = 'text') -> None:
+    """Save a chat exchange, through the write-behind queue when it is enabled"""
+    if _chat_writer is not None:
+        _chat_writer.submit({'user_id': user_id, 'message': message, 'reply': reply, 'message_type': message_type})
+    else:
+        save_chat_message(user_id, message, reply, message_type)
 
 def process_chat_message(user_id: int, message: str, message_type: str = 'text') -> str:
     """Process chat message and return AI response"""
@@ -15,14 +40,16 @@ def process_chat_message(user_id: int, message: str, message_type: str = 'text')
         closet_items = get_user_images(user_id, limit=10)
         closet_context = ""
         if closet_items:
-            closet_context = "\n\nUser's closet items:\n"
+            # Whole-closet summary from the cached SQL aggregate; the 10 newest items are listed below it
+            stats = get_closet_stats(user_id)
+            summary = ', '.join(f"{count} {category}" for category, count in stats['categories'].items())
+            closet_context = f"\n\nUser's closet ({stats['total_items']} items: {summary})\n"
+            closet_context += "Recent items:\n"
             for item in closet_items:
-                if item.get('analysis'):
-                    try:
-                        analysis = json.loads(item['analysis'])
-                        closet_context += f"- {analysis.get('item_name', 'Item')}: {analysis.get('description', '')}\n"
-                    except:
-                        closet_context += f"- {item.get('original_name', 'Item')}\n"
+                if item.get('item_name'):
+                    closet_context += f"- {item['item_name']}: {item_description(item)}\n"
+                elif item.get('analysis'):
+                    closet_context += f"- {item.get('original_name', 'Item')}\n"
         
         # Get recent chat history for context
         recent_messages = get_chat_messages(user_id, limit=5)
@@ -69,7 +96,7 @@ Guidelines:
                 print(f"✅ Chat response received: {reply[:50]}...")
                 
                 # Save the conversation
-                save_chat_message(user_id, message, reply, message_type)
+                _persist_chat_message(user_id, message, reply, message_type)
                 return reply
                 
             except Exception as e:
@@ -79,15 +106,71 @@ Guidelines:
         
         # Final fallback
         fallback_reply = "I'm here to help with your fashion questions! Feel free to ask about styling advice, outfit coordination, or anything fashion-related."
-        save_chat_message(user_id, message, fallback_reply, message_type)
+        _persist_chat_message(user_id, message, fallback_reply, message_type)
         return fallback_reply
         
     except Exception as e:
         print(f"Chat processing error: {e}")
         return "I'm sorry, I'm having trouble processing your message right now. Please try again!"
 
-def get_recommended_outfits_from_closet(user_id: int, occasion: str = None, weather: str = None) -> List[Dict[str, Any]]:
-    """Get outfit recommendations based on user's closet items"""
+def get_recommended_outfits_from_closet(user_id: int, occasion: str = None, weather: str = None,
+                                        forecast: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    """
+    Get outfit recommendations based on user's closet items (memoised until the closet changes).
+    `occasion` and `weather` do not change the result; a `forecast` (temperature, humidity, wind_speed, condition) drops items unsuited to it and
+    pairs the best-fitting ones first.
+    """
+    try:
+        version = get_closet_version(user_id)
+    except Exception as e:
+        print(f"Outfit recommendation cache error: {e}")
+        return _build_recommended_outfits(user_id, forecast)
+    targets = None
+    if forecast:
+        targets = forecast_targets(forecast)
+        targets = (targets['warmth'], targets['wet'], targets['muggy'])
+    # occasion and weather are accepted for the API but not used to build outfits, so they stay out of the key
+    key = (user_id, version, targets)
+    with _outfit_memo_lock:
+        outfits = _outfit_memo.get(key)
+        if outfits is not None:
+            _outfit_memo.move_to_end(key)
+            _outfit_memo_stats['hits'] += 1
+            return copy.deepcopy(outfits)
+        _outfit_memo_stats['misses'] += 1
+    
+    outfits = _build_recommended_outfits(user_id, forecast)
+    if outfits:
+        with _outfit_memo_lock:
+            _outfit_memo[key] = copy.deepcopy(outfits)
+            _outfit_memo.move_to_end(key)
+            while len(_outfit_memo) > OUTFIT_MEMO_MAX_ENTRIES:
+                _outfit_memo.popitem(last=False)
+    return outfits
+
+def clear_outfit_recommendation_cache() -> None:
+    """Forget memoised outfit recommendations"""
+    with _outfit_memo_lock:
+        _outfit_memo.clear()
+
+# A restore rewinds closet versions, so entries for the same version may describe a newer closet
+add_restore_listener(clear_outfit_recommendation_cache)
+add_restore_listener(clear_recommendation_cache)
+
+def get_outfit_recommendation_cache_stats() -> Dict[str, Any]:
+    """Hit/miss counters for memoised closet outfit recommendations"""
+    with _outfit_memo_lock:
+        hits = _outfit_memo_stats['hits']
+        misses = _outfit_memo_stats['misses']
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / (hits + misses) if hits + misses else 0.0,
+            'entries': len(_outfit_memo)
+        }
+
+def _build_recommended_outfits(user_id: int, forecast: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    """Pair the user's newest tops and bottoms (best forecast fit first), adding shoes and accessories"""
     try:
         # Get user's closet items
         closet_items = get_user_images(user_id, limit=20)
@@ -95,6 +178,12 @@ def get_recommended_outfits_from_closet(user_id: int, occasion: str = None, weat
         if not closet_items:
             return []
         
+        if forecast:
+            # Scored from the analysis text; unsuitable items drop out, the rest keep fit order
+            ranked = filter_by_forecast([{'desc': item['analysis'], 'item': item}
+                                         for item in closet_items if item.get('analysis')], forecast)
+            closet_items = [entry['item'] for entry in ranked]
+        
         # Analyze items and create outfit combinations
         outfits = []
         
@@ -106,32 +195,30 @@ def get_recommended_outfits_from_closet(user_id: int, occasion: str = None, weat
         
         for item in closet_items:
             if item.get('analysis'):
-                try:
-                    analysis = json.loads(item['analysis'])
-                    category = analysis.get('category', '').lower()
-                    
-                    if any(word in category for word in ['shirt', 'blouse', 'top', 'sweater', 'jacket', 'blazer']):
-                        tops.append({
-                            'item': item,
-                            'analysis': analysis
-                        })
-                    elif any(word in category for word in ['pants', 'jeans', 'skirt', 'shorts', 'trousers']):
-                        bottoms.append({
-                            'item': item,
-                            'analysis': analysis
-                        })
-                    elif any(word in category for word in ['shoes', 'boots', 'sneakers', 'heels', 'sandals']):
-                        shoes.append({
-                            'item': item,
-                            'analysis': analysis
-                        })
-                    else:
-                        accessories.append({
-                            'item': item,
-                            'analysis': analysis
-                        })
-                except:
-                    continue
+                # Typed columns stand in for the parsed analysis (item_name, category, ...)
+                analysis = {key: item[key] for key in ('item_name', 'category', 'color', 'style') if item.get(key)}
+                category = (item.get('category') or '').lower()
+                
+                if any(word in category for word in ['shirt', 'blouse', 'top', 'sweater', 'jacket', 'blazer']):
+                    tops.append({
+                        'item': item,
+                        'analysis': analysis
+                    })
+                elif any(word in category for word in ['pants', 'jeans', 'skirt', 'shorts', 'trousers']):
+                    bottoms.append({
+                        'item': item,
+                        'analysis': analysis
+                    })
+                elif any(word in category for word in ['shoes', 'boots', 'sneakers', 'heels', 'sandals']):
+                    shoes.append({
+                        'item': item,
+                        'analysis': analysis
+                    })
+                else:
+                    accessories.append({
+                        'item': item,
+                        'analysis': analysis
+                    })
         
         # Create outfit combinations
         outfit_count = 0
@@ -2,7 +2,6 @@
 # -*- coding: utf-8 -*-
 
 from database import get_user_images, delete_uploaded_image
-import json
 
 def cleanup_duplicates():
     """Remove duplicate entries, keeping the ones with proper analysis"""
@@ -24,14 +23,13 @@ def cleanup_duplicates():
             # Find the best entry (with proper analysis)
             best_entry = None
             for entry in group:
-                analysis = json.loads(entry['analysis'])
-                item_name = analysis.get('item_name', '')
-                category = analysis.get('category', '')
+                item_name = entry.get('item_name') or ''
+                category = entry.get('category') or ''
                 
                 # Prefer entries with proper names and categories
                 if (item_name not in ['Chat Upload', 'S__21733430_0', 'S__21733428_0'] and 
                     category != 'Clothing' and 
-                    'analysis pending' not in analysis.get('description', '')):
+                    'analysis pending' not in (entry.get('description_excerpt') or '')):
                     best_entry = entry
                     break
             
@@ -39,12 +37,12 @@ def cleanup_duplicates():
             if not best_entry:
                 best_entry = group[0]
             
-            print(f"Keeping: {best_entry['filename']} - {json.loads(best_entry['analysis']).get('item_name', 'N/A')}")
+            print(f"Keeping: {best_entry['filename']} - {best_entry.get('item_name') or 'N/A'}")
             
             # Delete the others
             for entry in group:
                 if entry != best_entry:
-                    print(f"Deleting: {entry['filename']} - {json.loads(entry['analysis']).get('item_name', 'N/A')}")
+                    print(f"Deleting: {entry['filename']} - {entry.get('item_name') or 'N/A'}")
                     try:
                         delete_uploaded_image(1, entry['filename'])  # user_id = 1
                     except Exception as e:
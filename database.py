@@ -6,130 +6,1298 @@ Handles all database operations including user management, image storage, and ch
 import sqlite3
 import os
 import json
-from datetime import datetime
+import math
+import re
+import zlib
+import base64
+import atexit
+import hashlib
+import queue
+import shutil
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from datetime import datetime, timezone
 from typing import List, Dict, Optional, Any
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 # Database file path
 DB_PATH = os.path.join(os.path.dirname(__file__), 'aistylist.db')
 
-def get_db_connection():
-    """Get database connection"""
-    conn = sqlite3.connect(DB_PATH)
+# Where uploaded clothing images live on disk
+UPLOAD_DIR = os.path.join(os.path.dirname(__file__), 'data', 'clothes', 'input')
+
+# Connection tuning applied to every connection
+BUSY_TIMEOUT_MS = 5000       # Wait this long for a competing writer instead of failing
+CACHE_SIZE_KIB = 16384       # Page cache per connection (16 MB)
+
+# Length of the description excerpt stored next to the full analysis JSON
+DESCRIPTION_EXCERPT_CHARS = 280
+
+# Long LLM text (chat replies, analysis JSON) is stored compressed as a BLOB that starts with a
+# marker byte; short text and rows written before compression stay plain TEXT and read as-is.
+# Decompressing costs read throughput (bench_database.py), so only unusually long text pays it:
+# typical 2-4 sentence replies stay plain
+COMPRESS_MIN_CHARS = int(os.getenv('DB_COMPRESS_MIN_CHARS', '2048'))
+COMPRESSED_COLUMNS = ('reply', 'analysis')
+_ZLIB_MARKER = b'z'
+_ZSTD_MARKER = b'Z'
+_zstd_compressor = zstandard.ZstdCompressor(level=6) if zstandard else None
+_zstd_decompressor = zstandard.ZstdDecompressor() if zstandard else None
+
+# Page sizes for cursor-paginated listings
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# Column lists shared by the list and page helpers
+_IMAGE_COLUMNS = '''id, filename, original_name, url, analysis, item_name, category, color, style,
+                   description_excerpt, content_hash, created_at'''
+_CHAT_COLUMNS = 'id, message, reply, message_type, created_at'
+_OUTFIT_COLUMNS = 'id, outfit_name, outfit_data, weather_condition, occasion, created_at'
+_COLLECTION_COLUMNS = 'id, collection_name, collection_type, avatar_image_url, outfit_description, tags, created_at'
+
+# In-process weather tier: most lookups become a dict hit instead of a SQLite round trip
+WEATHER_MEMO_MAX_ENTRIES = 256
+_weather_memo = OrderedDict()  # location -> (monotonic time cached, weather data)
+_weather_memo_lock = threading.Lock()
+_weather_memo_stats = {'hits': 0, 'misses': 0}
+
+# Retention policy applied by run_retention() (scheduled nightly in app.py)
+CHAT_RETENTION_PER_USER = int(os.getenv('CHAT_RETENTION_PER_USER', '500'))    # Newest messages kept per user
+WEATHER_RETENTION_HOURS = int(os.getenv('WEATHER_RETENTION_HOURS', '24'))
+PROCESSED_EVENTS_RETENTION_DAYS = 30  # Stripe stops retrying an event after 3 days
+VACUUM_PAGES_PER_STEP = 1000          # Free pages returned to the OS per incremental_vacuum step
+VACUUM_MAX_STEPS = 50                 # Cap on steps per run so compaction never monopolises the write lock
+
+# Online backups (sqlite3 backup API, copied in small steps so writers are never blocked for long)
+BACKUP_DIR = os.getenv('DB_BACKUP_DIR', os.path.join(os.path.dirname(__file__), 'data', 'backups'))
+BACKUP_PAGES_PER_STEP = 256    # ~1 MB per step at the default 4 KB page size
+BACKUP_STEP_SLEEP = 0.01       # Seconds between steps for other connections to use the file
+BACKUP_KEEP = 7                # Newest backup files kept by backup_database()
+
+# Closet stats memo: (database path, user_id) -> (closet version, stats); a new version makes the entry stale
+CLOSET_STATS_MAX_ENTRIES = 1024
+_closet_stats = OrderedDict()
+_closet_stats_lock = threading.Lock()
+
+# Callbacks run after restore_database(), so in-process caches keyed by closet version or user drop rewound data
+_restore_listeners = []
+
+# Opt-in per-statement timing (DB_QUERY_STATS=1 or enable_query_stats()); off by default
+QUERY_STATS_ENABLED = os.getenv('DB_QUERY_STATS', '').lower() in ('1', 'true', 'yes')
+SLOW_QUERY_MS = float(os.getenv('DB_SLOW_QUERY_MS', '100'))
+QUERY_SAMPLES_PER_STATEMENT = 1000   # Latency samples kept per fingerprint for percentiles
+SLOW_QUERY_LOG_SIZE = 100
+_query_stats = {}  # fingerprint -> {'count', 'total_seconds', 'rows', 'samples'}
+_slow_queries = deque(maxlen=SLOW_QUERY_LOG_SIZE)
+_query_stats_lock = threading.Lock()
+
+# Optional per-user sharding (DB_SHARDED=1): closet, chat, outfit and collection rows live in
+# one file per user under SHARD_DIR; users, subscriptions, webhooks and weather stay in DB_PATH
+SHARDED = os.getenv('DB_SHARDED', '').lower() in ('1', 'true', 'yes')
+SHARD_DIR = os.getenv('DB_SHARD_DIR', os.path.join(os.path.dirname(__file__), 'data', 'shards'))
+SHARD_CONNECTIONS_PER_THREAD = 32   # LRU of open shard connections kept by each thread
+_shard_schemas_ready = set()
+_shard_schema_lock = threading.RLock()
+
+# Each worker thread keeps its open connections while it runs
+_local = threading.local()
+
+# The threaded Flask server runs every request on a new thread, so a request's connections go
+# back to this shared idle pool at teardown (release_connections) for the next request to reuse
+POOL_MAX_IDLE_PER_PATH = 16
+_idle_connections = {}  # path -> [(conn, timed)], most recently released last
+_idle_connections_lock = threading.Lock()
+
+def _query_fingerprint(sql: str) -> str:
+    """Normalise a statement so calls differing only in literals/whitespace share one entry"""
+    sql = re.sub(r"'(?:[^']|'')*'", '?', sql)
+    sql = re.sub(r'\b\d+(?:\.\d+)?\b', '?', sql)
+    return ' '.join(sql.split())
+
+def _record_query(sample: list, seconds: float, rows: int, finished: bool = True) -> None:
+    """
+    Add execute/fetch time and rows to a statement's sample, logging it once if it turns slow.
+    finished=False (a query whose rows are still to be fetched) defers the slow check to the fetch,
+    so the logged row count is the rows actually returned.
+    """
+    with _query_stats_lock:
+        sample[0] += seconds
+        sample[1] += rows
+        stats = sample[3]
+        stats['total_seconds'] += seconds
+        stats['rows'] += rows
+        if not finished or sample[0] * 1000 < SLOW_QUERY_MS or sample[2]:
+            return
+        sample[2] = True
+        slow = {'sql': stats['sql'], 'ms': round(sample[0] * 1000, 2), 'rows': sample[1],
+                'at': datetime.now().isoformat(timespec='seconds')}
+        _slow_queries.append(slow)
+    print(f"Slow query ({slow['ms']} ms, {slow['rows']} rows): {slow['sql']}")
+
+def _start_query(sql: str) -> list:
+    """Register one execution of a statement; returns its mutable [seconds, rows, logged, stats] sample"""
+    fingerprint = _query_fingerprint(sql)
+    with _query_stats_lock:
+        stats = _query_stats.get(fingerprint)
+        if stats is None:
+            stats = _query_stats[fingerprint] = {
+                'sql': fingerprint, 'count': 0, 'total_seconds': 0.0, 'rows': 0,
+                'samples': deque(maxlen=QUERY_SAMPLES_PER_STATEMENT)
+            }
+        stats['count'] += 1
+        sample = [0.0, 0, False, stats]
+        stats['samples'].append(sample)
+    return sample
+
+class _TimedCursor(sqlite3.Cursor):
+    """Cursor that charges execute and fetch time (and rows fetched) to the statement's stats"""
+    
+    _sample = None
+    
+    def _timed(self, method, *args, done=None):
+        start = time.perf_counter()
+        result = method(*args)
+        rows = (1 if result is not None else 0) if method is sqlite3.Cursor.fetchone else len(result)
+        _record_query(self._sample, time.perf_counter() - start, rows, True if done is None else done(result))
+        return result
+    
+    def execute(self, sql, parameters=()):
+        self._sample = _start_query(sql)
+        start = time.perf_counter()
+        super().execute(sql, parameters)
+        # Queries (statements returning rows) are checked for slowness once their rows are fetched
+        _record_query(self._sample, time.perf_counter() - start, 0, finished=self.description is None)
+        return self
+    
+    def executemany(self, sql, seq_of_parameters):
+        self._sample = _start_query(sql)
+        start = time.perf_counter()
+        super().executemany(sql, seq_of_parameters)
+        _record_query(self._sample, time.perf_counter() - start, max(self.rowcount, 0))
+        return self
+    
+    def fetchone(self):
+        if self._sample is None:
+            return super().fetchone()
+        return self._timed(sqlite3.Cursor.fetchone, self)
+    
+    def fetchmany(self, size=None):
+        size = size or self.arraysize
+        if self._sample is None:
+            return super().fetchmany(size)
+        return self._timed(sqlite3.Cursor.fetchmany, self, size, done=lambda rows: len(rows) < size)
+    
+    def fetchall(self):
+        if self._sample is None:
+            return super().fetchall()
+        return self._timed(sqlite3.Cursor.fetchall, self)
+    
+    def __next__(self):
+        if self._sample is None:
+            row = super().fetchone()
+        else:
+            # Iterating: the statement is finished once the rows run out
+            row = self._timed(sqlite3.Cursor.fetchone, self, done=lambda row: row is None)
+        if row is None:
+            raise StopIteration
+        return row
+
+class _TimedConnection(sqlite3.Connection):
+    """Connection whose statements (and commits) are recorded by _TimedCursor"""
+    
+    def cursor(self, factory=_TimedCursor):
+        return super().cursor(factory)
+    
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+    
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+    
+    def commit(self):
+        sample = _start_query('COMMIT')
+        start = time.perf_counter()
+        super().commit()
+        _record_query(sample, time.perf_counter() - start, 0)
+
+def compress_text(text: Optional[str]):
+    """Compress text of COMPRESS_MIN_CHARS or more into a marker-prefixed BLOB; shorter text is returned unchanged"""
+    if text is None or len(text) < COMPRESS_MIN_CHARS:
+        return text
+    raw = text.encode('utf-8')
+    if _zstd_compressor is not None:
+        return _ZSTD_MARKER + _zstd_compressor.compress(raw)
+    return _ZLIB_MARKER + zlib.compress(raw, 6)
+
+def decompress_text(value):
+    """Inverse of compress_text; plain TEXT (including rows from before compression) passes through"""
+    if not isinstance(value, bytes):
+        return value
+    if value[:1] == _ZSTD_MARKER:
+        if _zstd_decompressor is None:
+            raise RuntimeError("Row is zstd-compressed but the zstandard package is not installed")
+        return _zstd_decompressor.decompress(value[1:]).decode('utf-8')
+    if value[:1] == _ZLIB_MARKER:
+        return zlib.decompress(value[1:]).decode('utf-8')
+    return value.decode('utf-8')
+
+def _row_dict(row: sqlite3.Row) -> Dict[str, Any]:
+    """Convert a fetched row to a dict, decompressing its compressed columns"""
+    item = dict(row)
+    for column in COMPRESSED_COLUMNS:
+        if isinstance(item.get(column), bytes):
+            item[column] = decompress_text(item[column])
+    return item
+
+def _open_connection(path: str, isolation_level: Optional[str] = None) -> sqlite3.Connection:
+    """Open a connection configured for concurrent readers and a single writer"""
+    factory = _TimedConnection if QUERY_STATS_ENABLED else sqlite3.Connection
+    # check_same_thread off: pooled connections move between request threads (one user at a time)
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_MS / 1000, isolation_level=isolation_level, factory=factory,
+                           check_same_thread=False)
     conn.row_factory = sqlite3.Row
+    # Lets triggers (FTS sync) read compressed columns
+    conn.create_function('decompress_text', 1, decompress_text, deterministic=True)
+    # WAL lets readers keep going while the 5 AM job (or any request) writes
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = NORMAL')
+    conn.execute(f'PRAGMA cache_size = -{CACHE_SIZE_KIB}')
+    conn.execute(f'PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}')
+    conn.execute('PRAGMA temp_store = MEMORY')
     return conn
 
-def init_database():
-    """Initialize database with required tables"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # Users table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            email TEXT UNIQUE,
-            name TEXT,
-            subscription_type TEXT DEFAULT 'free',
-            subscription_status TEXT DEFAULT 'active',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+def get_db_connection():
+    """Get a standalone database connection (the caller is responsible for closing it)"""
+    return _open_connection(DB_PATH, isolation_level='')
+
+def shard_path(user_id: int) -> str:
+    """Path of a user's shard file (256 subdirectories so no directory grows huge)"""
+    user_id = int(user_id)
+    return os.path.join(SHARD_DIR, f'{user_id % 256:02x}', f'user_{user_id}.db')
+
+def _database_path(user_id: Optional[int]) -> str:
+    """Route a user's rows to their shard when sharding is on; everything else uses DB_PATH"""
+    if SHARDED and user_id is not None:
+        return shard_path(user_id)
+    return DB_PATH
+
+def _handle(user_id: Optional[int] = None) -> Dict[str, Any]:
+    """Get the calling thread's {'conn', 'depth', 'timed'} handle for a database file, opening it on first use"""
+    handles = getattr(_local, 'handles', None)
+    if handles is None:
+        handles = _local.handles = OrderedDict()  # path -> handle, least recently used first
+    
+    # Tests and tools repoint DB_PATH; drop the connection to the old main file
+    if getattr(_local, 'main_path', DB_PATH) != DB_PATH:
+        old = handles.pop(_local.main_path, None)
+        if old is not None:
+            old['conn'].close()
+    _local.main_path = DB_PATH
+    
+    path = _database_path(user_id)
+    handle = handles.get(path)
+    # Toggling query stats swaps the connection class, but never in the middle of a transaction
+    if handle is not None and handle['timed'] != QUERY_STATS_ENABLED and handle['depth'] == 0:
+        handle['conn'].close()
+        handle = None
+    if handle is None:
+        conn = _take_idle_connection(path)
+        if conn is None:
+            if path != DB_PATH and not os.path.exists(path):
+                _create_shard_file(path)
+            conn = _open_connection(path)
+        handle = {'conn': conn, 'depth': 0, 'timed': QUERY_STATS_ENABLED}
+        handles[path] = handle
+        _evict_shard_connections(handles)
+        if path != DB_PATH:
+            _ensure_shard_schema(path, user_id)
+    handles.move_to_end(path)
+    return handle
+
+def _take_idle_connection(path: str) -> Optional[sqlite3.Connection]:
+    """Reuse a connection another thread released for this file, if one of the right class is idle"""
+    with _idle_connections_lock:
+        idle = _idle_connections.get(path)
+        while idle:
+            conn, timed = idle.pop()
+            if timed == QUERY_STATS_ENABLED:
+                return conn
+            conn.close()
+    return None
+
+def release_connections() -> None:
+    """
+    Return the calling thread's connections to the shared idle pool (Flask's teardown_appcontext
+    calls this), keeping at most POOL_MAX_IDLE_PER_PATH per file; connections still inside a
+    transaction stay with the thread.
+    """
+    handles = getattr(_local, 'handles', None)
+    if not handles:
+        return
+    for path, handle in list(handles.items()):
+        if handle['depth']:
+            continue
+        del handles[path]
+        with _idle_connections_lock:
+            idle = _idle_connections.setdefault(path, [])
+            if len(idle) < POOL_MAX_IDLE_PER_PATH and handle['timed'] == QUERY_STATS_ENABLED:
+                idle.append((handle['conn'], handle['timed']))
+                continue
+        handle['conn'].close()
+
+def close_idle_connections() -> None:
+    """Close every pooled idle connection (e.g. before the files are replaced)"""
+    with _idle_connections_lock:
+        idle = [conn for conns in _idle_connections.values() for conn, _ in conns]
+        _idle_connections.clear()
+    for conn in idle:
+        conn.close()
+
+def shard_user_ids() -> List[int]:
+    """User ids that have a shard file under SHARD_DIR"""
+    user_ids = []
+    if os.path.isdir(SHARD_DIR):
+        for subdir in sorted(os.listdir(SHARD_DIR)):
+            for name in os.listdir(os.path.join(SHARD_DIR, subdir)):
+                if name.startswith('user_') and name.endswith('.db'):
+                    user_ids.append(int(name[len('user_'):-len('.db')]))
+    return sorted(user_ids)
+
+def _evict_shard_connections(handles: OrderedDict) -> None:
+    """Close the least recently used idle shard connections beyond SHARD_CONNECTIONS_PER_THREAD"""
+    shard_paths = [path for path in handles if path != DB_PATH]
+    for path in shard_paths[:max(0, len(shard_paths) - SHARD_CONNECTIONS_PER_THREAD)]:
+        if handles[path]['depth'] == 0:
+            handles.pop(path)['conn'].close()
+
+def _create_shard_file(path: str) -> None:
+    """Create an empty shard with incremental auto-vacuum chosen up front (no VACUUM needed later)"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        conn.execute('PRAGMA journal_mode = WAL')  # First write: fixes the file header
+    finally:
+        conn.close()
+
+def _ensure_shard_schema(path: str, user_id: int) -> None:
+    """Create and migrate a shard the first time this process touches it"""
+    with _shard_schema_lock:
+        if path in _shard_schemas_ready:
+            return
+        _shard_schemas_ready.add(path)
+        try:
+            init_database(user_id)
+        except BaseException:
+            _shard_schemas_ready.discard(path)
+            raise
+
+def get_connection(user_id: int = None) -> sqlite3.Connection:
+    """Get the calling thread's long-lived connection (to the user's shard when sharding is on)"""
+    return _handle(user_id)['conn']
+
+def close_connection() -> None:
+    """Close the calling thread's connections (they are reopened on next use)"""
+    handles = getattr(_local, 'handles', None) or {}
+    for handle in handles.values():
+        handle['conn'].close()
+    handles.clear()
+
+def enable_query_stats(slow_query_ms: float = None) -> None:
+    """Start timing every statement (each thread reopens its connection outside a transaction)"""
+    global QUERY_STATS_ENABLED, SLOW_QUERY_MS
+    if slow_query_ms is not None:
+        SLOW_QUERY_MS = slow_query_ms
+    QUERY_STATS_ENABLED = True
+
+def disable_query_stats() -> None:
+    """Stop timing statements (collected stats are kept until reset_query_stats)"""
+    global QUERY_STATS_ENABLED
+    QUERY_STATS_ENABLED = False
+
+def reset_query_stats() -> None:
+    """Forget all collected statement stats and slow queries"""
+    with _query_stats_lock:
+        _query_stats.clear()
+        _slow_queries.clear()
+
+def _percentile(sorted_values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    index = max(0, min(len(sorted_values) - 1, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+def get_query_stats() -> Dict[str, Any]:
+    """Per-statement count, total/p50/p95/p99 milliseconds and rows, slowest total first"""
+    with _query_stats_lock:
+        snapshot = [
+            (stats['sql'], stats['count'], stats['total_seconds'], stats['rows'], sorted(s[0] for s in stats['samples']))
+            for stats in _query_stats.values()
+        ]
+        slow = list(_slow_queries)
+    statements = []
+    for sql, count, total_seconds, rows, samples in snapshot:
+        statements.append({
+            'sql': sql,
+            'count': count,
+            'total_ms': round(total_seconds * 1000, 3),
+            'p50_ms': round(_percentile(samples, 0.50) * 1000, 3),
+            'p95_ms': round(_percentile(samples, 0.95) * 1000, 3),
+            'p99_ms': round(_percentile(samples, 0.99) * 1000, 3),
+            'rows': rows,
+            'rows_per_call': round(rows / count, 2)
+        })
+    statements.sort(key=lambda s: s['total_ms'], reverse=True)
+    return {
+        'enabled': QUERY_STATS_ENABLED,
+        'slow_query_ms': SLOW_QUERY_MS,
+        'statements': statements,
+        'slow_queries': slow
+    }
+
+@contextmanager
+def transaction(write: bool = False, user_id: int = None):
+    """
+    Run a block inside one transaction on the thread's connection (the user's
+    shard when sharding is on and user_id is given).
+    Nested blocks join the outermost transaction, which commits once on exit
+    or rolls back if the block raises. write=True takes the write lock up front
+    so concurrent writers wait on the busy timeout instead of failing mid-way.
+    """
+    handle = _handle(user_id)
+    conn = handle['conn']
+    if handle['depth'] == 0:
+        conn.execute('BEGIN IMMEDIATE' if write else 'BEGIN')
+    handle['depth'] += 1
+    try:
+        yield conn
+    except BaseException:
+        handle['depth'] -= 1
+        if handle['depth'] == 0:
+            conn.rollback()
+        raise
+    handle['depth'] -= 1
+    if handle['depth'] == 0:
+        try:
+            conn.commit()
+        except BaseException:
+            # A failed COMMIT (e.g. SQLITE_BUSY) leaves the transaction open; end it so the next BEGIN works
+            conn.rollback()
+            raise
+
+@contextmanager
+def batch(user_id: int = None):
+    """
+    Defer commits for every helper called inside the block to one transaction:
+
+        with database.batch():
+            for row in rows:
+                database.save_outfit(...)
+    
+    With sharding on, pass the user_id whose rows the block writes.
+    """
+    with transaction(write=True, user_id=user_id) as conn:
+        yield conn
+
+class BackgroundWriter:
+    """
+    Write-behind persister: submit() enqueues a row and returns immediately, and a
+    daemon thread hands queued rows to write_many (e.g. save_chat_messages_many)
+    in small batches, one transaction each. A full queue blocks submit() until
+    the writer catches up; pending rows are flushed at interpreter exit.
+    """
+    
+    def __init__(self, write_many, max_queue: int = 1000, batch_size: int = 50,
+                 flush_interval: float = 0.05, name: str = 'db-writer'):
+        self.write_many = write_many
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.written = 0
+        self.failed = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+    
+    def submit(self, item: Any, timeout: float = None) -> None:
+        """Queue one row; blocks (up to timeout, then raises queue.Full) while the queue is full"""
+        if self._stopped.is_set():
+            raise RuntimeError(f"{self._thread.name} is closed")
+        self._queue.put(item, timeout=timeout)
+    
+    def pending(self) -> int:
+        """Rows queued but not yet handed to write_many"""
+        return self._queue.qsize()
+    
+    def flush(self) -> None:
+        """Block until every row submitted so far has been written"""
+        self._queue.join()
+    
+    def close(self) -> None:
+        """Write everything still queued, then stop the thread"""
+        if self._stopped.is_set():
+            return
+        self._stopped.set()
+        self._thread.join()
+    
+    def _run(self) -> None:
+        while not (self._stopped.is_set() and self._queue.empty()):
+            try:
+                items = [self._queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                continue
+            while len(items) < self.batch_size:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.write_many(items)
+                self.written += len(items)
+            except Exception as e:
+                self.failed += len(items)
+                print(f"{self._thread.name}: failed to write {len(items)} rows: {e}")
+            finally:
+                for _ in items:
+                    self._queue.task_done()
+        close_connection()
+
+def init_database(user_id: int = None):
+    """Initialize database with required tables (a user's shard when user_id is given and sharding is on)"""
+    with transaction(write=True, user_id=user_id) as conn:
+        # Users table
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                email TEXT UNIQUE,
+                name TEXT,
+                subscription_type TEXT DEFAULT 'free',
+                subscription_status TEXT DEFAULT 'active',
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        # Uploaded images table
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS uploaded_images (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER,
+                filename TEXT,
+                original_name TEXT,
+                url TEXT,
+                analysis TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users (id)
+            )
+        ''')
+        
+        # Chat messages table
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS chat_messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER,
+                message TEXT,
+                reply TEXT,
+                message_type TEXT DEFAULT 'text',
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users (id)
+            )
+        ''')
+        
+        # Outfits table
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS outfits (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER,
+                outfit_name TEXT,
+                outfit_data TEXT,
+                weather_condition TEXT,
+                occasion TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users (id)
+            )
+        ''')
+        
+        # Weather cache table (one row per location)
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS weather_cache (
+                location TEXT PRIMARY KEY,
+                weather_data TEXT,
+                cached_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        # Collections table for avatar outfit photos
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS collections (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER,
+                collection_name TEXT,
+                collection_type TEXT,
+                avatar_image_url TEXT,
+                outfit_description TEXT,
+                tags TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users (id)
+            )
+        ''')
+    
+    migrate(user_id)
+    enable_incremental_vacuum(user_id)
+    if _database_path(user_id) == DB_PATH:
+        if SHARDED:
+            move_rows_to_shards()
+        print("Database initialized successfully")
+
+# Tables whose rows live in the owner's shard when sharding is on
+SHARDED_TABLES = ('uploaded_images', 'chat_messages', 'outfits', 'collections')
+
+def move_rows_to_shards() -> Dict[str, int]:
+    """
+    Move per-user rows still in the main file (written before DB_SHARDED was turned on) into
+    their owners' shards; returns the rows moved per table. Each batch is copied in one shard
+    transaction that also records the main-file ids in shard_imports, then deleted from the main
+    file, so a run cut short in between resumes without duplicating rows.
+    """
+    moved = {table: 0 for table in SHARDED_TABLES}
+    if not SHARDED:
+        return moved
+    for table in SHARDED_TABLES:
+        with transaction() as conn:
+            user_ids = [row['user_id'] for row in conn.execute(
+                f'SELECT DISTINCT user_id FROM {table} WHERE user_id IS NOT NULL ORDER BY user_id'
+            )]
+        for user_id in user_ids:
+            with transaction() as conn:
+                rows = [dict(row) for row in conn.execute(f'SELECT * FROM {table} WHERE user_id = ? ORDER BY id', (user_id,))]
+            if not rows:
+                continue
+            # Stored values (compressed text included) are copied as-is; the shard assigns new ids
+            columns = [column for column in rows[0] if column != 'id']
+            with transaction(write=True, user_id=user_id) as shard:
+                copied = {row['main_id'] for row in shard.execute(
+                    'SELECT main_id FROM shard_imports WHERE table_name = ?', (table,)
+                )}
+                pending = [row for row in rows if row['id'] not in copied]
+                shard.executemany(
+                    f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                    [tuple(row[column] for column in columns) for row in pending]
+                )
+                shard.executemany(
+                    'INSERT INTO shard_imports (table_name, main_id) VALUES (?, ?)',
+                    [(table, row['id']) for row in pending]
+                )
+            with transaction(write=True) as conn:
+                conn.execute(f'DELETE FROM {table} WHERE user_id = ? AND id <= ?', (user_id, rows[-1]['id']))
+            moved[table] += len(pending)
+    if any(moved.values()):
+        print(f"Moved rows into shards: {moved}")
+    return moved
+
+def _migration_001_user_created_indexes(conn: sqlite3.Connection) -> None:
+    """Index the (user_id, created_at) access path used by every per-user listing"""
+    # Filtering on user_id and walking created_at backwards serves ORDER BY created_at DESC
+    # straight from the index, so reads touch only the rows they return (no scan, no sort)
+    for table in ('uploaded_images', 'chat_messages', 'outfits', 'collections'):
+        conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_user_created ON {table} (user_id, created_at)')
+
+def _migration_002_item_columns(conn: sqlite3.Connection) -> None:
+    """Promote the analysis fields every listing reads into typed, indexed columns"""
+    for column in ('item_name', 'category', 'color', 'style', 'description_excerpt'):
+        conn.execute(f'ALTER TABLE uploaded_images ADD COLUMN {column} TEXT')
+    
+    # Backfill from the JSON blob, parsed one last time
+    rows = conn.execute('SELECT id, analysis FROM uploaded_images').fetchall()
+    conn.executemany('''
+        UPDATE uploaded_images
+        SET item_name = ?, category = ?, color = ?, style = ?, description_excerpt = ?
+        WHERE id = ?
+    ''', [_analysis_columns(row['analysis']) + (row['id'],) for row in rows])
+    
+    # Category/color filters are served (and ordered) straight from the index
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_uploaded_images_user_category ON uploaded_images (user_id, category, created_at)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_uploaded_images_user_color ON uploaded_images (user_id, color, created_at)')
+
+def _migration_003_content_hash(conn: sqlite3.Connection) -> None:
+    """Store each image's content hash so duplicate uploads are one indexed lookup"""
+    conn.execute('ALTER TABLE uploaded_images ADD COLUMN content_hash TEXT')
+    
+    # Backfill by hashing each file on disk once (rows sharing a filename share the hash)
+    hashes = {}
+    rows = conn.execute('SELECT id, filename FROM uploaded_images').fetchall()
+    for row in rows:
+        filename = row['filename'] or ''
+        if filename not in hashes:
+            path = os.path.join(UPLOAD_DIR, filename)
+            hashes[filename] = file_content_hash(path) if filename and os.path.isfile(path) else None
+    conn.executemany(
+        'UPDATE uploaded_images SET content_hash = ? WHERE id = ?',
+        [(hashes[row['filename'] or ''], row['id']) for row in rows]
+    )
+    
+    # Not UNIQUE: legacy duplicate rows (see cleanup_duplicates.py) would make it fail to build
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_uploaded_images_user_hash ON uploaded_images (user_id, content_hash)')
+
+# Full-text columns derived from an uploaded_images row (analysis may not be valid JSON)
+_IMAGE_FTS_VALUES = '''
+    new.id, new.user_id, new.item_name, new.category, new.color, new.style,
+    CASE WHEN json_valid(new.analysis) THEN json_extract(new.analysis, '$.description') END
+'''
+
+def _migration_004_fts_search(conn: sqlite3.Connection) -> None:
+    """Add FTS5 indexes over closet items and chat history, kept in sync by triggers"""
+    conn.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS uploaded_images_fts USING fts5(
+            user_id UNINDEXED, item_name, category, color, style, description,
+            tokenize = 'porter unicode61'
         )
     ''')
-    
-    # Uploaded images table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS uploaded_images (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            filename TEXT,
-            original_name TEXT,
-            url TEXT,
-            analysis TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id)
+    conn.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS chat_messages_fts USING fts5(
+            user_id UNINDEXED, message, reply,
+            tokenize = 'porter unicode61'
         )
     ''')
     
-    # Chat messages table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS chat_messages (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            message TEXT,
-            reply TEXT,
-            message_type TEXT DEFAULT 'text',
+    # rowid of each FTS row is the id of the row it indexes (one execute per trigger: executescript would commit)
+    triggers = [
+        f'''
+            CREATE TRIGGER IF NOT EXISTS uploaded_images_fts_insert AFTER INSERT ON uploaded_images BEGIN
+                INSERT INTO uploaded_images_fts (rowid, user_id, item_name, category, color, style, description)
+                VALUES ({_IMAGE_FTS_VALUES});
+            END
+        ''',
+        f'''
+            CREATE TRIGGER IF NOT EXISTS uploaded_images_fts_update
+            AFTER UPDATE OF user_id, analysis, item_name, category, color, style ON uploaded_images BEGIN
+                DELETE FROM uploaded_images_fts WHERE rowid = old.id;
+                INSERT INTO uploaded_images_fts (rowid, user_id, item_name, category, color, style, description)
+                VALUES ({_IMAGE_FTS_VALUES});
+            END
+        ''',
+        '''
+            CREATE TRIGGER IF NOT EXISTS uploaded_images_fts_delete AFTER DELETE ON uploaded_images BEGIN
+                DELETE FROM uploaded_images_fts WHERE rowid = old.id;
+            END
+        ''',
+        '''
+            CREATE TRIGGER IF NOT EXISTS chat_messages_fts_insert AFTER INSERT ON chat_messages BEGIN
+                INSERT INTO chat_messages_fts (rowid, user_id, message, reply)
+                VALUES (new.id, new.user_id, new.message, new.reply);
+            END
+        ''',
+        '''
+            CREATE TRIGGER IF NOT EXISTS chat_messages_fts_update
+            AFTER UPDATE OF user_id, message, reply ON chat_messages BEGIN
+                DELETE FROM chat_messages_fts WHERE rowid = old.id;
+                INSERT INTO chat_messages_fts (rowid, user_id, message, reply)
+                VALUES (new.id, new.user_id, new.message, new.reply);
+            END
+        ''',
+        '''
+            CREATE TRIGGER IF NOT EXISTS chat_messages_fts_delete AFTER DELETE ON chat_messages BEGIN
+                DELETE FROM chat_messages_fts WHERE rowid = old.id;
+            END
+        ''',
+    ]
+    for trigger in triggers:
+        conn.execute(trigger)
+    
+    # Backfill existing rows
+    conn.execute(f'''
+        INSERT INTO uploaded_images_fts (rowid, user_id, item_name, category, color, style, description)
+        SELECT {_IMAGE_FTS_VALUES.replace('new.', '')} FROM uploaded_images
+    ''')
+    conn.execute('''
+        INSERT INTO chat_messages_fts (rowid, user_id, message, reply)
+        SELECT id, user_id, message, reply FROM chat_messages
+    ''')
+
+def _migration_005_subscriptions(conn: sqlite3.Connection) -> None:
+    """Create the subscriptions table payment_service reads and its webhooks update"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS subscriptions (
+            user_id INTEGER PRIMARY KEY,
+            status TEXT DEFAULT 'trial',
+            stripe_customer_id TEXT,
+            stripe_subscription_id TEXT,
+            current_period_end TIMESTAMP,
+            trial_ends_at TIMESTAMP,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             FOREIGN KEY (user_id) REFERENCES users (id)
         )
     ''')
+    # customer.subscription.* webhooks only carry the Stripe customer id
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_subscriptions_customer ON subscriptions (stripe_customer_id)')
+
+def _migration_006_processed_events(conn: sqlite3.Connection) -> None:
+    """Record applied Stripe webhook event ids so redelivered events are skipped"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS processed_events (
+            event_id TEXT PRIMARY KEY,
+            event_type TEXT,
+            processed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+def _migration_007_closet_versions(conn: sqlite3.Connection) -> None:
+    """Keep a per-user closet version that every uploaded_images write bumps (a cache key)"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS closet_versions (
+            user_id INTEGER PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
     
-    # Outfits table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS outfits (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            outfit_name TEXT,
-            outfit_data TEXT,
-            weather_condition TEXT,
-            occasion TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id)
+    # Bumped by triggers so the version commits atomically with the write that changed the closet
+    bump = '''
+        INSERT INTO closet_versions (user_id, version) SELECT {user}, 1 WHERE {user} IS NOT NULL {extra}
+        ON CONFLICT (user_id) DO UPDATE SET version = version + 1;
+    '''
+    triggers = [
+        ('closet_version_insert', 'AFTER INSERT', bump.format(user='new.user_id', extra='')),
+        ('closet_version_update', 'AFTER UPDATE',
+         bump.format(user='new.user_id', extra='') + bump.format(user='old.user_id', extra='AND old.user_id IS NOT new.user_id')),
+        ('closet_version_delete', 'AFTER DELETE', bump.format(user='old.user_id', extra='')),
+    ]
+    for name, timing, body in triggers:
+        conn.execute(f'CREATE TRIGGER IF NOT EXISTS {name} {timing} ON uploaded_images BEGIN {body} END')
+    
+    conn.execute('''
+        INSERT OR IGNORE INTO closet_versions (user_id, version)
+        SELECT DISTINCT user_id, 1 FROM uploaded_images WHERE user_id IS NOT NULL
+    ''')
+
+def _migration_008_closet_stats_index(conn: sqlite3.Connection) -> None:
+    """Covering index so closet stats are one GROUP BY over the index, never the table"""
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_uploaded_images_user_category_color
+        ON uploaded_images (user_id, category, color, created_at)
+    ''')
+
+def _migration_009_contentless_fts(conn: sqlite3.Connection) -> None:
+    """
+    Rebuild the FTS indexes as contentless tables fed decompressed text. They no
+    longer keep a second, uncompressed copy of every reply and description; search
+    joins back to the base table for user_id and the row itself.
+    """
+    for name in ('uploaded_images_fts_insert', 'uploaded_images_fts_update', 'uploaded_images_fts_delete',
+                 'chat_messages_fts_insert', 'chat_messages_fts_update', 'chat_messages_fts_delete'):
+        conn.execute(f'DROP TRIGGER IF EXISTS {name}')
+    conn.execute('DROP TABLE IF EXISTS uploaded_images_fts')
+    conn.execute('DROP TABLE IF EXISTS chat_messages_fts')
+    conn.execute('''
+        CREATE VIRTUAL TABLE uploaded_images_fts USING fts5(
+            item_name, category, color, style, description,
+            content = '', tokenize = 'porter unicode61'
+        )
+    ''')
+    conn.execute('''
+        CREATE VIRTUAL TABLE chat_messages_fts USING fts5(
+            message, reply,
+            content = '', tokenize = 'porter unicode61'
         )
     ''')
     
-    # Collections table for avatar outfit photos
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS collections (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            collection_name TEXT,
-            collection_type TEXT,
-            avatar_image_url TEXT,
-            outfit_description TEXT,
-            tags TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id)
+    # Contentless tables forget what they indexed, so removals pass the old values to the 'delete' command
+    image_values = '''{row}.item_name, {row}.category, {row}.color, {row}.style,
+        (SELECT CASE WHEN json_valid(text) THEN json_extract(text, '$.description') END
+         FROM (SELECT decompress_text({row}.analysis) AS text))'''
+    chat_values = '{row}.message, decompress_text({row}.reply)'
+    image_insert = f'''
+        INSERT INTO uploaded_images_fts (rowid, item_name, category, color, style, description)
+        VALUES (new.id, {image_values.format(row='new')});'''
+    image_delete = f'''
+        INSERT INTO uploaded_images_fts (uploaded_images_fts, rowid, item_name, category, color, style, description)
+        VALUES ('delete', old.id, {image_values.format(row='old')});'''
+    chat_insert = f'''
+        INSERT INTO chat_messages_fts (rowid, message, reply) VALUES (new.id, {chat_values.format(row='new')});'''
+    chat_delete = f'''
+        INSERT INTO chat_messages_fts (chat_messages_fts, rowid, message, reply)
+        VALUES ('delete', old.id, {chat_values.format(row='old')});'''
+    triggers = [
+        ('uploaded_images_fts_insert', 'AFTER INSERT ON uploaded_images', image_insert),
+        ('uploaded_images_fts_update', 'AFTER UPDATE OF analysis, item_name, category, color, style ON uploaded_images',
+         image_delete + image_insert),
+        ('uploaded_images_fts_delete', 'AFTER DELETE ON uploaded_images', image_delete),
+        ('chat_messages_fts_insert', 'AFTER INSERT ON chat_messages', chat_insert),
+        ('chat_messages_fts_update', 'AFTER UPDATE OF message, reply ON chat_messages', chat_delete + chat_insert),
+        ('chat_messages_fts_delete', 'AFTER DELETE ON chat_messages', chat_delete),
+    ]
+    for name, event, body in triggers:
+        conn.execute(f'CREATE TRIGGER {name} {event} BEGIN {body} END')
+    
+    conn.execute(f'''
+        INSERT INTO uploaded_images_fts (rowid, item_name, category, color, style, description)
+        SELECT id, {image_values.format(row='uploaded_images')} FROM uploaded_images
+    ''')
+    conn.execute(f'''
+        INSERT INTO chat_messages_fts (rowid, message, reply)
+        SELECT id, {chat_values.format(row='chat_messages')} FROM chat_messages
+    ''')
+
+def _migration_010_failed_events(conn: sqlite3.Connection) -> None:
+    """Park Stripe webhook events that could not be applied after being acknowledged, for replay"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS failed_events (
+            event_id TEXT PRIMARY KEY,
+            event_type TEXT,
+            payload TEXT NOT NULL,
+            error TEXT,
+            attempts INTEGER NOT NULL DEFAULT 1,
+            failed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
     ''')
+
+def _migration_011_shard_imports(conn: sqlite3.Connection) -> None:
+    """Record which main-file rows a shard has already copied, so move_rows_to_shards() can resume"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS shard_imports (
+            table_name TEXT NOT NULL,
+            main_id INTEGER NOT NULL,
+            PRIMARY KEY (table_name, main_id)
+        )
+    ''')
+
+# Numbered schema migrations; append new ones, never edit or reorder applied ones
+MIGRATIONS = [
+    (1, 'user_id/created_at indexes', _migration_001_user_created_indexes),
+    (2, 'typed uploaded_images columns', _migration_002_item_columns),
+    (3, 'uploaded_images content hash', _migration_003_content_hash),
+    (4, 'FTS5 closet and chat search', _migration_004_fts_search),
+    (5, 'subscriptions table', _migration_005_subscriptions),
+    (6, 'processed webhook events', _migration_006_processed_events),
+    (7, 'per-user closet versions', _migration_007_closet_versions),
+    (8, 'closet stats covering index', _migration_008_closet_stats_index),
+    (9, 'contentless FTS over compressed text', _migration_009_contentless_fts),
+    (10, 'failed webhook events', _migration_010_failed_events),
+    (11, 'shard import ledger', _migration_011_shard_imports),
+]
+
+def get_schema_version(user_id: int = None) -> int:
+    """Get the highest migration version applied to the database"""
+    with transaction(user_id=user_id) as conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                name TEXT,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        result = conn.execute('SELECT MAX(version) AS version FROM schema_version').fetchone()
+    return result['version'] or 0
+
+def migrate(user_id: int = None) -> int:
+    """Apply pending migrations in order, each in its own transaction; returns the new version"""
+    current = get_schema_version(user_id)
+    for version, name, apply in MIGRATIONS:
+        if version <= current:
+            continue
+        with transaction(write=True, user_id=user_id) as conn:
+            apply(conn)
+            conn.execute('INSERT INTO schema_version (version, name) VALUES (?, ?)', (version, name))
+        if _database_path(user_id) == DB_PATH:
+            print(f"Applied migration {version}: {name}")
+        current = version
+    return current
+
+def enable_incremental_vacuum(user_id: int = None) -> bool:
+    """
+    Switch the file to auto_vacuum=INCREMENTAL so deleted pages can be released
+    in bounded steps. Existing files need one full VACUUM to change mode, which
+    cannot run inside a transaction, so this runs after migrate(); returns True if it did.
+    """
+    conn = get_connection(user_id)
+    if conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2:
+        return False
+    conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+    conn.execute('VACUUM')
+    print(f"Enabled incremental auto-vacuum for {_database_path(user_id)}")
+    return True
+
+def incremental_vacuum(pages_per_step: int = None, max_steps: int = None, user_id: int = None) -> int:
+    """Release free pages to the OS a step at a time, letting other writers in between; returns pages freed"""
+    pages_per_step = pages_per_step or VACUUM_PAGES_PER_STEP
+    max_steps = max_steps or VACUUM_MAX_STEPS
+    handle = _handle(user_id)
+    conn = handle['conn']
+    if handle['depth']:
+        raise RuntimeError("incremental_vacuum() cannot run inside a transaction")
+    free_before = conn.execute('PRAGMA freelist_count').fetchone()[0]
+    free_pages = free_before
+    for _ in range(max_steps):
+        if free_pages == 0:
+            break
+        # Each step is its own short autocommit write. executescript because execute()
+        # steps a statement once, and incremental_vacuum frees one page per step
+        conn.executescript(f'PRAGMA incremental_vacuum({pages_per_step});')
+        free_pages = conn.execute('PRAGMA freelist_count').fetchone()[0]
+    return free_before - free_pages
+
+def run_retention(chat_messages_per_user: int = None, weather_max_age_hours: int = None) -> Dict[str, int]:
+    """Apply the retention policy (old chat, weather and webhook rows), then compact the file"""
+    keep = chat_messages_per_user if chat_messages_per_user is not None else CHAT_RETENTION_PER_USER
+    max_age = weather_max_age_hours if weather_max_age_hours is not None else WEATHER_RETENTION_HOURS
+    with transaction(write=True) as conn:
+        weather = conn.execute(
+            "DELETE FROM weather_cache WHERE cached_at < datetime('now', ?)", (f'-{max_age} hours',)
+        ).rowcount
+        events = conn.execute(
+            "DELETE FROM processed_events WHERE processed_at < datetime('now', ?)", (f'-{PROCESSED_EVENTS_RETENTION_DAYS} days',)
+        ).rowcount
+    result = {'chat_messages': 0, 'weather_cache': weather, 'processed_events': events, 'pages_freed': 0}
     
-    conn.commit()
-    conn.close()
-    print("Database initialized successfully")
+    # The main file always; with sharding on, every shard too (one transaction each)
+    for user_id in [None] + (shard_user_ids() if SHARDED else []):
+        with transaction(write=True, user_id=user_id) as conn:
+            result['chat_messages'] += conn.execute('''
+                DELETE FROM chat_messages WHERE id IN (
+                    SELECT id FROM (
+                        SELECT id, ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY created_at DESC, id DESC) AS position
+                        FROM chat_messages
+                    ) WHERE position > ?
+                )
+            ''', (keep,)).rowcount
+        result['pages_freed'] += incremental_vacuum(user_id=user_id)
+    print(f"Retention: {result}")
+    return result
 
-def create_user(email: str, name: str, subscription_type: str = 'free') -> int:
-    """Create a new user and return user ID"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
+def add_restore_listener(callback) -> None:
+    """Call callback() after every restore_database() in this process (modules register their cache clears)"""
+    if callback not in _restore_listeners:
+        _restore_listeners.append(callback)
+
+def shard_backup_dir(backup_path: str) -> str:
+    """Directory holding the shard files that belong to a main-file backup"""
+    return os.path.splitext(backup_path)[0] + '.shards'
+
+def _copy_database(source_path: str, dest_path: str, pages_per_step: int, sleep: float) -> Dict[str, int]:
+    """Online-copy one database file a few pages at a time; returns the pages and steps copied"""
+    progress = {'steps': 0, 'pages': 0}
+    def on_step(status, remaining, total):
+        progress['steps'] += 1
+        progress['pages'] = total
     
+    # A dedicated connection, so a transaction open on this thread is never touched
+    source = _open_connection(source_path)
+    dest = sqlite3.connect(dest_path)
     try:
-        cursor.execute('''
-            INSERT INTO users (email, name, subscription_type)
-            VALUES (?, ?, ?)
-        ''', (email, name, subscription_type))
-        
-        user_id = cursor.lastrowid
-        conn.commit()
-        return user_id
-    except sqlite3.IntegrityError:
-        # User already exists, get existing user ID
-        cursor.execute('SELECT id FROM users WHERE email = ?', (email,))
-        result = cursor.fetchone()
-        return result['id'] if result else None
+        source.backup(dest, pages=pages_per_step, progress=on_step, sleep=sleep)
+    finally:
+        dest.close()
+        source.close()
+    return progress
+
+def backup_database(dest_path: str = None, pages_per_step: int = None, sleep: float = None) -> Dict[str, Any]:
+    """
+    Copy the live database to dest_path (default: a timestamped file in BACKUP_DIR)
+    without stopping traffic; with sharding on, every shard is copied too, into
+    shard_backup_dir(dest_path). Returns the path, bytes, pages and shards copied and the duration.
+    """
+    if not os.path.isfile(DB_PATH):
+        raise FileNotFoundError(f"No database to back up at {DB_PATH}")
+    if dest_path is None:
+        os.makedirs(BACKUP_DIR, exist_ok=True)
+        dest_path = os.path.join(BACKUP_DIR, f"aistylist-{datetime.now().strftime('%Y%m%d-%H%M%S')}.db")
+    pages_per_step = pages_per_step or BACKUP_PAGES_PER_STEP
+    sleep = BACKUP_STEP_SLEEP if sleep is None else sleep
+    
+    start = time.perf_counter()
+    progress = _copy_database(DB_PATH, dest_path, pages_per_step, sleep)
+    result = {
+        'path': dest_path,
+        'bytes': os.path.getsize(dest_path),
+        'pages': progress['pages'],
+        'steps': progress['steps'],
+        'shards': 0
+    }
+    if SHARDED:
+        # Same layout as SHARD_DIR, so restore maps each file straight back
+        shards_dir = shard_backup_dir(dest_path)
+        if os.path.isdir(shards_dir):
+            shutil.rmtree(shards_dir)
+        for user_id in shard_user_ids():
+            shard_dest = os.path.join(shards_dir, os.path.relpath(shard_path(user_id), SHARD_DIR))
+            os.makedirs(os.path.dirname(shard_dest), exist_ok=True)
+            progress = _copy_database(shard_path(user_id), shard_dest, pages_per_step, sleep)
+            result['bytes'] += os.path.getsize(shard_dest)
+            result['pages'] += progress['pages']
+            result['steps'] += progress['steps']
+            result['shards'] += 1
+    result['seconds'] = round(time.perf_counter() - start, 3)
+    print(f"Backed up database to {dest_path}: {result['bytes']:,} bytes, {result['shards']} shards "
+          f"in {result['seconds']}s ({result['steps']} steps)")
+    if os.path.dirname(os.path.abspath(dest_path)) == os.path.abspath(BACKUP_DIR):
+        _prune_backups()
+    return result
+
+def _prune_backups() -> None:
+    """Delete all but the newest BACKUP_KEEP backups in BACKUP_DIR (with their shard directories)"""
+    backups = sorted(name for name in os.listdir(BACKUP_DIR) if name.startswith('aistylist-') and name.endswith('.db'))
+    for name in backups[:-BACKUP_KEEP]:
+        path = os.path.join(BACKUP_DIR, name)
+        os.remove(path)
+        if os.path.isdir(shard_backup_dir(path)):
+            shutil.rmtree(shard_backup_dir(path))
+
+def check_integrity(path: str) -> List[str]:
+    """Run PRAGMA integrity_check on a database file; returns [] if it is intact, else the problems"""
+    conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    try:
+        problems = [row[0] for row in conn.execute('PRAGMA integrity_check').fetchall()]
+    except sqlite3.DatabaseError as e:
+        problems = [str(e)]
     finally:
         conn.close()
+    return [] if problems == ['ok'] else problems
 
-def get_user_subscription(user_id: int) -> Dict[str, Any]:
-    """Get user subscription information"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
+def _backup_shard_files(backup_path: str) -> Dict[str, str]:
+    """Map each shard file in a backup to the live path it restores to"""
+    shards_dir = shard_backup_dir(backup_path)
+    files = {}
+    if os.path.isdir(shards_dir):
+        for subdir in sorted(os.listdir(shards_dir)):
+            for name in os.listdir(os.path.join(shards_dir, subdir)):
+                if name.startswith('user_') and name.endswith('.db'):
+                    files[os.path.join(shards_dir, subdir, name)] = os.path.join(SHARD_DIR, subdir, name)
+    return files
+
+def _restore_file(backup_path: str, live_path: str) -> None:
+    """Copy one verified backup file over a live database file"""
+    source = sqlite3.connect(f'file:{backup_path}?mode=ro', uri=True)
+    dest = _open_connection(live_path)
+    try:
+        source.backup(dest)
+    finally:
+        dest.close()
+        source.close()
+
+def restore_database(backup_path: str) -> Dict[str, Any]:
+    """
+    Verify a backup (and its shards) with integrity_check, then copy it over the live database.
+    With sharding on, the backed-up shards replace the live ones, shards created after the backup
+    are removed, and any per-user rows the restored main file still holds are moved into shards.
+    Closet versions rewind with the data, so this process's caches are cleared; other running
+    processes (e.g. the app when restoring with backup_db.py) must be restarted.
+    """
+    if not os.path.isfile(backup_path):
+        raise FileNotFoundError(backup_path)
+    shard_files = _backup_shard_files(backup_path)
+    # Check everything before touching anything, so a bad shard cannot leave a half-restored set
+    for path in [backup_path] + list(shard_files):
+        problems = check_integrity(path)
+        if problems:
+            raise ValueError(f"Backup {path} failed integrity check: {problems[:5]}")
     
-    cursor.execute('''
-        SELECT subscription_type, subscription_status, created_at, updated_at
-        FROM users WHERE id = ?
-    ''', (user_id,))
+    start = time.perf_counter()
+    close_connection()
+    close_idle_connections()
+    _restore_file(backup_path, DB_PATH)
+    if SHARDED:
+        restored = set(shard_files.values())
+        for user_id in shard_user_ids():
+            live_path = shard_path(user_id)
+            if live_path not in restored:
+                for suffix in ('', '-wal', '-shm'):
+                    if os.path.exists(live_path + suffix):
+                        os.remove(live_path + suffix)
+        for source_path, live_path in shard_files.items():
+            if not os.path.exists(live_path):
+                _create_shard_file(live_path)
+            _restore_file(source_path, live_path)
+        # Restored shards may be at an older schema version
+        with _shard_schema_lock:
+            _shard_schemas_ready.clear()
+    # Cached weather may predate the restored rows, and rewound closet versions would
+    # match stats cached for newer closets
+    with _weather_memo_lock:
+        _weather_memo.clear()
+    with _closet_stats_lock:
+        _closet_stats.clear()
+    if SHARDED:
+        move_rows_to_shards()
+    for callback in list(_restore_listeners):
+        callback()
+    result = {'path': backup_path, 'shards': len(shard_files) if SHARDED else 0,
+              'seconds': round(time.perf_counter() - start, 3)}
+    print(f"Restored database from {backup_path} ({result['shards']} shards) in {result['seconds']}s")
+    return result
+
+def encode_page_cursor(created_at: str, row_id: int) -> str:
+    """Encode the (created_at, id) position of a page's last row as an opaque token"""
+    raw = json.dumps([created_at, row_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_page_cursor(cursor: str) -> tuple:
+    """Decode a page token; raises ValueError for anything encode_page_cursor did not produce"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except Exception as e:
+        raise ValueError(f"Invalid page cursor: {cursor!r}") from e
+    if not isinstance(created_at, str) or not isinstance(row_id, int):
+        raise ValueError(f"Invalid page cursor: {cursor!r}")
+    return created_at, row_id
+
+def _fetch_page(table: str, columns: str, conditions: List[str], params: List[Any],
+                cursor: Optional[str], page_size: int) -> Dict[str, Any]:
+    """
+    Fetch one newest-first page using keyset pagination on (created_at, id).
+    The cursor seeks straight into the (user_id, created_at) index, so page N
+    costs the same as page 1 no matter how many rows the user has.
+    """
+    page_size = max(1, min(int(page_size or DEFAULT_PAGE_SIZE), MAX_PAGE_SIZE))
+    conditions = list(conditions)
+    params = list(params)
+    if cursor:
+        conditions.append('(created_at, id) < (?, ?)')
+        params.extend(decode_page_cursor(cursor))
     
-    result = cursor.fetchone()
-    conn.close()
+    # Every listing filters on user_id first, which also picks the shard
+    with transaction(user_id=params[0]) as conn:
+        rows = conn.execute(f'''
+            SELECT {columns}
+            FROM {table}
+            WHERE {' AND '.join(conditions)}
+            ORDER BY created_at DESC, id DESC
+            LIMIT ?
+        ''', params + [page_size + 1]).fetchall()
+    
+    # One extra row tells us whether another page exists
+    items = [_row_dict(row) for row in rows[:page_size]]
+    next_cursor = None
+    if len(rows) > page_size:
+        next_cursor = encode_page_cursor(items[-1]['created_at'], items[-1]['id'])
+    return {'items': items, 'next_cursor': next_cursor}
+
+def create_user(email: str, name: str, subscription_type: str = 'free') -> int:
+    """Create a new user and return user ID"""
+    with transaction(write=True) as conn:
+        try:
+            cursor = conn.execute('''
+                INSERT INTO users (email, name, subscription_type)
+                VALUES (?, ?, ?)
+            ''', (email, name, subscription_type))
+            return cursor.lastrowid
+        except sqlite3.IntegrityError:
+            # User already exists, get existing user ID
+            result = conn.execute('SELECT id FROM users WHERE email = ?', (email,)).fetchone()
+            return result['id'] if result else None
+
+def get_user_subscription(user_id: int) -> Dict[str, Any]:
+    """Get user subscription information"""
+    with transaction() as conn:
+        result = conn.execute('''
+            SELECT subscription_type, subscription_status, created_at, updated_at
+            FROM users WHERE id = ?
+        ''', (user_id,)).fetchone()
     
     if result:
         return {
@@ -142,197 +1310,366 @@ def get_user_subscription(user_id: int) -> Dict[str, Any]:
 
 def save_chat_message(user_id: int, message: str, reply: str, message_type: str = 'text') -> int:
     """Save chat message and reply"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        INSERT INTO chat_messages (user_id, message, reply, message_type)
-        VALUES (?, ?, ?, ?)
-    ''', (user_id, message, reply, message_type))
-    
-    message_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
-    
-    return message_id
+    with transaction(write=True, user_id=user_id) as conn:
+        cursor = conn.execute('''
+            INSERT INTO chat_messages (user_id, message, reply, message_type)
+            VALUES (?, ?, ?, ?)
+        ''', (user_id, message, compress_text(reply), message_type))
+        return cursor.lastrowid
+
+def _group_by_shard(rows: List[Dict[str, Any]]) -> Dict[Optional[int], List[Dict[str, Any]]]:
+    """Split rows by user_id when sharding is on, so each shard gets one transaction"""
+    if not SHARDED:
+        return {None: rows}
+    groups = {}
+    for row in rows:
+        groups.setdefault(row['user_id'], []).append(row)
+    return groups
+
+def save_chat_messages_many(messages: List[Dict[str, Any]]) -> int:
+    """Save many chat messages (dicts with user_id, message, reply[, message_type]) in one transaction (per shard)"""
+    for user_id, rows in _group_by_shard(messages).items():
+        with transaction(write=True, user_id=user_id) as conn:
+            conn.executemany('''
+                INSERT INTO chat_messages (user_id, message, reply, message_type)
+                VALUES (?, ?, ?, ?)
+            ''', [(m['user_id'], m['message'], compress_text(m['reply']), m.get('message_type', 'text')) for m in rows])
+    return len(messages)
 
 def get_chat_messages(user_id: int, limit: int = 50) -> List[Dict[str, Any]]:
     """Get chat messages for a user"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    with transaction(user_id=user_id) as conn:
+        results = conn.execute(f'''
+            SELECT {_CHAT_COLUMNS}
+            FROM chat_messages
+            WHERE user_id = ?
+            ORDER BY created_at DESC
+            LIMIT ?
+        ''', (user_id, limit)).fetchall()
     
-    cursor.execute('''
-        SELECT id, message, reply, message_type, created_at
-        FROM chat_messages
-        WHERE user_id = ?
-        ORDER BY created_at DESC
-        LIMIT ?
-    ''', (user_id, limit))
-    
-    results = cursor.fetchall()
-    conn.close()
-    
-    return [dict(row) for row in results]
+    return [_row_dict(row) for row in results]
+
+def item_description(item: Dict[str, Any]) -> str:
+    """
+    Full analysis description of an uploaded_images row, for LLM prompts; description_excerpt
+    is cut at DESCRIPTION_EXCERPT_CHARS for listings, so it only stands in when analysis is unreadable
+    """
+    try:
+        data = json.loads(item.get('analysis') or '')
+    except (TypeError, ValueError):
+        data = None
+    if isinstance(data, dict) and data.get('description'):
+        return str(data['description'])
+    return item.get('description_excerpt') or ''
+
+def _analysis_columns(analysis: Optional[str]) -> tuple:
+    """Extract (item_name, category, color, style, description_excerpt) from an analysis JSON string"""
+    try:
+        data = json.loads(analysis) if analysis else {}
+    except (TypeError, ValueError):
+        data = {}
+    if not isinstance(data, dict):
+        data = {}
+    description = str(data.get('description') or '')
+    return (
+        data.get('item_name'),
+        data.get('category'),
+        data.get('color'),
+        data.get('style'),
+        description[:DESCRIPTION_EXCERPT_CHARS]
+    )
+
+def file_content_hash(path: str) -> str:
+    """MD5 of a file's contents (same digest as generate_item.get_image_hash)"""
+    digest = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
 
-def save_uploaded_image(user_id: int, filename: str, original_name: str, url: str, analysis: str) -> int:
+def get_chat_messages_page(user_id: int, cursor: str = None, page_size: int = DEFAULT_PAGE_SIZE) -> Dict[str, Any]:
+    """Get one newest-first page of chat messages ({'items', 'next_cursor'})"""
+    return _fetch_page('chat_messages', _CHAT_COLUMNS, ['user_id = ?'], [user_id], cursor, page_size)
+
+def save_uploaded_image(user_id: int, filename: str, original_name: str, url: str, analysis: str, content_hash: str = None) -> int:
     """Save uploaded image information"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        INSERT INTO uploaded_images (user_id, filename, original_name, url, analysis)
-        VALUES (?, ?, ?, ?, ?)
-    ''', (user_id, filename, original_name, url, analysis))
-    
-    image_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
+    with transaction(write=True, user_id=user_id) as conn:
+        cursor = conn.execute('''
+            INSERT INTO uploaded_images (user_id, filename, original_name, url, analysis,
+                                         item_name, category, color, style, description_excerpt, content_hash)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (user_id, filename, original_name, url, compress_text(analysis)) + _analysis_columns(analysis) + (content_hash,))
+        return cursor.lastrowid
+
+def save_uploaded_images_many(images: List[Dict[str, Any]]) -> int:
+    """Save many uploaded images (dicts with save_uploaded_image's arguments) in one transaction (per shard)"""
+    for user_id, rows in _group_by_shard(images).items():
+        with transaction(write=True, user_id=user_id) as conn:
+            conn.executemany('''
+                INSERT INTO uploaded_images (user_id, filename, original_name, url, analysis,
+                                             item_name, category, color, style, description_excerpt, content_hash)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', [
+                (i['user_id'], i['filename'], i['original_name'], i['url'], compress_text(i['analysis']))
+                + _analysis_columns(i['analysis']) + (i.get('content_hash'),)
+                for i in rows
+            ])
+    return len(images)
+
+def find_image_by_hash(user_id: int, content_hash: str) -> Optional[Dict[str, Any]]:
+    """Get the user's earliest upload with the given content hash, if any"""
+    with transaction(user_id=user_id) as conn:
+        result = conn.execute('''
+            SELECT id, filename, original_name, url, analysis, created_at
+            FROM uploaded_images
+            WHERE user_id = ? AND content_hash = ?
+            ORDER BY id
+            LIMIT 1
+        ''', (user_id, content_hash)).fetchone()
     
-    return image_id
+    return _row_dict(result) if result else None
 
-def get_user_images(user_id: int, limit: int = 100) -> List[Dict[str, Any]]:
-    """Get user's uploaded images"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
+def get_user_images(user_id: int, limit: int = 100, category: str = None, color: str = None) -> List[Dict[str, Any]]:
+    """Get user's uploaded images, optionally filtered by exact category and/or color"""
+    conditions = ['user_id = ?']
+    params = [user_id]
+    if category:
+        conditions.append('category = ?')
+        params.append(category)
+    if color:
+        conditions.append('color = ?')
+        params.append(color)
     
-    cursor.execute('''
-        SELECT id, filename, original_name, url, analysis, created_at
-        FROM uploaded_images
-        WHERE user_id = ?
-        ORDER BY created_at DESC
-        LIMIT ?
-    ''', (user_id, limit))
+    with transaction(user_id=user_id) as conn:
+        results = conn.execute(f'''
+            SELECT {_IMAGE_COLUMNS}
+            FROM uploaded_images
+            WHERE {' AND '.join(conditions)}
+            ORDER BY created_at DESC
+            LIMIT ?
+        ''', params + [limit]).fetchall()
     
-    results = cursor.fetchall()
-    conn.close()
+    return [_row_dict(row) for row in results]
+
+def get_closet_version(user_id: int) -> int:
+    """Get the user's closet version; it increases on every upload, analysis update and delete"""
+    with transaction(user_id=user_id) as conn:
+        result = conn.execute('SELECT version FROM closet_versions WHERE user_id = ?', (user_id,)).fetchone()
+    return result['version'] if result else 0
+
+def get_closet_stats(user_id: int) -> Dict[str, Any]:
+    """
+    Get category and color histograms, the item count and the latest upload time
+    for a user's closet, from one GROUP BY over the covering index (cached per closet version)
+    """
+    key = (_database_path(user_id), user_id)
+    with transaction(user_id=user_id) as conn:
+        result = conn.execute('SELECT version FROM closet_versions WHERE user_id = ?', (user_id,)).fetchone()
+        version = result['version'] if result else 0
+        with _closet_stats_lock:
+            cached = _closet_stats.get(key)
+            if cached and cached[0] == version:
+                _closet_stats.move_to_end(key)
+                return _copy_closet_stats(cached[1])
+        rows = conn.execute('''
+            SELECT category, color, COUNT(*) AS items, MAX(created_at) AS last_upload
+            FROM uploaded_images
+            WHERE user_id = ?
+            GROUP BY category, color
+        ''', (user_id,)).fetchall()
     
-    return [dict(row) for row in results]
+    # Fold the (category, color) cross-tab into the two histograms
+    categories = {}
+    colors = {}
+    for row in rows:
+        category = row['category'] or 'Uncategorized'
+        color = row['color'] or 'Unknown'
+        categories[category] = categories.get(category, 0) + row['items']
+        colors[color] = colors.get(color, 0) + row['items']
+    stats = {
+        'total_items': sum(categories.values()),
+        'categories': dict(sorted(categories.items(), key=lambda kv: (-kv[1], kv[0]))),
+        'colors': dict(sorted(colors.items(), key=lambda kv: (-kv[1], kv[0]))),
+        'last_upload': max((row['last_upload'] for row in rows if row['last_upload']), default=None),
+        'closet_version': version
+    }
+    with _closet_stats_lock:
+        _closet_stats[key] = (version, stats)
+        _closet_stats.move_to_end(key)
+        while len(_closet_stats) > CLOSET_STATS_MAX_ENTRIES:
+            _closet_stats.popitem(last=False)
+    return _copy_closet_stats(stats)
+
+def _copy_closet_stats(stats: Dict[str, Any]) -> Dict[str, Any]:
+    """Copy cached stats so callers can't modify the cached histograms"""
+    return {**stats, 'categories': dict(stats['categories']), 'colors': dict(stats['colors'])}
+
+def get_user_images_page(user_id: int, cursor: str = None, page_size: int = DEFAULT_PAGE_SIZE,
+                         category: str = None, color: str = None) -> Dict[str, Any]:
+    """Get one newest-first page of the user's uploaded images ({'items', 'next_cursor'})"""
+    conditions = ['user_id = ?']
+    params = [user_id]
+    if category:
+        conditions.append('category = ?')
+        params.append(category)
+    if color:
+        conditions.append('color = ?')
+        params.append(color)
+    return _fetch_page('uploaded_images', _IMAGE_COLUMNS, conditions, params, cursor, page_size)
+
+def _fts_query(text: str) -> str:
+    """Turn free text into an FTS5 query: every word must match, as a prefix ("wool navy" -> "wool"* "navy"*)"""
+    return ' '.join(f'"{word}"*' for word in re.findall(r'\w+', text.lower()))
+
+def search_user_items(user_id: int, query: str, limit: int = 50) -> List[Dict[str, Any]]:
+    """Full-text search of the user's closet, best matches first (names weigh more than descriptions)"""
+    match = _fts_query(query)
+    if not match:
+        return []
+    columns = ', '.join(f'i.{column.strip()}' for column in _IMAGE_COLUMNS.split(','))
+    with transaction(user_id=user_id) as conn:
+        rows = conn.execute(f'''
+            SELECT {columns}
+            FROM uploaded_images_fts f JOIN uploaded_images i ON i.id = f.rowid
+            WHERE uploaded_images_fts MATCH ? AND i.user_id = ?
+            ORDER BY bm25(uploaded_images_fts, 10.0, 5.0, 5.0, 2.0, 1.0)
+            LIMIT ?
+        ''', (match, user_id, max(1, min(int(limit), MAX_PAGE_SIZE)))).fetchall()
+    return [_row_dict(row) for row in rows]
+
+def search_chat_messages(user_id: int, query: str, limit: int = 50) -> List[Dict[str, Any]]:
+    """Full-text search of the user's chat history, best matches first"""
+    match = _fts_query(query)
+    if not match:
+        return []
+    with transaction(user_id=user_id) as conn:
+        rows = conn.execute('''
+            SELECT m.id, m.message, m.reply, m.message_type, m.created_at
+            FROM chat_messages_fts f JOIN chat_messages m ON m.id = f.rowid
+            WHERE chat_messages_fts MATCH ? AND m.user_id = ?
+            ORDER BY bm25(chat_messages_fts)
+            LIMIT ?
+        ''', (match, user_id, max(1, min(int(limit), MAX_PAGE_SIZE)))).fetchall()
+    return [_row_dict(row) for row in rows]
 
 def save_outfit(user_id: int, outfit_name: str, outfit_data: str, weather_condition: str = None, occasion: str = None) -> int:
     """Save outfit recommendation"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        INSERT INTO outfits (user_id, outfit_name, outfit_data, weather_condition, occasion)
-        VALUES (?, ?, ?, ?, ?)
-    ''', (user_id, outfit_name, outfit_data, weather_condition, occasion))
-    
-    outfit_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
-    
-    return outfit_id
+    with transaction(write=True, user_id=user_id) as conn:
+        cursor = conn.execute('''
+            INSERT INTO outfits (user_id, outfit_name, outfit_data, weather_condition, occasion)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (user_id, outfit_name, outfit_data, weather_condition, occasion))
+        return cursor.lastrowid
+
+def save_outfits_many(outfits: List[Dict[str, Any]]) -> int:
+    """Save many outfits (dicts with save_outfit's arguments) in one transaction (per shard)"""
+    for user_id, rows in _group_by_shard(outfits).items():
+        with transaction(write=True, user_id=user_id) as conn:
+            conn.executemany('''
+                INSERT INTO outfits (user_id, outfit_name, outfit_data, weather_condition, occasion)
+                VALUES (?, ?, ?, ?, ?)
+            ''', [
+                (o['user_id'], o['outfit_name'], o['outfit_data'], o.get('weather_condition'), o.get('occasion'))
+                for o in rows
+            ])
+    return len(outfits)
 
 def get_user_outfits(user_id: int, limit: int = 50) -> List[Dict[str, Any]]:
     """Get user's saved outfits"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        SELECT id, outfit_name, outfit_data, weather_condition, occasion, created_at
-        FROM outfits
-        WHERE user_id = ?
-        ORDER BY created_at DESC
-        LIMIT ?
-    ''', (user_id, limit))
+    with transaction(user_id=user_id) as conn:
+        results = conn.execute(f'''
+            SELECT {_OUTFIT_COLUMNS}
+            FROM outfits
+            WHERE user_id = ?
+            ORDER BY created_at DESC
+            LIMIT ?
+        ''', (user_id, limit)).fetchall()
     
-    results = cursor.fetchall()
-    conn.close()
-    
-    return [dict(row) for row in results]
+    return [_row_dict(row) for row in results]
+
+def get_user_outfits_page(user_id: int, cursor: str = None, page_size: int = DEFAULT_PAGE_SIZE) -> Dict[str, Any]:
+    """Get one newest-first page of the user's saved outfits ({'items', 'next_cursor'})"""
+    return _fetch_page('outfits', _OUTFIT_COLUMNS, ['user_id = ?'], [user_id], cursor, page_size)
 
 def delete_uploaded_image(user_id: int, filename: str) -> bool:
     """Delete uploaded image from database and filesystem"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
     try:
-        # First get the file info to delete the actual file
-        cursor.execute('''
-            SELECT filename, url FROM uploaded_images 
-            WHERE user_id = ? AND filename = ?
-        ''', (user_id, filename))
-        
-        result = cursor.fetchone()
-        if not result:
-            conn.close()
-            return False
-        
-        # Delete from database
-        cursor.execute('''
-            DELETE FROM uploaded_images
-            WHERE user_id = ? AND filename = ?
-        ''', (user_id, filename))
-        
-        deleted_count = cursor.rowcount
-        conn.commit()
-        conn.close()
-        
-        # Delete the actual file from filesystem
-        try:
-            file_path = os.path.join(os.path.dirname(__file__), 'data', 'clothes', 'input', filename)
-            if os.path.exists(file_path):
-                os.remove(file_path)
-                print(f"Deleted file: {file_path}")
-        except Exception as e:
-            print(f"Error deleting file {filename}: {e}")
-        
-        return deleted_count > 0
-        
+        with transaction(write=True, user_id=user_id) as conn:
+            # First make sure the image belongs to this user
+            result = conn.execute('''
+                SELECT filename, url FROM uploaded_images 
+                WHERE user_id = ? AND filename = ?
+            ''', (user_id, filename)).fetchone()
+            
+            if not result:
+                return False
+            
+            # Delete from database
+            deleted_count = conn.execute('''
+                DELETE FROM uploaded_images
+                WHERE user_id = ? AND filename = ?
+            ''', (user_id, filename)).rowcount
     except Exception as e:
         print(f"Error deleting image from database: {e}")
-        conn.rollback()
-        conn.close()
         return False
+    
+    # Delete the actual file from filesystem
+    try:
+        file_path = os.path.join(UPLOAD_DIR, filename)
+        if os.path.exists(file_path):
+            os.remove(file_path)
+            print(f"Deleted file: {file_path}")
+    except Exception as e:
+        print(f"Error deleting file {filename}: {e}")
+    
+    return deleted_count > 0
 
 def update_user_subscription(user_id: int, subscription_type: str, subscription_status: str = 'active') -> bool:
     """Update user subscription"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        UPDATE users
-        SET subscription_type = ?, subscription_status = ?, updated_at = CURRENT_TIMESTAMP
-        WHERE id = ?
-    ''', (subscription_type, subscription_status, user_id))
-    
-    updated_count = cursor.rowcount
-    conn.commit()
-    conn.close()
+    with transaction(write=True) as conn:
+        updated_count = conn.execute('''
+            UPDATE users
+            SET subscription_type = ?, subscription_status = ?, updated_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+        ''', (subscription_type, subscription_status, user_id)).rowcount
     
     return updated_count > 0
 
 def save_collection(user_id: int, collection_name: str, collection_type: str, avatar_image_url: str, outfit_description: str, tags: str = "") -> int:
     """Save a new collection item"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        INSERT INTO collections (user_id, collection_name, collection_type, avatar_image_url, outfit_description, tags)
-        VALUES (?, ?, ?, ?, ?, ?)
-    ''', (user_id, collection_name, collection_type, avatar_image_url, outfit_description, tags))
-    
-    collection_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
-    
-    return collection_id
+    with transaction(write=True, user_id=user_id) as conn:
+        cursor = conn.execute('''
+            INSERT INTO collections (user_id, collection_name, collection_type, avatar_image_url, outfit_description, tags)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (user_id, collection_name, collection_type, avatar_image_url, outfit_description, tags))
+        return cursor.lastrowid
+
+def save_collections_many(collections: List[Dict[str, Any]]) -> int:
+    """Save many collection items (dicts with save_collection's arguments) in one transaction (per shard)"""
+    for user_id, rows in _group_by_shard(collections).items():
+        with transaction(write=True, user_id=user_id) as conn:
+            conn.executemany('''
+                INSERT INTO collections (user_id, collection_name, collection_type, avatar_image_url, outfit_description, tags)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', [
+                (c['user_id'], c['collection_name'], c['collection_type'], c['avatar_image_url'],
+                 c['outfit_description'], c.get('tags', ''))
+                for c in rows
+            ])
+    return len(collections)
 
 def get_user_collections(user_id: int) -> List[Dict[str, Any]]:
     """Get all collections for a user"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        SELECT id, collection_name, collection_type, avatar_image_url, outfit_description, tags, created_at
-        FROM collections 
-        WHERE user_id = ?
-        ORDER BY created_at DESC
-    ''', (user_id,))
+    with transaction(user_id=user_id) as conn:
+        rows = conn.execute(f'''
+            SELECT {_COLLECTION_COLUMNS}
+            FROM collections 
+            WHERE user_id = ?
+            ORDER BY created_at DESC
+        ''', (user_id,)).fetchall()
     
     collections = []
-    for row in cursor.fetchall():
+    for row in rows:
         collections.append({
             'id': row['id'],
             'collection_name': row['collection_name'],
@@ -343,93 +1680,93 @@ def get_user_collections(user_id: int) -> List[Dict[str, Any]]:
             'created_at': row['created_at']
         })
     
-    conn.close()
     return collections
 
+def get_user_collections_page(user_id: int, cursor: str = None, page_size: int = DEFAULT_PAGE_SIZE) -> Dict[str, Any]:
+    """Get one newest-first page of the user's collections ({'items', 'next_cursor'})"""
+    return _fetch_page('collections', _COLLECTION_COLUMNS, ['user_id = ?'], [user_id], cursor, page_size)
+
 def delete_collection(user_id: int, collection_id: int) -> bool:
     """Delete a collection item"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        DELETE FROM collections
-        WHERE user_id = ? AND id = ?
-    ''', (user_id, collection_id))
-    
-    deleted_count = cursor.rowcount
-    conn.commit()
-    conn.close()
+    with transaction(write=True, user_id=user_id) as conn:
+        deleted_count = conn.execute('''
+            DELETE FROM collections
+            WHERE user_id = ? AND id = ?
+        ''', (user_id, collection_id)).rowcount
     
     return deleted_count > 0
 
+def _memo_weather(location: str, weather_data: Dict[str, Any], age_seconds: float = 0.0) -> None:
+    """Put a location's weather in the in-process tier, evicting the least recently used entry"""
+    with _weather_memo_lock:
+        _weather_memo[location] = (time.monotonic() - age_seconds, weather_data)
+        _weather_memo.move_to_end(location)
+        while len(_weather_memo) > WEATHER_MEMO_MAX_ENTRIES:
+            _weather_memo.popitem(last=False)
+
 def cache_weather(location: str, weather_data: Dict[str, Any]) -> None:
     """Cache weather data"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # Create weather cache table if it doesn't exist
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS weather_cache (
-            location TEXT PRIMARY KEY,
-            weather_data TEXT,
-            cached_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Insert or update weather data
-    cursor.execute('''
-        INSERT OR REPLACE INTO weather_cache (location, weather_data)
-        VALUES (?, ?)
-    ''', (location, json.dumps(weather_data)))
-    
-    conn.commit()
-    conn.close()
+    with transaction(write=True) as conn:
+        # Insert or update weather data
+        conn.execute('''
+            INSERT OR REPLACE INTO weather_cache (location, weather_data)
+            VALUES (?, ?)
+        ''', (location, json.dumps(weather_data)))
+    _memo_weather(location, dict(weather_data))
 
 def get_cached_weather(location: str, max_age_hours: int = 1) -> Optional[Dict[str, Any]]:
-    """Get cached weather data if it's not too old"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # Create weather cache table if it doesn't exist
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS weather_cache (
-            location TEXT PRIMARY KEY,
-            weather_data TEXT,
-            cached_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Get cached data
-    cursor.execute('''
-        SELECT weather_data, cached_at
-        FROM weather_cache
-        WHERE location = ?
-    ''', (location,))
+    """Get cached weather data if it's not too old (in-process tier first, then SQLite)"""
+    max_age_seconds = max_age_hours * 3600
+    with _weather_memo_lock:
+        entry = _weather_memo.get(location)
+        if entry and time.monotonic() - entry[0] <= max_age_seconds:
+            _weather_memo.move_to_end(location)
+            _weather_memo_stats['hits'] += 1
+            return dict(entry[1])
+        _weather_memo_stats['misses'] += 1
     
-    result = cursor.fetchone()
-    conn.close()
+    with transaction() as conn:
+        result = conn.execute('''
+            SELECT weather_data, cached_at
+            FROM weather_cache
+            WHERE location = ?
+        ''', (location,)).fetchone()
     
     if not result:
         return None
     
-    # Check if cache is still valid (within max_age_hours)
+    # Check if cache is still valid (cached_at is CURRENT_TIMESTAMP, i.e. UTC)
     cached_at = datetime.fromisoformat(result['cached_at'])
-    age_hours = (datetime.now() - cached_at).total_seconds() / 3600
+    age_seconds = (datetime.now(timezone.utc).replace(tzinfo=None) - cached_at).total_seconds()
     
-    if age_hours > max_age_hours:
+    if age_seconds > max_age_seconds:
         return None
     
-    return json.loads(result['weather_data'])
+    weather_data = json.loads(result['weather_data'])
+    _memo_weather(location, weather_data, age_seconds)
+    return dict(weather_data)
+
+def get_weather_cache_stats() -> Dict[str, Any]:
+    """Get hit/miss counters for the in-process weather tier"""
+    with _weather_memo_lock:
+        hits = _weather_memo_stats['hits']
+        misses = _weather_memo_stats['misses']
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / (hits + misses) if hits + misses else 0.0,
+            'entries': len(_weather_memo)
+        }
 
 def clear_weather_cache(location: str = None) -> None:
     """Clear weather cache for a specific location or all locations"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    if location:
-        cursor.execute('DELETE FROM weather_cache WHERE location = ?', (location,))
-    else:
-        cursor.execute('DELETE FROM weather_cache')
-    
-    conn.commit()
-    conn.close()
+    with transaction(write=True) as conn:
+        if location:
+            conn.execute('DELETE FROM weather_cache WHERE location = ?', (location,))
+        else:
+            conn.execute('DELETE FROM weather_cache')
+    with _weather_memo_lock:
+        if location:
+            _weather_memo.pop(location, None)
+        else:
+            _weather_memo.clear()
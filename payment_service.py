@@ -1,13 +1,41 @@
 """
 Payment service for AIstylist using Stripe
 """
+import json
 import os
+import threading
+import time
+from datetime import datetime
 import stripe
-from database import get_db_connection
+from database import transaction, BackgroundWriter, add_restore_listener
 
 # Initialize Stripe
 stripe.api_key = os.getenv("STRIPE_SECRET_KEY")
 
+# Per-user subscription status cache; webhooks that change a subscription evict it early
+SUBSCRIPTION_CACHE_TTL = float(os.getenv("SUBSCRIPTION_CACHE_TTL", "60"))  # seconds
+_status_cache = {}  # user_id -> (monotonic expiry, status dict)
+_status_cache_lock = threading.Lock()
+_status_cache_generation = 0  # Bumped on every invalidation so an in-flight read can't re-cache stale data
+
+def invalidate_subscription_status(user_id=None):
+    """Drop the cached status for one user (or everyone)"""
+    global _status_cache_generation
+    with _status_cache_lock:
+        _status_cache_generation += 1
+        if user_id is None:
+            _status_cache.clear()
+        else:
+            _status_cache.pop(int(user_id), None)
+
+# A restore can rewind subscriptions, so drop every cached status with it
+add_restore_listener(invalidate_subscription_status)
+
+def _customer_user_ids(conn, customer_id):
+    """Users linked to a Stripe customer"""
+    rows = conn.execute('SELECT user_id FROM subscriptions WHERE stripe_customer_id = ?', (customer_id,)).fetchall()
+    return [row['user_id'] for row in rows]
+
 def create_checkout_session(user_id, price_id="price_1234567890"):
     """Create Stripe checkout session"""
     try:
@@ -41,6 +69,141 @@ def create_customer_portal_session(customer_id):
         print(f"Customer portal error: {e}")
         return None
 
+def _period_end(timestamp):
+    """Convert a Stripe epoch timestamp (or None) to a datetime"""
+    return datetime.fromtimestamp(timestamp) if timestamp else None
+
+def _apply_event(conn, event):
+    """
+    Apply one Stripe event on conn (inside the caller's transaction).
+    Returns the user ids whose subscription changed, or None if the event was already processed.
+    """
+    # Stripe retries deliveries; the event id makes each one apply at most once
+    cursor = conn.execute(
+        'INSERT OR IGNORE INTO processed_events (event_id, event_type) VALUES (?, ?)',
+        (event['id'], event['type'])
+    )
+    if cursor.rowcount == 0:
+        return None
+    
+    if event['type'] == 'checkout.session.completed':
+        session = event['data']['object']
+        user_id = int(session['metadata']['user_id'])
+        details = session.get('subscription_details') or {}
+        
+        # Upsert: a user who never had a subscription row gets one on first checkout
+        conn.execute('''
+            INSERT INTO subscriptions (user_id, status, stripe_customer_id, stripe_subscription_id, current_period_end)
+            VALUES (?, 'active', ?, ?, ?)
+            ON CONFLICT (user_id) DO UPDATE SET
+                status = 'active',
+                stripe_customer_id = excluded.stripe_customer_id,
+                stripe_subscription_id = excluded.stripe_subscription_id,
+                current_period_end = excluded.current_period_end
+        ''', (
+            user_id,
+            session['customer'],
+            session['subscription'],
+            _period_end((details.get('metadata') or {}).get('current_period_end'))
+        ))
+        return [user_id]
+    
+    elif event['type'] == 'customer.subscription.updated':
+        subscription = event['data']['object']
+        conn.execute('''
+            UPDATE subscriptions 
+            SET status = ?, 
+                current_period_end = ?
+            WHERE stripe_customer_id = ?
+        ''', (
+            subscription['status'],
+            _period_end(subscription.get('current_period_end')),
+            subscription['customer']
+        ))
+        return _customer_user_ids(conn, subscription['customer'])
+    
+    elif event['type'] == 'customer.subscription.deleted':
+        subscription = event['data']['object']
+        conn.execute('''
+            UPDATE subscriptions 
+            SET status = 'cancelled'
+            WHERE stripe_customer_id = ?
+        ''', (subscription['customer'],))
+        return _customer_user_ids(conn, subscription['customer'])
+    
+    return []
+
+def apply_webhook_event(event):
+    """Apply one verified Stripe event; returns False if it was a duplicate delivery"""
+    with transaction(write=True) as conn:
+        user_ids = _apply_event(conn, event)
+    for user_id in user_ids or []:
+        invalidate_subscription_status(user_id)
+    return user_ids is not None
+
+def apply_webhook_events(events):
+    """Apply a burst of events in one transaction, falling back to one at a time if any fails"""
+    try:
+        changed = []
+        with transaction(write=True) as conn:
+            for event in events:
+                changed.extend(_apply_event(conn, event) or [])
+        for user_id in changed:
+            invalidate_subscription_status(user_id)
+    except Exception as e:
+        print(f"Webhook batch error, retrying events individually: {e}")
+        for event in events:
+            try:
+                apply_webhook_event(event)
+            except Exception as e:
+                # Stripe already got its 200 and will not redeliver; keep the event for replay
+                print(f"Webhook error ({event.get('id')}): {e}")
+                _record_failed_event(event, e)
+    return len(events)
+
+def _record_failed_event(event, error):
+    """Park an acknowledged event that could not be applied in failed_events (see replay_failed_events)"""
+    try:
+        with transaction(write=True) as conn:
+            conn.execute('''
+                INSERT INTO failed_events (event_id, event_type, payload, error)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (event_id) DO UPDATE SET
+                    error = excluded.error,
+                    attempts = attempts + 1,
+                    failed_at = CURRENT_TIMESTAMP
+            ''', (event.get('id'), event.get('type'), json.dumps(event, default=str), str(error)))
+    except Exception as e:
+        print(f"Could not record failed webhook event {event.get('id')}: {e}")
+
+def replay_failed_events():
+    """
+    Retry every parked webhook event, oldest first. Applied (or meanwhile processed) events are
+    removed; ones that fail again stay with their attempt count bumped. Returns {'applied', 'failed'}.
+    """
+    with transaction() as conn:
+        rows = conn.execute('SELECT event_id, payload FROM failed_events ORDER BY failed_at, event_id').fetchall()
+    result = {'applied': 0, 'failed': 0}
+    for row in rows:
+        event = json.loads(row['payload'])
+        try:
+            apply_webhook_event(event)
+        except Exception as e:
+            print(f"Webhook replay error ({row['event_id']}): {e}")
+            _record_failed_event(event, e)
+            result['failed'] += 1
+            continue
+        with transaction(write=True) as conn:
+            conn.execute('DELETE FROM failed_events WHERE event_id = ?', (row['event_id'],))
+        result['applied'] += 1
+    return result
+
+# STRIPE_WEBHOOK_ASYNC=1 acknowledges Stripe as soon as the signature checks out
+# and applies events from a local queue, a burst per transaction
+_webhook_writer = None
+if os.getenv("STRIPE_WEBHOOK_ASYNC", "").lower() in ("1", "true", "yes"):
+    _webhook_writer = BackgroundWriter(apply_webhook_events, name="stripe-webhooks")
+
 def handle_webhook(payload, signature):
     """Handle Stripe webhook events"""
     try:
@@ -49,68 +212,10 @@ def handle_webhook(payload, signature):
             payload, signature, webhook_secret
         )
         
-        if event['type'] == 'checkout.session.completed':
-            session = event['data']['object']
-            user_id = session['metadata']['user_id']
-            
-            # Update user subscription
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                UPDATE subscriptions 
-                SET status = 'active', 
-                    stripe_customer_id = ?, 
-                    stripe_subscription_id = ?,
-                    current_period_end = ?
-                WHERE user_id = ?
-            ''', (
-                session['customer'],
-                session['subscription'],
-                datetime.fromtimestamp(session['subscription_details']['metadata']['current_period_end']),
-                user_id
-            ))
-            
-            conn.commit()
-            conn.close()
-            
-        elif event['type'] == 'customer.subscription.updated':
-            subscription = event['data']['object']
-            customer_id = subscription['customer']
-            
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                UPDATE subscriptions 
-                SET status = ?, 
-                    current_period_end = ?
-                WHERE stripe_customer_id = ?
-            ''', (
-                subscription['status'],
-                datetime.fromtimestamp(subscription['current_period_end']),
-                customer_id
-            ))
-            
-            conn.commit()
-            conn.close()
-            
-        elif event['type'] == 'customer.subscription.deleted':
-            subscription = event['data']['object']
-            customer_id = subscription['customer']
-            
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                UPDATE subscriptions 
-                SET status = 'cancelled'
-                WHERE stripe_customer_id = ?
-            ''', (customer_id,))
-            
-            conn.commit()
-            conn.close()
-        
+        if _webhook_writer is not None:
+            _webhook_writer.submit(event)
+        elif not apply_webhook_event(event):
+            print(f"Skipping duplicate webhook event {event['id']}")
         return True
         
     except Exception as e:
@@ -118,16 +223,25 @@ def handle_webhook(payload, signature):
         return False
 
 def get_subscription_status(user_id):
-    """Get user's subscription status"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        SELECT * FROM subscriptions WHERE user_id = ?
-    ''', (user_id,))
+    """Get user's subscription status (cached for SUBSCRIPTION_CACHE_TTL seconds)"""
+    with _status_cache_lock:
+        cached = _status_cache.get(int(user_id))
+        generation = _status_cache_generation
+    if cached and cached[0] > time.monotonic():
+        return dict(cached[1])
     
-    subscription = cursor.fetchone()
-    conn.close()
+    status = _load_subscription_status(user_id)
+    with _status_cache_lock:
+        if generation == _status_cache_generation:
+            _status_cache[int(user_id)] = (time.monotonic() + SUBSCRIPTION_CACHE_TTL, status)
+    return dict(status)
+
+def _load_subscription_status(user_id):
+    """Read user's subscription status from the database"""
+    with transaction() as conn:
+        subscription = conn.execute('''
+            SELECT * FROM subscriptions WHERE user_id = ?
+        ''', (user_id,)).fetchone()
     
     if not subscription:
         return {
@@ -136,7 +250,6 @@ def get_subscription_status(user_id):
             'can_use_features': True
         }
     
-    from datetime import datetime
     now = datetime.now()
     trial_ends_at = datetime.fromisoformat(subscription['trial_ends_at']) if subscription['trial_ends_at'] else None
     
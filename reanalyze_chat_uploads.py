@@ -5,7 +5,7 @@ import os
 import sys
 sys.path.append('src')
 
-from database import get_user_images, save_uploaded_image
+from database import get_user_images, save_uploaded_images_many
 from generate_item import analyze_image
 from app import extract_item_info
 import json
@@ -14,6 +14,9 @@ def reanalyze_chat_uploads():
     """Re-analyze chat uploads that failed or have generic names"""
     items = get_user_images(1)
     
+    # Re-analysed rows are written together in one transaction at the end
+    updated_rows = []
+    
     for item in items:
         filename = item.get('filename', '')
         analysis_data = item.get('analysis', '{}')
@@ -57,14 +60,15 @@ def reanalyze_chat_uploads():
                             "image_url": item.get('url', '')
                         }
                         
-                        # Save to database
-                        save_uploaded_image(
-                            user_id=1,
-                            filename=filename,
-                            original_name=item.get('original_name', filename),
-                            url=item.get('url', ''),
-                            analysis=json.dumps(new_analysis)
-                        )
+                        # Queue for the batched database write
+                        updated_rows.append({
+                            'user_id': 1,
+                            'filename': filename,
+                            'original_name': item.get('original_name', filename),
+                            'url': item.get('url', ''),
+                            'analysis': json.dumps(new_analysis),
+                            'content_hash': item.get('content_hash')
+                        })
                         
                         # Save analysis text to file
                         txt_filename = filename.replace('.jpg', '.txt')
@@ -83,6 +87,10 @@ def reanalyze_chat_uploads():
                 
         except Exception as e:
             print(f"❌ Error processing {filename}: {e}")
+    
+    if updated_rows:
+        save_uploaded_images_many(updated_rows)
+        print(f"\n💾 Saved {len(updated_rows)} re-analyzed items")
 
 if __name__ == "__main__":
     reanalyze_chat_uploads()
@@ -8,6 +8,8 @@ import json
 import openai
 from typing import List, Dict, Any, Optional
 
+import keyword_tagger
+
 def load_closet_items(closet_dir: str) -> List[Dict[str, Any]]:
     """Load all clothing items with their descriptions."""
     items = []
@@ -42,20 +44,7 @@ def load_closet_items(closet_dir: str) -> List[Dict[str, Any]]:
 
 def detect_category(description: str) -> str:
     """Basic category detection as fallback."""
-    desc_lower = description.lower()
-    
-    if any(word in desc_lower for word in ['dress']):
-        return 'Dresses'
-    elif any(word in desc_lower for word in ['blouse', 'top', 'shirt', 't-shirt', 'sweater', 'hoodie', 'tank', 'crop', 'blazer', 'cardigan', 'pullover', 'polo', 'camisole', 'tunic']):
-        return 'Tops'
-    elif any(word in desc_lower for word in ['pants', 'skirt', 'jeans', 'shorts', 'trousers', 'leggings', 'capri', 'cargo', 'chinos']):
-        return 'Bottoms'
-    elif any(word in desc_lower for word in ['shoes', 'sneaker', 'boot', 'sandals', 'loafer', 'heel', 'sneakers', 'boots', 'flats', 'pumps', 'oxfords', 'mules', 'clogs', 'slippers']):
-        return 'Shoes'
-    elif any(word in desc_lower for word in ['jacket', 'coat', 'blazer', 'cardigan', 'sweater', 'hoodie', 'vest', 'windbreaker', 'trench', 'parka', 'bomber', 'denim jacket', 'leather jacket']):
-        return 'Outerwear'
-    else:
-        return 'Accessories'
+    return keyword_tagger.detect_category(description.lower())
 
 def create_outfit_selection_prompt(items: List[Dict[str, Any]], weather: Optional[str] = None, occasion: str = "casual") -> str:
     """Create a prompt for GPT-4o to select outfit combinations."""
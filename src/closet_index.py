@@ -0,0 +1,153 @@
+"""
+closet_index.py
+Persistent per-directory index of parsed closet descriptions (category, colors, materials, warmth).
+
+The index is a single JSON file under cache/ keyed by description file name together with its
+mtime and size, so only new or changed .txt files are read and parsed again. Loaded indexes are
+also kept in memory for the life of the process.
+"""
+
+import hashlib
+import json
+import os
+import threading
+
+INDEX_DIR = os.getenv('CLOSET_INDEX_DIR', os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'cache'))
+INDEX_FORMAT = 1
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+PENDING_DESCRIPTION = "Description not available yet."
+
+# closet dir -> {'version', 'entries': {txt name: entry}, 'fingerprint'}
+_indexes = {}
+_indexes_lock = threading.Lock()
+_stats = {'parsed': 0, 'reused': 0, 'writes': 0}
+
+def index_path(closet_dir):
+    """Location of the persisted index for a closet directory"""
+    key = hashlib.sha1(os.path.abspath(closet_dir).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(INDEX_DIR, f"closet_index_{key}.json")
+
+def _read_index(path, version):
+    """Load a persisted index in one read; anything unreadable or from another parser version is dropped"""
+    try:
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if data.get('format') != INDEX_FORMAT or data.get('version') != version:
+        return {}
+    return data.get('entries') or {}
+
+def _write_index(path, version, entries):
+    """Atomically replace the persisted index"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'format': INDEX_FORMAT, 'version': version, 'entries': entries}, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+    _stats['writes'] += 1
+
+def _scan(closet_dir):
+    """One directory pass: image names in listing order and {txt name: (mtime_ns, size)}"""
+    images = []
+    txt_stats = {}
+    with os.scandir(closet_dir) as it:
+        for entry in it:
+            name = entry.name
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                images.append(name)
+            elif name.endswith('.txt'):
+                st = entry.stat()
+                txt_stats[name] = (st.st_mtime_ns, st.st_size)
+    return images, txt_stats
+
+def load_closet_index(closet_dir, parse, version, image_prefix='/data/clothes/input/'):
+    """
+    Return one item dict per closet image, refreshing the index incrementally.
+
+    `parse(desc)` turns a description into a dict of features merged into the item; it is only
+    called for descriptions that are new or whose mtime/size changed. Bump `version` whenever
+    `parse` changes so stale entries are re-parsed. Images without a description come back as
+    'Pending' items and are not indexed.
+    """
+    closet_dir = os.path.abspath(closet_dir)
+    path = index_path(closet_dir)
+    images, txt_stats = _scan(closet_dir)
+
+    with _indexes_lock:
+        cached = _indexes.get(closet_dir)
+        if cached is None or cached['version'] != version:
+            cached = {'version': version, 'entries': _read_index(path, version)}
+            _indexes[closet_dir] = cached
+        old_entries = cached['entries']
+
+    entries = {}
+    changed = False
+    for img in images:
+        txt_name = os.path.splitext(img)[0] + '.txt'
+        stat = txt_stats.get(txt_name)
+        if stat is None or txt_name in entries:
+            continue
+        entry = old_entries.get(txt_name)
+        if entry is not None and entry['mtime_ns'] == stat[0] and entry['size'] == stat[1]:
+            _stats['reused'] += 1
+        else:
+            try:
+                with open(os.path.join(closet_dir, txt_name), encoding='utf-8') as f:
+                    desc = f.read()
+            except OSError:
+                continue
+            entry = dict(parse(desc), desc=desc, mtime_ns=stat[0], size=stat[1])
+            _stats['parsed'] += 1
+            changed = True
+        entries[txt_name] = entry
+    if len(entries) != len(old_entries):
+        changed = True
+
+    if changed:
+        with _indexes_lock:
+            cached['entries'] = entries
+        try:
+            _write_index(path, version, entries)
+        except OSError as e:
+            print(f"Could not write closet index {path}: {e}")
+
+    # Changes whenever an image or description is added, removed or edited
+    digest = hashlib.sha1()
+    for img in images:
+        entry = entries.get(os.path.splitext(img)[0] + '.txt')
+        digest.update(f"{img}\0{entry['mtime_ns']}:{entry['size']}\0".encode('utf-8') if entry else f"{img}\0-\0".encode('utf-8'))
+    with _indexes_lock:
+        cached['fingerprint'] = digest.hexdigest()
+
+    items = []
+    for img in images:
+        txt_name = os.path.splitext(img)[0] + '.txt'
+        entry = entries.get(txt_name)
+        if entry is None:
+            items.append({'file': txt_name, 'desc': PENDING_DESCRIPTION, 'image': image_prefix + img,
+                          'category': 'Pending'})
+            continue
+        item = {key: value for key, value in entry.items() if key not in ('mtime_ns', 'size')}
+        item['file'] = txt_name
+        item['image'] = image_prefix + img
+        items.append(item)
+    return items
+
+def closet_fingerprint(closet_dir):
+    """Digest of the closet's files as of the last load_closet_index call (None if never loaded)"""
+    with _indexes_lock:
+        cached = _indexes.get(os.path.abspath(closet_dir))
+        return cached.get('fingerprint') if cached else None
+
+def get_closet_index_stats():
+    """Counters for descriptions parsed vs reused from the index, and index file writes"""
+    return dict(_stats)
+
+def clear_closet_index(closet_dir=None):
+    """Forget in-memory indexes (one directory or all); persisted files are left alone"""
+    with _indexes_lock:
+        if closet_dir is None:
+            _indexes.clear()
+        else:
+            _indexes.pop(os.path.abspath(closet_dir), None)
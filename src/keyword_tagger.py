@@ -0,0 +1,292 @@
+"""
+keyword_tagger.py
+Single-pass keyword tagging shared by every description classifier (category, color, material, style, item type).
+
+All vocabularies are compiled into one trie-shaped regular expression. A scan finds every keyword
+occurrence in one pass with the same substring semantics as `keyword in text` (per-word results are
+memoised, since descriptions reuse a small vocabulary), and each vocabulary is then resolved in its
+own order, so the first-match-wins chains the classifiers used to run keep their results.
+"""
+
+import re
+
+# Distinct words whose keyword sets are remembered between scans
+WORD_MEMO_MAX_ENTRIES = 100000
+
+# Closet categories, in the order the old if/elif chains checked them
+CATEGORY_KEYWORDS = {
+    'Dresses': ['dress'],
+    'Tops': ['blouse', 'top', 'shirt', 't-shirt', 'sweater', 'hoodie', 'tank', 'crop', 'blazer', 'cardigan', 'pullover', 'polo', 'camisole', 'tunic'],
+    'Bottoms': ['pants', 'skirt', 'jeans', 'shorts', 'trousers', 'leggings', 'capri', 'cargo', 'chinos'],
+    'Shoes': ['shoes', 'sneaker', 'boot', 'sandals', 'loafer', 'heel', 'sneakers', 'boots', 'flats', 'pumps', 'oxfords', 'mules', 'clogs', 'slippers'],
+    'Outerwear': ['jacket', 'coat', 'blazer', 'cardigan', 'sweater', 'hoodie', 'vest', 'windbreaker', 'trench', 'parka', 'bomber', 'denim jacket', 'leather jacket'],
+    'Accessories': ['bag', 'handbag', 'backpack', 'purse', 'tote', 'clutch', 'satchel', 'hat', 'cap', 'scarf', 'belt', 'glove', 'accessory', 'jewelry', 'watch', 'sunglasses', 'necklace', 'bracelet', 'earrings', 'ring'],
+}
+
+# Display colors used to name uploaded items
+COLOR_KEYWORDS = {
+    'black': ['black', 'dark', 'charcoal', 'ebony'],
+    'white': ['white', 'cream', 'ivory', 'off-white'],
+    'blue': ['blue', 'navy', 'royal blue', 'sky blue', 'light blue', 'dark blue', 'powder blue', 'cobalt'],
+    'red': ['red', 'crimson', 'burgundy', 'maroon', 'scarlet', 'cherry'],
+    'green': ['green', 'emerald', 'forest green', 'mint', 'olive', 'sage', 'lime'],
+    'yellow': ['yellow', 'gold', 'mustard', 'lemon', 'amber'],
+    'pink': ['pink', 'rose', 'magenta', 'fuchsia', 'salmon'],
+    'purple': ['purple', 'violet', 'lavender', 'plum', 'mauve'],
+    'orange': ['orange', 'peach', 'coral', 'tangerine', 'apricot'],
+    'brown': ['brown', 'tan', 'beige', 'khaki', 'taupe', 'camel', 'mocha', 'chocolate'],
+    'gray': ['gray', 'grey', 'silver', 'slate', 'ash', 'pewter'],
+    'denim': ['denim', 'jean', 'indigo']
+}
+
+# Color families style_agent scores harmony with
+HARMONY_COLOR_KEYWORDS = {
+    'black': ['black', 'dark', 'charcoal', 'ebony'],
+    'white': ['white', 'cream', 'ivory', 'off-white'],
+    'blue': ['blue', 'navy', 'royal blue', 'sky blue'],
+    'red': ['red', 'crimson', 'burgundy', 'maroon'],
+    'green': ['green', 'emerald', 'forest green', 'mint'],
+    'yellow': ['yellow', 'gold', 'mustard', 'lemon'],
+    'pink': ['pink', 'rose', 'magenta', 'fuchsia'],
+    'purple': ['purple', 'violet', 'lavender', 'plum'],
+    'brown': ['brown', 'tan', 'beige', 'khaki', 'camel'],
+    'gray': ['gray', 'grey', 'silver', 'slate']
+}
+
+MATERIAL_KEYWORDS = {
+    'Cotton': ['cotton', 'cotton blend'],
+    'Wool': ['wool', 'woolen', 'wool blend'],
+    'Silk': ['silk', 'silk blend'],
+    'Denim': ['denim', 'jean'],
+    'Leather': ['leather', 'leather-like'],
+    'Knit': ['knit', 'knitted', 'knitwear'],
+    'Linen': ['linen', 'linen blend'],
+    'Polyester': ['polyester', 'poly blend'],
+    'Cashmere': ['cashmere'],
+    'Velvet': ['velvet', 'velvety'],
+    'Suede': ['suede', 'sueded'],
+    'Chiffon': ['chiffon'],
+    'Satin': ['satin', 'satin-like'],
+    'Mesh': ['mesh', 'net'],
+    'Fleece': ['fleece', 'fleecy']
+}
+
+STYLE_KEYWORDS = {
+    'Striped': ['striped', 'stripes', 'pinstriped'],
+    'Polka Dot': ['polka dot', 'dotted', 'spots'],
+    'Floral': ['floral', 'flower', 'botanical'],
+    'Plaid': ['plaid', 'tartan', 'checkered'],
+    'Solid': ['solid', 'plain'],
+    'Cropped': ['cropped', 'crop'],
+    'Oversized': ['oversized', 'oversize', 'loose'],
+    'Fitted': ['fitted', 'tailored', 'slim'],
+    'Long Sleeve': ['long sleeve', 'long-sleeve'],
+    'Short Sleeve': ['short sleeve', 'short-sleeve'],
+    'Sleeveless': ['sleeveless', 'tank'],
+    'Button-up': ['button-up', 'button up', 'buttoned'],
+    'Hoodie': ['hoodie', 'hooded'],
+    'Turtleneck': ['turtleneck', 'mock neck'],
+    'V-neck': ['v-neck', 'v neck'],
+    'Crew Neck': ['crew neck', 'crew-neck'],
+    'High Waist': ['high waist', 'high-waist'],
+    'Low Rise': ['low rise', 'low-rise'],
+    'Wide Leg': ['wide leg', 'wide-leg'],
+    'Skinny': ['skinny', 'slim fit'],
+    'Bootcut': ['bootcut', 'boot cut'],
+    'Straight': ['straight', 'straight leg'],
+    'A-line': ['a-line', 'a line'],
+    'Pencil': ['pencil', 'pencil skirt'],
+    'Maxi': ['maxi', 'long'],
+    'Mini': ['mini', 'short'],
+    'Midi': ['midi', 'mid-length']
+}
+
+ITEM_TYPE_KEYWORDS = {
+    'Shirt': ['shirt', 'button-up', 'button up', 'dress shirt', 'blouse'],
+    'T-shirt': ['t-shirt', 'tee', 't shirt'],
+    'Sweater': ['sweater', 'pullover', 'jumper'],
+    'Hoodie': ['hoodie', 'hooded sweatshirt'],
+    'Cardigan': ['cardigan'],
+    'Blazer': ['blazer', 'sport coat'],
+    'Tank Top': ['tank top', 'tank', 'camisole'],
+    'Crop Top': ['crop top', 'crop'],
+    'Jeans': ['jeans', 'denim'],
+    'Pants': ['pants', 'trousers'],
+    'Skirt': ['skirt'],
+    'Shorts': ['shorts'],
+    'Dress': ['dress'],
+    'Jacket': ['jacket', 'coat'],
+    'Sneakers': ['sneakers', 'sneaker', 'athletic shoes'],
+    'Boots': ['boots', 'boot'],
+    'Heels': ['heels', 'high heels', 'pumps'],
+    'Flats': ['flats', 'flat shoes'],
+    'Sandals': ['sandals', 'sandal'],
+    'Bag': ['bag', 'handbag', 'purse', 'tote'],
+    'Hat': ['hat', 'cap'],
+    'Scarf': ['scarf'],
+    'Belt': ['belt']
+}
+
+# Weather suitability cues behind style_agent.filter_by_weather
+WEATHER_KEYWORDS = {
+    'warm_prefer': ['lightweight', 'cotton', 'linen', 'short-sleeved', 'sleeveless', 'flowy', 'breathable'],
+    'warm_avoid': ['wool', 'thick', 'heavy', 'winter', 'warm'],
+    'cold_prefer': ['wool', 'thick', 'warm', 'long-sleeved', 'sweater', 'jacket', 'coat'],
+    'cold_avoid': ['sleeveless', 'thin', 'lightweight'],
+}
+
+# Slot preferences style_agent adds to coordination scores
+COORDINATION_KEYWORDS = {
+    'versatile': ['basic', 'solid', 'neutral', 'white', 'black', 'gray'],
+    'layering': ['tank', 'camisole', 't-shirt', 'blouse'],
+    'outer_layer': ['blazer', 'cardigan', 'jacket'],
+}
+
+# Fabric and construction cues behind style_agent's numeric warmth / breathability / water-resistance scores
+THERMAL_KEYWORDS = {
+    'insulated': ['puffer', 'padded', 'quilted', 'insulated', 'down-filled', 'fleece', 'sherpa', 'shearling', 'thermal'],
+    'knit': ['wool', 'cashmere', 'merino', 'knit', 'sweater', 'cardigan', 'turtleneck'],
+    'outer': ['coat', 'jacket', 'parka', 'blazer', 'anorak'],
+    'covered': ['long sleeve', 'long-sleeved', 'boots', 'trousers', 'jeans', 'scarf', 'gloves', 'beanie'],
+    'heavy': ['thick', 'heavy', 'chunky', 'winter', 'warm'],
+    'light': ['lightweight', 'thin', 'sheer', 'flowy', 'breathable', 'airy', 'summer', 'mesh'],
+    'exposed': ['sleeveless', 'short sleeve', 'short-sleeved', 'tank', 'camisole', 'shorts', 'sandals', 'crop'],
+    'breathable_fiber': ['linen', 'cotton', 'chiffon', 'silk', 'rayon', 'bamboo'],
+    'synthetic': ['polyester', 'nylon', 'acrylic', 'faux leather', 'vinyl'],
+    'waterproof': ['waterproof', 'raincoat', 'rain jacket', 'rain boots', 'gore-tex', 'rubber', 'wellington'],
+    'water_resistant': ['water-resistant', 'water resistant', 'water-repellent', 'windbreaker', 'trench', 'leather', 'shell'],
+}
+
+VOCABULARIES = {
+    'category': CATEGORY_KEYWORDS,
+    'color': COLOR_KEYWORDS,
+    'harmony_color': HARMONY_COLOR_KEYWORDS,
+    'material': MATERIAL_KEYWORDS,
+    'style': STYLE_KEYWORDS,
+    'item_type': ITEM_TYPE_KEYWORDS,
+    'weather': WEATHER_KEYWORDS,
+    'coordination': COORDINATION_KEYWORDS,
+    'thermal': THERMAL_KEYWORDS,
+}
+
+def _trie_pattern(node):
+    """Regex for a trie node; greedy so the longest keyword at a position wins"""
+    branches = [re.escape(char) + _trie_pattern(child) for char, child in node.items() if char != '']
+    if not branches:
+        return ''
+    if len(branches) == 1 and '' not in node:
+        return branches[0]
+    group = f"(?:{'|'.join(branches)})"
+    return f"{group}?" if '' in node else group
+
+class KeywordTagger:
+    """Compiled matcher for a set of ordered vocabularies ({name: {tag: [keywords]}})"""
+
+    def __init__(self, vocabularies, word_memo_size=WORD_MEMO_MAX_ENTRIES):
+        self.vocabularies = {name: [(tag, tuple(keywords)) for tag, keywords in vocab.items()]
+                             for name, vocab in vocabularies.items()}
+        # keyword -> indexes of the tags it belongs to (and the first of them), per vocabulary
+        self._tag_indexes = {}
+        self._first_tag_indexes = {}
+        for name, vocab in self.vocabularies.items():
+            index = {}
+            for i, (_, keywords) in enumerate(vocab):
+                for keyword in keywords:
+                    if i not in index.setdefault(keyword, []):
+                        index[keyword].append(i)
+            self._tag_indexes[name] = index
+            self._first_tag_indexes[name] = {keyword: positions[0] for keyword, positions in index.items()}
+        keywords = sorted({kw for vocab in self.vocabularies.values() for _, kws in vocab for kw in kws})
+        trie = {}
+        for keyword in keywords:
+            node = trie
+            for char in keyword:
+                node = node.setdefault(char, {})
+            node[''] = True
+        # The lookahead reports a match at every start position, so overlapping keywords are not lost
+        self._pattern = re.compile(f"(?=({_trie_pattern(trie)}))")
+        # Every keyword matching at a position is a prefix of the longest one found there
+        keyword_set = set(keywords)
+        self._prefixes = {kw: tuple(kw[:i] for i in range(1, len(kw) + 1) if kw[:i] in keyword_set)
+                          for kw in keywords}
+        # Keywords without whitespace can only occur inside one whitespace-separated word; a keyword
+        # with spaces can only occur where some word starts with the part after its last space
+        self._spaced = {}
+        for kw in keywords:
+            if ' ' in kw:
+                tail = kw.rsplit(' ', 1)[1]
+                self._spaced.setdefault(tail[0], []).append((kw, tail))
+        self._word_memo = {}
+        self._word_memo_size = word_memo_size
+
+    def _scan_word(self, word):
+        """(keywords inside word, spaced keywords that could end in a phrase starting with word)"""
+        found = set()
+        prefixes = self._prefixes
+        for longest in set(self._pattern.findall(word)):
+            found.update(prefixes[longest])
+        return frozenset(found), tuple(kw for kw, tail in self._spaced.get(word[0], ()) if word.startswith(tail))
+
+    def scan(self, text_lower):
+        """Set of every keyword occurring anywhere in already-lowercased text (substring semantics)"""
+        found = set()
+        phrases = set()
+        memo = self._word_memo
+        for word in set(text_lower.split()):
+            entry = memo.get(word)
+            if entry is None:
+                entry = self._scan_word(word)
+                if len(memo) >= self._word_memo_size:
+                    memo.clear()
+                memo[word] = entry
+            if entry[0]:
+                found |= entry[0]
+            if entry[1]:
+                phrases.update(entry[1])
+        for keyword in phrases:
+            if keyword in text_lower:
+                found.add(keyword)
+        return found
+
+    def first(self, vocabulary, found, default=None):
+        """First tag of a vocabulary, in vocabulary order, with any keyword in `found`"""
+        index = self._first_tag_indexes[vocabulary]
+        vocab = self.vocabularies[vocabulary]
+        best = len(vocab)
+        for keyword in found:
+            position = index.get(keyword, best)
+            if position < best:
+                best = position
+        return default if best == len(vocab) else vocab[best][0]
+
+    def all(self, vocabulary, found):
+        """Every tag of a vocabulary with any keyword in `found`, in vocabulary order"""
+        index = self._tag_indexes[vocabulary]
+        positions = set()
+        for keyword in found:
+            positions.update(index.get(keyword, ()))
+        vocab = self.vocabularies[vocabulary]
+        return [vocab[i][0] for i in sorted(positions)]
+
+    def tags(self, text_lower):
+        """{vocabulary: [tags in vocabulary order]} for already-lowercased text"""
+        found = self.scan(text_lower)
+        return {name: self.all(name, found) for name in self.vocabularies}
+
+TAGGER = KeywordTagger(VOCABULARIES)
+
+def scan(text_lower):
+    """Keywords of every shared vocabulary present in already-lowercased text"""
+    return TAGGER.scan(text_lower)
+
+def first_tag(vocabulary, found, default=None):
+    """First tag of a shared vocabulary matched by a scan result"""
+    return TAGGER.first(vocabulary, found, default)
+
+def all_tags(vocabulary, found):
+    """All tags of a shared vocabulary matched by a scan result"""
+    return TAGGER.all(vocabulary, found)
+
+def detect_category(text_lower, default='Accessories'):
+    """Closet category for already-lowercased text (Dresses, Tops, Bottoms, Shoes, Outerwear, Accessories)"""
+    return TAGGER.first('category', TAGGER.scan(text_lower), default)
@@ -3,41 +3,92 @@ style_agent.py
 Selects multiple outfit combinations from /data/clothes based on user needs (tags, weather, occasion).
 """
 
-import os
 import random
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from closet_index import load_closet_index, closet_fingerprint
+from keyword_tagger import scan, first_tag, all_tags, HARMONY_COLOR_KEYWORDS
+
+# Bump whenever describe_item changes so persisted closet indexes are re-parsed
+INDEX_VERSION = 4
+
+# select_multiple_outfits results, keyed by (closet fingerprint, weather, occasion, num, seed, forecast targets, time budget)
+RECOMMENDATION_MEMO_MAX_ENTRIES = 256
+_recommendation_memo = OrderedDict()
+_recommendation_memo_lock = threading.Lock()
+_recommendation_memo_stats = {'hits': 0, 'misses': 0}
+
+# Basic color harmony rules
+HARMONY_RULES = {
+    'black': ['white', 'gray', 'red', 'blue', 'green', 'yellow', 'pink', 'purple'],
+    'white': ['black', 'gray', 'blue', 'red', 'green', 'yellow', 'pink', 'purple'],
+    'gray': ['black', 'white', 'blue', 'red', 'green', 'yellow', 'pink', 'purple'],
+    'blue': ['white', 'gray', 'black', 'yellow', 'pink', 'green'],
+    'red': ['white', 'black', 'gray', 'blue', 'green'],
+    'green': ['white', 'black', 'gray', 'blue', 'red', 'yellow'],
+    'yellow': ['black', 'gray', 'blue', 'green', 'purple'],
+    'pink': ['white', 'gray', 'blue', 'green', 'purple'],
+    'purple': ['white', 'gray', 'yellow', 'pink', 'green']
+}
+
+COLOR_FAMILIES = list(HARMONY_COLOR_KEYWORDS)
+COLOR_INDEX = {color: i for i, color in enumerate(COLOR_FAMILIES)}
+
+def _harmony_matrix():
+    """[i, j]: score of a candidate color i next to an outfit color j (3 same, 2 harmonious, 0.5 neutral)"""
+    matrix = np.full((len(COLOR_FAMILIES), len(COLOR_FAMILIES)), 0.5)
+    for color, partners in HARMONY_RULES.items():
+        for partner in partners:
+            matrix[COLOR_INDEX[color], COLOR_INDEX[partner]] = 2
+    np.fill_diagonal(matrix, 3)
+    return matrix
+
+HARMONY_MATRIX = _harmony_matrix()
+
+# Row m is the one-hot color vector of color bitmask m
+MASK_ONEHOT = np.array([[(mask >> i) & 1 for i in range(len(COLOR_FAMILIES))]
+                        for mask in range(1 << len(COLOR_FAMILIES))], dtype=np.float64)
+
+def weather_flags(found):
+    """Whether a scanned description suits warm and cold weather (keyword rules of filter_by_weather)"""
+    cues = set(all_tags('weather', found))
+    return {
+        # Prioritize lightweight fabrics, short sleeves, thin clothing; exclude thick materials
+        'warm': 'warm_prefer' in cues or 'warm_avoid' not in cues,
+        # Prioritize thick fabrics and long sleeves; exclude thin materials
+        'cold': 'cold_prefer' in cues or 'cold_avoid' not in cues,
+    }
+
+def describe_item(desc):
+    """Parse a description into the features stored in the closet index."""
+    text = desc.lower()
+    found = scan(text)
+    cues = set(all_tags('weather', found))
+    if 'cold_prefer' in cues and 'warm_prefer' not in cues:
+        warmth = 'warm'
+    elif 'warm_prefer' in cues and 'cold_prefer' not in cues:
+        warmth = 'light'
+    else:
+        warmth = 'neutral'
+    return {
+        'category': first_tag('category', found, 'Accessories'),  # デフォルトをAccessoriesに変更
+        'colors': all_tags('harmony_color', found),
+        'color_mask': colors_to_mask(all_tags('harmony_color', found)),
+        'category_bonus': category_bonuses(found),
+        'materials': all_tags('material', found),
+        'warmth': warmth,
+        'weather_ok': weather_flags(found),
+        **thermal_scores(found),
+        'text': text,
+    }
 
 def load_closet_txts(closet_dir):
-    items = []
-    # Get all image files
-    image_files = [f for f in os.listdir(closet_dir) if f.lower().endswith(('.jpg', '.jpeg', '.png'))]
-    txt_files = set(f for f in os.listdir(closet_dir) if f.endswith('.txt'))
-    for img in image_files:
-        base = os.path.splitext(img)[0]
-        txt_name = base + '.txt'
-        img_path = '/data/clothes/input/' + img
-        if txt_name in txt_files:
-            with open(os.path.join(closet_dir, txt_name), encoding='utf-8') as f:
-                desc = f.read()
-            desc_lower = desc.lower()
-            if any(word in desc_lower for word in ['dress']):
-                category = 'Dresses'
-            elif any(word in desc_lower for word in ['blouse', 'top', 'shirt', 't-shirt', 'sweater', 'hoodie', 'tank', 'crop', 'blazer', 'cardigan', 'pullover', 'polo', 'camisole', 'tunic']):
-                category = 'Tops'
-            elif any(word in desc_lower for word in ['pants', 'skirt', 'jeans', 'shorts', 'trousers', 'leggings', 'capri', 'cargo', 'chinos', 'trousers']):
-                category = 'Bottoms'
-            elif any(word in desc_lower for word in ['shoes', 'sneaker', 'boot', 'sandals', 'loafer', 'heel', 'sneakers', 'boots', 'flats', 'pumps', 'oxfords', 'mules', 'clogs', 'slippers']):
-                category = 'Shoes'
-            elif any(word in desc_lower for word in ['jacket', 'coat', 'blazer', 'cardigan', 'sweater', 'hoodie', 'vest', 'windbreaker', 'trench', 'parka', 'bomber', 'denim jacket', 'leather jacket']):
-                category = 'Outerwear'
-            elif any(word in desc_lower for word in ['bag', 'handbag', 'backpack', 'purse', 'tote', 'clutch', 'satchel', 'hat', 'cap', 'scarf', 'belt', 'glove', 'accessory', 'jewelry', 'watch', 'sunglasses', 'necklace', 'bracelet', 'earrings', 'ring']):
-                category = 'Accessories'
-            else:
-                category = 'Accessories'  # デフォルトをAccessoriesに変更
-        else:
-            desc = "Description not available yet."
-            category = "Pending"
-        items.append({'file': txt_name, 'desc': desc, 'image': img_path, 'category': category})
-    return items
+    """Closet items ({file, desc, image, category} plus indexed features), parsing only changed descriptions."""
+    return load_closet_index(closet_dir, describe_item, INDEX_VERSION)
 
 def filter_by_weather(items, weather):
     """Filter items based on weather conditions."""
@@ -48,37 +99,23 @@ def filter_by_weather(items, weather):
     filtered_items = []
 
     for item in items:
-        desc = item['desc'].lower()
+        # Indexed items carry their keyword checks precomputed
+        weather_ok = item.get('weather_ok') or weather_flags(scan(item['desc'].lower()))
 
         # For warm weather
         if weather in ['warm', 'hot', 'summer']:
-            # Prioritize lightweight fabrics, short sleeves, thin clothing
-            if any(word in desc for word in ['lightweight', 'cotton', 'linen', 'short-sleeved', 'sleeveless', 'flowy', 'breathable']):
+            if weather_ok['warm']:
                 filtered_items.append(item)
-            # Exclude thick materials
-            elif any(word in desc for word in ['wool', 'thick', 'heavy', 'winter', 'warm']):
-                continue
-            else:
-                filtered_items.append(item)  # Include other clothing by default
 
         # For cold weather
         elif weather in ['cold', 'winter', 'cool']:
-            # Prioritize thick fabrics and long sleeves
-            if any(word in desc for word in ['wool', 'thick', 'warm', 'long-sleeved', 'sweater', 'jacket', 'coat']):
-                filtered_items.append(item)
-            # Exclude thin materials
-            elif any(word in desc for word in ['sleeveless', 'thin', 'lightweight']):
-                continue
-            else:
+            if weather_ok['cold']:
                 filtered_items.append(item)
 
         # For rainy weather
         elif weather in ['rainy', 'wet']:
-            # Prioritize waterproof materials
-            if any(word in desc for word in ['waterproof', 'water-resistant', 'nylon', 'polyester']):
-                filtered_items.append(item)
-            else:
-                filtered_items.append(item)
+            # Waterproof materials are welcome, but nothing is excluded
+            filtered_items.append(item)
 
         else:
             # If weather is unspecified, include all items
@@ -86,6 +123,88 @@ def filter_by_weather(items, weather):
 
     return filtered_items
 
+# Numeric weather model: every item gets warmth, breathability and water resistance in [0, 1]
+# at index time, and a forecast (get_weather_data's numbers) becomes a target for each
+THERMAL_BASE = (0.45, 0.5, 0.0)  # An item with no cues at all
+THERMAL_EFFECTS = {
+    # cue: (warmth, breathability, water resistance) added to the base
+    'insulated': (0.35, -0.2, 0.05),
+    'knit': (0.25, 0.0, 0.0),
+    'outer': (0.25, -0.05, 0.1),
+    'covered': (0.1, -0.05, 0.0),
+    'heavy': (0.2, -0.15, 0.0),
+    'light': (-0.2, 0.25, 0.0),
+    'exposed': (-0.2, 0.2, 0.0),
+    'breathable_fiber': (-0.05, 0.2, 0.0),
+    'synthetic': (0.0, -0.2, 0.15),
+    'waterproof': (0.0, -0.2, 0.8),
+    'water_resistant': (0.0, -0.05, 0.4),
+}
+WIND_CHILL_PER_KPH = 0.1        # Below 20°C, each km/h of wind over 5 feels 0.1°C colder
+HUMIDITY_HEAT_PER_PERCENT = 0.1  # From 20°C up, each % of humidity over 50 feels 0.1°C warmer
+WARMTH_TOLERANCE = 0.5           # Items further than this from the wanted warmth are filtered out
+WET_CONDITIONS = ['rain', 'drizzle', 'shower', 'sleet', 'snow', 'storm', 'thunder']
+WET_WEIGHT = 0.5                 # Ranking weight of water resistance when it is wet
+MUGGY_WEIGHT = 0.5               # Ranking weight of breathability when it is hot and humid
+
+def thermal_scores(found):
+    """Warmth, breathability and water resistance (0-1) of a scanned description."""
+    scores = list(THERMAL_BASE)
+    for cue in all_tags('thermal', found):
+        for i, effect in enumerate(THERMAL_EFFECTS[cue]):
+            scores[i] += effect
+    warmth, breathability, water_resistance = (round(min(1.0, max(0.0, score)), 4) for score in scores)
+    return {'warmth_score': warmth, 'breathability': breathability, 'water_resistance': water_resistance}
+
+def forecast_targets(forecast):
+    """
+    What a forecast asks of clothes, from get_weather_data's temperature (°C), humidity (%),
+    wind_speed (km/h) and condition: the wanted warmth (0.1 at 30°C felt, 0.9 at 0°C felt) and how
+    much water resistance (`wet`) and breathability (`muggy`) matter, each 0-1.
+    """
+    temperature = float(forecast.get('temperature', 22))
+    humidity = float(forecast.get('humidity', 60))
+    wind_speed = float(forecast.get('wind_speed', 10))
+    condition = (forecast.get('condition') or '').lower()
+    if temperature < 20:
+        feels_like = temperature - WIND_CHILL_PER_KPH * max(0.0, wind_speed - 5)
+    else:
+        feels_like = temperature + HUMIDITY_HEAT_PER_PERCENT * max(0.0, humidity - 50)
+    return {
+        'feels_like': round(feels_like, 1),
+        'warmth': round(min(0.9, max(0.1, 0.1 + (30 - feels_like) / 30 * 0.8)), 4),
+        'wet': 1.0 if any(word in condition for word in WET_CONDITIONS) or humidity >= 90 else 0.0,
+        'muggy': round(min(1.0, max(0.0, (feels_like - 22) / 10)) * humidity / 100, 4),
+    }
+
+def _thermal(item):
+    """(warmth, breathability, water resistance) of an item (indexed items carry them precomputed)"""
+    if 'warmth_score' not in item:
+        item = thermal_scores(scan(item['desc'].lower()))
+    return item['warmth_score'], item['breathability'], item['water_resistance']
+
+def forecast_fit(items, forecast):
+    """
+    Vectorized weather check of every item against a forecast: (suitable, fit) NumPy arrays.
+
+    An item is suitable when its warmth is within WARMTH_TOLERANCE of the wanted warmth; fit ranks
+    items by closeness in warmth plus water resistance when wet and breathability when muggy.
+    """
+    targets = forecast_targets(forecast)
+    scores = np.array([_thermal(item) for item in items], dtype=np.float64).reshape(-1, 3)
+    warmth, breathability, water_resistance = scores.T
+    distance = np.abs(warmth - targets['warmth'])
+    fit = -distance + WET_WEIGHT * targets['wet'] * water_resistance + MUGGY_WEIGHT * targets['muggy'] * breathability
+    return distance <= WARMTH_TOLERANCE, fit
+
+def filter_by_forecast(items, forecast):
+    """Items suitable for a forecast (a get_weather_data dict), best fitting first."""
+    if not items:
+        return []
+    suitable, fit = forecast_fit(items, forecast)
+    order = np.argsort(-fit, kind='stable')
+    return [items[i] for i in order[suitable[order]]]
+
 def select_outfit(criteria, closet_dir="data/clothes/input"):
     items = load_closet_txts(closet_dir)
 
@@ -97,9 +216,10 @@ def select_outfit(criteria, closet_dir="data/clothes/input"):
     print(f"Available items after weather filtering: {len(items)}")
 
     # Classify by category
-    dress = [i for i in items if "dress" in i['desc'].lower()]
-    tops = [i for i in items if "blouse" in i['desc'].lower() or "top" in i['desc'].lower() or "shirt" in i['desc'].lower()]
-    bottoms = [i for i in items if "pants" in i['desc'].lower() or "skirt" in i['desc'].lower()]
+    texts = [i.get('text') or i['desc'].lower() for i in items]
+    dress = [i for i, text in zip(items, texts) if "dress" in text]
+    tops = [i for i, text in zip(items, texts) if "blouse" in text or "top" in text or "shirt" in text]
+    bottoms = [i for i, text in zip(items, texts) if "pants" in text or "skirt" in text]
 
     print(f"Found {len(dress)} dresses, {len(tops)} tops, {len(bottoms)} bottoms")
 
@@ -119,15 +239,42 @@ def select_outfit(criteria, closet_dir="data/clothes/input"):
         print("Recommended outfit: []")
         return []
 
-def select_multiple_outfits(num=4, closet_dir="data/clothes/input", criteria=None):
+def select_multiple_outfits(num=4, closet_dir="data/clothes/input", criteria=None, time_budget=None, seed=None,
+                            memoise=True):
     """
     Returns up to `num` unique outfit combinations (each as a list of filenames).
-    Ensures variety by shuffling and picking different items.
+    The best-scoring outfits are found by search_outfits, which keeps them varied. When it is
+    cool, add_layering_items then puts a base layer under a sweater, hoodie, cardigan or blazer.
+
+    A `seed` drives one random.Random that gives every item a small random handicap in the search
+    (SEARCH_JITTER) and makes the weighted top-3 base-layer picks; the same seed repeats its
+    outfits, a different one surfaces other near-best outfits, and no seed gives the unjittered
+    best. Results are memoised per closet state, weather, occasion, num, seed and time budget;
+    pass memoise=False for one-off seeds that will never be asked for again.
+
+    When criteria carry a numeric 'temperature' (with optional 'humidity', 'wind_speed' and
+    'condition', as get_weather_data returns them), items are filtered with the numeric warmth
+    model instead of the 'weather' keywords.
     """
     items = load_closet_txts(closet_dir)
     # Filter by weather if criteria is provided
     weather = criteria.get('weather') if criteria and isinstance(criteria, dict) else None
-    items = filter_by_weather(items, weather)
+    occasion = criteria.get('occasion') if criteria and isinstance(criteria, dict) else None
+    forecast = criteria if criteria and isinstance(criteria, dict) and criteria.get('temperature') is not None else None
+    # Forecasts asking the same of clothes share one memo entry
+    targets = None
+    if forecast:
+        targets = forecast_targets(forecast)
+        targets = (targets['warmth'], targets['wet'], targets['muggy'])
+
+    # A shorter time budget may stop the search early, so it only shares entries with the same budget
+    time_budget = SEARCH_TIME_BUDGET if time_budget is None else time_budget
+    key = (closet_fingerprint(closet_dir), (weather or '').lower(), (occasion or '').lower(), num, seed, targets, time_budget)
+    cached = _memo_get(key) if memoise else None
+    if cached is not None:
+        return cached
+
+    items = filter_by_forecast(items, forecast) if forecast else filter_by_weather(items, weather)
 
     # Group items by category for balanced selection
     items_by_category = {}
@@ -137,260 +284,361 @@ def select_multiple_outfits(num=4, closet_dir="data/clothes/input", criteria=Non
             items_by_category[category] = []
         items_by_category[category].append(item)
 
+    rng = random.Random(seed) if seed is not None else None
+    results = search_outfits(items_by_category, k=num, time_budget=time_budget, rng=rng)
+    # Layering is a post-step: the search fills one slot per category
+    if forecast:
+        layering_weather = 'cool' if forecast_targets(forecast)['feels_like'] <= LAYERING_FEELS_LIKE else None
+    else:
+        layering_weather = weather
+    # One index for every outfit; each base layer goes under at most one of them
+    index = AssemblyIndex(items_by_category)
+    base_layers_used = set()
     outfits = []
-    used = set()
-    
-    # Try to generate as many unique outfits as possible
-    for _ in range(num):
-        outfit = select_balanced_outfit(items_by_category, used)
-        if outfit:
-            outfits.append(outfit)
-            used.update(outfit)
-        else:
-            break  # No more unique combinations possible
-    
+    for result in results:
+        outfit = add_layering_items(result['files'], items_by_category, base_layers_used,
+                                    weather=layering_weather, rng=rng, index=index)
+        base_layers_used.update(outfit[:len(outfit) - len(result['files'])])
+        outfits.append(outfit)
+    if memoise:
+        _memo_put(key, outfits)
     return outfits
 
-def select_balanced_outfit(items_by_category, used_items):
-    """Select an outfit with smart color coordination and layering."""
-    outfit = []
-    
-    # Priority order for categories
-    category_priority = ['Dresses', 'Tops', 'Bottoms', 'Shoes', 'Outerwear', 'Accessories']
-    
-    # Try to select from each category with smart coordination
-    for category in category_priority:
-        if category in items_by_category:
-            category_items = [item for item in items_by_category[category] if item['file'] not in used_items]
-            if category_items:
-                # For dresses, we might want to use only dress (not top+bottom)
-                if category == 'Dresses' and len(outfit) == 0:
-                    selected_item = smart_select_item(category_items, outfit, category)
-                    if selected_item:
-                        outfit.append(selected_item['file'])
-                    break
-                elif category != 'Dresses':
-                    selected_item = smart_select_item(category_items, outfit, category)
-                    if selected_item:
-                        outfit.append(selected_item['file'])
-    
-    # Add layering items if appropriate (only if it enhances the outfit)
-    outfit = add_layering_items(outfit, items_by_category, used_items, weather=criteria.get('weather') if criteria and isinstance(criteria, dict) else None)
-    
-    # If we don't have enough items, add more from any category
-    all_available = []
-    for category_items in items_by_category.values():
-        for item in category_items:
-            if item['file'] not in used_items and item['file'] not in outfit:
-                all_available.append(item)
-    
-    while len(outfit) < 4 and len(outfit) < len(all_available):
-        if all_available:
-            selected_item = smart_select_item(all_available, outfit, 'Any')
-            if selected_item:
-                outfit.append(selected_item['file'])
-                all_available.remove(selected_item)
-            else:
-                break
-        else:
-            break
-    
-    return outfit
+def _memo_get(key):
+    """Copy of a memoised recommendation, or None"""
+    with _recommendation_memo_lock:
+        outfits = _recommendation_memo.get(key)
+        if outfits is None:
+            _recommendation_memo_stats['misses'] += 1
+            return None
+        _recommendation_memo.move_to_end(key)
+        _recommendation_memo_stats['hits'] += 1
+        return [list(outfit) for outfit in outfits]
 
-def smart_select_item(candidates, current_outfit, category):
-    """Select an item that coordinates well with the current outfit."""
-    if not candidates:
-        return None
-    
-    # If no items in outfit yet, select randomly
-    if not current_outfit:
-        return random.choice(candidates)
-    
-    # Score each candidate based on coordination
-    scored_candidates = []
-    for item in candidates:
-        score = calculate_coordination_score(item, current_outfit, category)
-        scored_candidates.append((item, score))
-    
-    # Sort by score (higher is better) and add some randomness
-    scored_candidates.sort(key=lambda x: x[1], reverse=True)
-    
-    # Select from top 3 candidates with weighted randomness
-    top_candidates = scored_candidates[:min(3, len(scored_candidates))]
-    weights = [max(0.1, score) for _, score in top_candidates]
-    
+def _memo_put(key, outfits):
+    """Remember a recommendation, evicting the least recently used beyond the cap"""
+    with _recommendation_memo_lock:
+        _recommendation_memo[key] = [list(outfit) for outfit in outfits]
+        _recommendation_memo.move_to_end(key)
+        while len(_recommendation_memo) > RECOMMENDATION_MEMO_MAX_ENTRIES:
+            _recommendation_memo.popitem(last=False)
+
+def get_recommendation_cache_stats():
+    """Hit/miss counters for memoised select_multiple_outfits results"""
+    with _recommendation_memo_lock:
+        hits = _recommendation_memo_stats['hits']
+        misses = _recommendation_memo_stats['misses']
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / (hits + misses) if hits + misses else 0.0,
+            'entries': len(_recommendation_memo)
+        }
+
+def clear_recommendation_cache():
+    """Forget memoised recommendations"""
+    with _recommendation_memo_lock:
+        _recommendation_memo.clear()
+
+LAYER_WORDS = ['sweater', 'hoodie', 'cardigan', 'blazer']
+LAYERING_FEELS_LIKE = 15  # °C felt at or below which forecasts count as 'cool' for layering
+BASE_LAYER_WORDS = ['tank', 'camisole', 't-shirt', 'blouse', 'shirt']
+
+def pick_top(candidates, scores, rng=None):
+    """
+    One of the 3 best-scoring candidates, weighted by score (uniform over all candidates if every
+    score is <= 0); `rng` (random.Random) makes the pick reproducible, and without it the best one is taken.
+    """
+    top = top_indices(scores, 3)
+    if rng is None:
+        return candidates[top[0]]
+    weights = [max(0.1, float(scores[i])) for i in top]
     if weights and sum(weights) > 0:
-        selected = random.choices([item for item, _ in top_candidates], weights=weights)[0]
-        return selected
+        return rng.choices([candidates[i] for i in top], weights=weights)[0]
+    return rng.choice(candidates)
+
+def top_indices(scores, n):
+    """Indexes of the n highest scores, best first; ties keep their original order like a stable sort"""
+    if len(scores) > n:
+        threshold = np.partition(scores, len(scores) - n)[len(scores) - n]
+        top = np.flatnonzero(scores >= threshold)
     else:
-        return random.choice(candidates)
+        top = np.arange(len(scores))
+    return top[np.argsort(-scores[top], kind='stable')][:n]
 
-def calculate_coordination_score(item, current_outfit, category):
-    """Calculate how well an item coordinates with the current outfit."""
-    score = 0
-    
-    # Extract color information from item description
-    item_colors = extract_colors(item['desc'])
-    
-    # Check color coordination with existing items
+def _color_mask(item):
+    """Bitmask of an item's color families (indexed items carry it precomputed)"""
+    mask = item.get('color_mask')
+    if mask is None:
+        mask = colors_to_mask(extract_colors(item['desc']))
+    return mask
+
+def _category_bonus(item, category):
+    """Slot-specific preference bonus for an item (indexed items carry it precomputed)"""
+    bonus = item.get('category_bonus')
+    if bonus is None:
+        bonus = category_bonuses(scan(item['desc'].lower()))
+    return bonus.get(category, 0)
+
+def coordination_scores(candidates, current_outfit, category, items_by_file=None):
+    """
+    Coordination score of every candidate with the current outfit, as a NumPy array.
+
+    Colors are one-hot vectors over COLOR_FAMILIES, so the harmony of each candidate with every
+    outfit item is one matrix-vector product; outfit items are looked up in `items_by_file`
+    (files not found there contribute no colors).
+    """
+    outfit_colors = np.zeros(len(COLOR_FAMILIES))
     for outfit_item in current_outfit:
-        # This is a simplified check - in a real system, you'd parse the actual item data
-        outfit_colors = extract_colors_from_filename(outfit_item)  # Simplified
-        color_score = calculate_color_harmony(item_colors, outfit_colors)
-        score += color_score
+        item = items_by_file.get(outfit_item) if items_by_file else None
+        if item is not None:
+            outfit_colors += MASK_ONEHOT[_color_mask(item)]
+    masks = np.fromiter((_color_mask(item) for item in candidates), dtype=np.int64, count=len(candidates))
+    scores = (MASK_ONEHOT @ (HARMONY_MATRIX @ outfit_colors))[masks]
     
     # Category-specific scoring
-    if category == 'Tops':
-        # Prefer versatile tops that can be layered
-        if any(word in item['desc'].lower() for word in ['basic', 'solid', 'neutral', 'white', 'black', 'gray']):
-            score += 2
-        # Prefer layering-friendly items
-        if any(word in item['desc'].lower() for word in ['tank', 'camisole', 't-shirt', 'blouse']):
-            score += 1
-    elif category == 'Outerwear':
-        # Prefer outerwear that complements the base outfit
-        if any(word in item['desc'].lower() for word in ['blazer', 'cardigan', 'jacket']):
-            score += 1
-    elif category == 'Accessories':
+    if category == 'Accessories':
         # Prefer accessories that add interest without clashing
-        score += 0.5  # Neutral score for accessories
-    
-    return score
+        scores += 0.5  # Neutral score for accessories
+    elif category in ('Tops', 'Outerwear'):
+        scores += np.fromiter((_category_bonus(item, category) for item in candidates),
+                              dtype=np.float64, count=len(candidates))
+    return scores
 
 def extract_colors(description):
     """Extract color information from item description."""
-    colors = []
-    color_keywords = {
-        'black': ['black', 'dark', 'charcoal', 'ebony'],
-        'white': ['white', 'cream', 'ivory', 'off-white'],
-        'blue': ['blue', 'navy', 'royal blue', 'sky blue'],
-        'red': ['red', 'crimson', 'burgundy', 'maroon'],
-        'green': ['green', 'emerald', 'forest green', 'mint'],
-        'yellow': ['yellow', 'gold', 'mustard', 'lemon'],
-        'pink': ['pink', 'rose', 'magenta', 'fuchsia'],
-        'purple': ['purple', 'violet', 'lavender', 'plum'],
-        'brown': ['brown', 'tan', 'beige', 'khaki', 'camel'],
-        'gray': ['gray', 'grey', 'silver', 'slate']
-    }
-    
-    desc_lower = description.lower()
-    for color, keywords in color_keywords.items():
-        if any(keyword in desc_lower for keyword in keywords):
-            colors.append(color)
-    
-    return colors
+    return all_tags('harmony_color', scan(description.lower()))
 
-def extract_colors_from_filename(filename):
-    """Simplified color extraction from filename (placeholder)."""
-    # In a real implementation, you'd parse the actual item data
-    return []
+def colors_to_mask(colors):
+    """Bitmask over COLOR_FAMILIES for a list of color families"""
+    mask = 0
+    for color in colors:
+        mask |= 1 << COLOR_INDEX[color]
+    return mask
 
-def calculate_color_harmony(colors1, colors2):
-    """Calculate color harmony score between two sets of colors."""
-    if not colors1 or not colors2:
-        return 0
-    
-    # Basic color harmony rules
-    harmony_rules = {
-        'black': ['white', 'gray', 'red', 'blue', 'green', 'yellow', 'pink', 'purple'],
-        'white': ['black', 'gray', 'blue', 'red', 'green', 'yellow', 'pink', 'purple'],
-        'gray': ['black', 'white', 'blue', 'red', 'green', 'yellow', 'pink', 'purple'],
-        'blue': ['white', 'gray', 'black', 'yellow', 'pink', 'green'],
-        'red': ['white', 'black', 'gray', 'blue', 'green'],
-        'green': ['white', 'black', 'gray', 'blue', 'red', 'yellow'],
-        'yellow': ['black', 'gray', 'blue', 'green', 'purple'],
-        'pink': ['white', 'gray', 'blue', 'green', 'purple'],
-        'purple': ['white', 'gray', 'yellow', 'pink', 'green']
+def category_bonuses(found):
+    """Per-slot preference bonuses for a scanned description."""
+    cues = set(all_tags('coordination', found))
+    return {
+        # Prefer versatile tops that can be layered, and layering-friendly items
+        'Tops': 2 * ('versatile' in cues) + 1 * ('layering' in cues),
+        # Prefer outerwear that complements the base outfit
+        'Outerwear': 1 * ('outer_layer' in cues),
     }
-    
-    score = 0
-    for color1 in colors1:
-        for color2 in colors2:
-            if color1 == color2:
-                score += 3  # Same color
-            elif color2 in harmony_rules.get(color1, []):
-                score += 2  # Harmonious colors
-            else:
-                score += 0.5  # Neutral
-    
-    return score
 
-def add_layering_items(outfit, items_by_category, used_items, weather=None):
-    """Add layering items only if it enhances the outfit and is weather-appropriate."""
+# Outfit search: a base (a dress, or a top and bottom) plus shoes, outerwear and one accessory
+OUTFIT_PLANS = (
+    ('Dresses', 'Shoes', 'Outerwear', 'Accessories'),
+    ('Tops', 'Bottoms', 'Shoes', 'Outerwear', 'Accessories'),
+)
+BASE_SLOTS = {'Dresses', 'Tops', 'Bottoms'}
+SEARCH_BEAM_WIDTH = 8
+SEARCH_SLOT_CANDIDATES = 200   # Per-category cap after compatibility pruning
+SEARCH_TIME_BUDGET = 0.5       # Seconds
+DIVERSITY_PENALTY = 4.0        # Score taken off an item for each earlier outfit that used it
+SEARCH_JITTER = 3.0            # Largest random handicap per item when a seed is given
+
+# Pair harmony scored both ways round, so an outfit's score does not depend on slot order
+PAIR_MATRIX = (HARMONY_MATRIX + HARMONY_MATRIX.T) / 2
+
+def slot_bonus(item, category):
+    """Preference bonus an item earns in its slot (same bonuses as coordination_scores)"""
+    if category == 'Accessories':
+        return 0.5
+    return _category_bonus(item, category) if category in ('Tops', 'Outerwear') else 0
+
+def score_outfit(outfit_items):
+    """Whole-outfit score: pairwise color harmony between every two items plus slot bonuses."""
+    colors = MASK_ONEHOT[[_color_mask(item) for item in outfit_items]]
+    pairs = colors @ PAIR_MATRIX @ colors.T
+    return float((pairs.sum() - np.trace(pairs)) / 2 + sum(slot_bonus(item, item['category']) for item in outfit_items))
+
+def _search_slots(items_by_category, slot_candidates):
+    """Per category: (items, one-hot colors, colors @ PAIR_MATRIX, bonuses), pruned to the most compatible"""
+    categories = {category for plan in OUTFIT_PLANS for category in plan}
+    closet_colors = np.zeros(len(COLOR_FAMILIES))
+    arrays = {}
+    for category in categories:
+        items = items_by_category.get(category) or []
+        if not items:
+            continue
+        colors = MASK_ONEHOT[np.fromiter((_color_mask(item) for item in items), dtype=np.int64, count=len(items))]
+        bonus = np.fromiter((slot_bonus(item, category) for item in items), dtype=np.float64, count=len(items))
+        arrays[category] = (items, colors, bonus)
+        closet_colors += colors.sum(axis=0)
+    slots = {}
+    for category, (items, colors, bonus) in arrays.items():
+        pairwise = colors @ PAIR_MATRIX
+        if len(items) > slot_candidates:
+            # Keep the items that go best with the closet as a whole
+            affinity = pairwise @ (closet_colors / max(1, closet_colors.sum())) + bonus
+            keep = np.sort(top_indices(affinity, slot_candidates))
+            items = [items[i] for i in keep]
+            colors, pairwise, bonus = colors[keep], pairwise[keep], bonus[keep]
+        slots[category] = (items, colors, pairwise, bonus)
+    return slots
+
+def _beam_search(slots, penalties, beam_width):
+    """Best outfit under the current diversity penalties: (penalized score, score, [(category, index)])"""
+    plans = [plan for plan in OUTFIT_PLANS if all(c in slots for c in plan if c in BASE_SLOTS)]
+    if not plans:
+        # No complete base: take whatever the closet has
+        plans = [('Dresses', 'Tops', 'Bottoms', 'Shoes', 'Outerwear', 'Accessories')]
+    finished = []
+    for plan in plans:
+        # State: (penalized score, score, summed one-hot colors, picks)
+        beam = [(0.0, 0.0, np.zeros(len(COLOR_FAMILIES)), ())]
+        for category in plan:
+            if category not in slots:
+                continue
+            items, colors, pairwise, bonus = slots[category]
+            expanded = []
+            for penalized, score, color_sum, picks in beam:
+                gain = pairwise @ color_sum + bonus
+                ranked = gain - penalties[category]
+                for i in top_indices(ranked, beam_width):
+                    expanded.append((penalized + ranked[i], score + gain[i], color_sum + colors[i],
+                                     picks + ((category, int(i)),)))
+            expanded.sort(key=lambda state: -state[0])
+            beam = expanded[:beam_width]
+        finished.extend(state for state in beam if state[3])
+    if not finished:
+        return None
+    best = max(finished, key=lambda state: state[0])
+    return best[0], best[1], list(best[3])
+
+def search_outfits(items_by_category, k=4, beam_width=SEARCH_BEAM_WIDTH, time_budget=SEARCH_TIME_BUDGET,
+                   slot_candidates=SEARCH_SLOT_CANDIDATES, diversity_penalty=DIVERSITY_PENALTY, rng=None):
+    """
+    Return up to k outfits as [{'files': [...], 'score': float}], the best one first.
+
+    Each outfit is the best a beam search over the slots can find once items used by earlier
+    outfits are penalized, so the results are strong and varied. Searching stops early when the
+    time budget (seconds) runs out or no new combination turns up. Passing `rng` (random.Random)
+    adds a small random handicap to every item, so different seeds surface different near-best
+    outfits while the same seed repeats its results.
+    """
+    deadline = time.perf_counter() + time_budget
+    slots = _search_slots(items_by_category, slot_candidates)
+    if rng is not None:
+        noise = np.random.default_rng(rng.getrandbits(64))
+        penalties = {category: noise.random(len(slot[0])) * SEARCH_JITTER for category, slot in sorted(slots.items())}
+    else:
+        penalties = {category: np.zeros(len(slot[0])) for category, slot in slots.items()}
+    results = []
+    seen = set()
+    while len(results) < k and time.perf_counter() < deadline:
+        best = _beam_search(slots, penalties, beam_width)
+        if best is None:
+            break
+        _, score, picks = best
+        files = [slots[category][0][i]['file'] for category, i in picks]
+        if frozenset(files) in seen:
+            break
+        seen.add(frozenset(files))
+        results.append({'files': files, 'score': round(float(score), 6)})
+        for category, i in picks:
+            penalties[category][i] += diversity_penalty
+    return results
+
+class AssemblyIndex:
+    """
+    Flat, array-backed view of items_by_category for assembling outfits around search results.
+
+    Items are numbered in items_by_category order; `position` maps a file to its number and
+    `items_by_file` to its item, `by_category` holds each category's numbers as an array, and
+    color masks and layering cues are precomputed per item. Availability is a boolean array over
+    the numbers, so excluding used items is a single vectorized operation.
+    """
+
+    def __init__(self, items_by_category):
+        self.items = []
+        self.by_category = {}
+        for category, items in items_by_category.items():
+            start = len(self.items)
+            self.items.extend(items)
+            self.by_category[category] = np.arange(start, len(self.items))
+        self.position = {item['file']: i for i, item in enumerate(self.items)}
+        self.items_by_file = {item['file']: item for item in self.items}
+        self.masks = np.fromiter((_color_mask(item) for item in self.items), dtype=np.int64, count=len(self.items))
+        texts = [item.get('text') or item['desc'].lower() for item in self.items]
+        self.layer = np.array([any(word in text for word in LAYER_WORDS) for text in texts], dtype=bool)
+        self.base_layer = np.array([any(word in text for word in BASE_LAYER_WORDS) for text in texts], dtype=bool)
+
+    def available(self, used_items=()):
+        """Availability bitset with every known file in `used_items` cleared"""
+        available = np.ones(len(self.items), dtype=bool)
+        available[self.positions(used_items)] = False
+        return available
+
+    def positions(self, outfit):
+        """Item numbers of the outfit files this index knows"""
+        return [self.position[name] for name in outfit if name in self.position]
+
+def add_layering_items(outfit, items_by_category, used_items, weather=None, rng=None, index=None):
+    """
+    Add a base layer under a sweater, hoodie, cardigan or blazer when it is cool or the outfit calls for it.
+
+    An untaken top whose colors go with the layer is put first, picked by pick_top among the
+    best-coordinating ones (`rng`: random.Random; without it the best). Pass an AssemblyIndex
+    built once for `items_by_category` when layering several outfits.
+    """
     layered_outfit = outfit.copy()
     
     # Only consider layering if weather is cool or if it would enhance style
     should_consider_layering = (
         weather and weather.lower() in ['cold', 'cool', 'chilly'] or
-        any(word in ' '.join(outfit).lower() for word in ['sweater', 'hoodie', 'cardigan', 'blazer'])
+        any(word in ' '.join(outfit).lower() for word in LAYER_WORDS)
     )
     
     if not should_consider_layering:
         return layered_outfit
-    
+
+    index = index or AssemblyIndex(items_by_category)
+    # Untaken tops that can go underneath
+    base_layers = index.by_category.get('Tops', np.arange(0))
+    available = index.available(used_items)
+    available[index.positions(outfit)] = False
+    base_layers = base_layers[index.base_layer[base_layers] & available[base_layers]]
+
     # Check if we have items that would benefit from layering
     for item_file in outfit:
-        item_desc = get_item_description(item_file, items_by_category)
-        if not item_desc:
+        position = index.position.get(item_file)
+        if position is None or not index.layer[position]:
             continue
-            
-        # Look for layering opportunities
-        if any(word in item_desc.lower() for word in ['sweater', 'hoodie', 'cardigan', 'blazer']):
-            # Look for a suitable base layer
-            base_layer_candidates = []
-            if 'Tops' in items_by_category:
-                for item in items_by_category['Tops']:
-                    if item['file'] not in used_items and item['file'] not in outfit:
-                        if any(word in item['desc'].lower() for word in ['tank', 'camisole', 't-shirt', 'blouse', 'shirt']):
-                            # Check if colors would coordinate well
-                            if would_coordinate_well(item, item_file, items_by_category):
-                                base_layer_candidates.append(item)
-            
-            if base_layer_candidates:
-                # Select a base layer that coordinates well
-                selected_base = smart_select_item(base_layer_candidates, layered_outfit, 'Tops')
-                if selected_base:
-                    layered_outfit.insert(0, selected_base['file'])  # Add as base layer
-                    break
+
+        # Look for a suitable base layer whose colors would coordinate well
+        suitable = base_layers[coordinates_well(index.masks[base_layers], index.masks[position])]
+        if len(suitable):
+            candidates = [index.items[i] for i in suitable]
+            scores = coordination_scores(candidates, layered_outfit, 'Tops', index.items_by_file)
+            selected_base = pick_top(candidates, scores, rng)
+            layered_outfit.insert(0, selected_base['file'])  # Add as base layer
+            break
     
     return layered_outfit
 
-def get_item_description(item_file, items_by_category):
-    """Get description for an item file."""
-    for category_items in items_by_category.values():
-        for item in category_items:
-            if item['file'] == item_file:
-                return item['desc']
-    return ""
-
-def would_coordinate_well(base_item, outer_item, items_by_category):
-    """Check if base and outer items would coordinate well."""
-    # Simple color coordination check
-    base_colors = extract_colors(base_item['desc'])
-    outer_desc = get_item_description(outer_item, items_by_category)
-    outer_colors = extract_colors(outer_desc) if outer_desc else []
-    
-    # Basic coordination rules
-    if not base_colors or not outer_colors:
-        return True  # If we can't determine colors, allow it
-    
-    # Check for complementary or neutral combinations
-    neutral_colors = {'black', 'white', 'gray', 'beige', 'navy'}
-    if any(color in neutral_colors for color in base_colors) or any(color in neutral_colors for color in outer_colors):
-        return True
-    
-    # Check for complementary colors
-    complementary_pairs = [
-        ('blue', 'orange'), ('red', 'green'), ('yellow', 'purple'),
-        ('pink', 'mint'), ('navy', 'coral')
-    ]
-    
-    for base_color in base_colors:
-        for outer_color in outer_colors:
-            if (base_color, outer_color) in complementary_pairs or (outer_color, base_color) in complementary_pairs:
-                return True
-    
-    return False
+# Colors that go with anything, and complementary pairs, for base/outer layering
+NEUTRAL_COLORS = {'black', 'white', 'gray', 'beige', 'navy'}
+COMPLEMENTARY_PAIRS = [
+    ('blue', 'orange'), ('red', 'green'), ('yellow', 'purple'),
+    ('pink', 'mint'), ('navy', 'coral')
+]
+# The same rules as color bitmasks (only names that are COLOR_FAMILIES can ever match)
+NEUTRAL_MASK = colors_to_mask([color for color in NEUTRAL_COLORS if color in COLOR_INDEX])
+COMPLEMENTARY_MASKS = [(colors_to_mask([a]), colors_to_mask([b]))
+                       for pair in COMPLEMENTARY_PAIRS for a, b in (pair, pair[::-1])
+                       if a in COLOR_INDEX and b in COLOR_INDEX]
+
+def coordinates_well(base_masks, outer_mask):
+    """Which of an array of base-layer color masks coordinate with one outer-layer mask"""
+    base_masks = np.asarray(base_masks, dtype=np.int64)
+    # If we can't determine colors, allow it; neutral colors on either side always work
+    ok = (base_masks == 0) | (outer_mask == 0) | ((base_masks & NEUTRAL_MASK) != 0) | bool(outer_mask & NEUTRAL_MASK)
+    for base_color, outer_color in COMPLEMENTARY_MASKS:
+        if outer_mask & outer_color:
+            ok |= (base_masks & base_color) != 0
+    return ok
 
 if __name__ == "__main__":
     # Example usage with different weather conditions
@@ -0,0 +1,595 @@
+"""
+test_database.py
+Checks for database.py schema migrations and query plans (uses a throwaway database file)
+"""
+
+import json
+import os
+import queue
+import tempfile
+import threading
+
+import database
+
+# Per-user listings served on every page render, chat message and API hit
+HOT_QUERIES = {
+    'closet listing': '''
+        SELECT id, filename, original_name, url, analysis, created_at
+        FROM uploaded_images WHERE user_id = ? ORDER BY created_at DESC LIMIT ?
+    ''',
+    'closet by category': '''
+        SELECT id, filename, original_name, url, analysis, created_at
+        FROM uploaded_images WHERE user_id = ? AND category = ? ORDER BY created_at DESC LIMIT ?
+    ''',
+    'closet by color': '''
+        SELECT id, filename, original_name, url, analysis, created_at
+        FROM uploaded_images WHERE user_id = ? AND color = ? ORDER BY created_at DESC LIMIT ?
+    ''',
+    'duplicate upload lookup': '''
+        SELECT id, filename, original_name, url, analysis, created_at
+        FROM uploaded_images WHERE user_id = ? AND content_hash = ? ORDER BY id LIMIT 1
+    ''',
+    'closet page after cursor': '''
+        SELECT id, filename, original_name, url, analysis, created_at
+        FROM uploaded_images WHERE user_id = ? AND (created_at, id) < (?, ?)
+        ORDER BY created_at DESC, id DESC LIMIT ?
+    ''',
+    'chat history': '''
+        SELECT id, message, reply, message_type, created_at
+        FROM chat_messages WHERE user_id = ? ORDER BY created_at DESC LIMIT ?
+    ''',
+    'saved outfits': '''
+        SELECT id, outfit_name, outfit_data, weather_condition, occasion, created_at
+        FROM outfits WHERE user_id = ? ORDER BY created_at DESC LIMIT ?
+    ''',
+    'closet stats': '''
+        SELECT category, color, COUNT(*) AS items, MAX(created_at) AS last_upload
+        FROM uploaded_images WHERE user_id = ? GROUP BY category, color
+    ''',
+    'collections': '''
+        SELECT id, collection_name, collection_type, avatar_image_url, outfit_description, tags, created_at
+        FROM collections WHERE user_id = ? ORDER BY created_at DESC
+    ''',
+}
+
+def use_temp_database():
+    """Point database.py at a fresh temporary file and create the schema"""
+    database.DB_PATH = os.path.join(tempfile.mkdtemp(prefix='aistylist_test_'), 'test.db')
+    database.init_database()
+
+def query_plan(sql, params):
+    """Return the EXPLAIN QUERY PLAN detail lines for a statement"""
+    with database.transaction() as conn:
+        rows = conn.execute('EXPLAIN QUERY PLAN ' + sql, params).fetchall()
+    return [row['detail'] for row in rows]
+
+def test_migrations_are_recorded_and_idempotent():
+    """Every migration is applied once and re-running init_database is a no-op"""
+    use_temp_database()
+    latest = database.MIGRATIONS[-1][0]
+    assert database.get_schema_version() == latest
+    database.init_database()
+    assert database.get_schema_version() == latest
+    with database.transaction() as conn:
+        applied = conn.execute('SELECT COUNT(*) AS n FROM schema_version').fetchone()['n']
+    assert applied == len(database.MIGRATIONS)
+
+def test_hot_queries_use_indexes():
+    """Every hot per-user query is an index search with no table scan or temp sort"""
+    use_temp_database()
+    for name, sql in HOT_QUERIES.items():
+        params = {1: (1,), 2: (1, 50), 3: (1, 'Tops', 50), 4: (1, '2025-01-01 00:00:00', 10, 50)}[sql.count('?')]
+        plan = query_plan(sql, params)
+        print(f"{name}: {plan}")
+        assert any('USING INDEX' in line or 'USING COVERING INDEX' in line for line in plan), f"{name} does not use an index: {plan}"
+        assert not any(line.startswith('SCAN') for line in plan), f"{name} scans a table: {plan}"
+        assert not any('TEMP B-TREE' in line for line in plan), f"{name} sorts in a temp b-tree: {plan}"
+
+def test_item_columns_backfilled_from_analysis():
+    """Rows written before the typed columns existed are backfilled from their analysis JSON"""
+    database.DB_PATH = os.path.join(tempfile.mkdtemp(prefix='aistylist_test_'), 'test.db')
+    all_migrations = database.MIGRATIONS
+    database.MIGRATIONS = all_migrations[:1]
+    try:
+        database.init_database()
+        with database.transaction(write=True) as conn:
+            conn.execute(
+                'INSERT INTO uploaded_images (user_id, filename, analysis) VALUES (?, ?, ?)',
+                (1, 'old.jpg', json.dumps({'item_name': 'Blue Cotton Shirt', 'category': 'Tops', 'color': 'Blue', 'description': 'x' * 1000}))
+            )
+    finally:
+        database.MIGRATIONS = all_migrations
+    database.migrate()
+    
+    item = database.get_user_images(1, category='Tops', color='Blue')[0]
+    assert item['item_name'] == 'Blue Cotton Shirt'
+    assert len(item['description_excerpt']) == database.DESCRIPTION_EXCERPT_CHARS
+    assert database.item_description(item) == 'x' * 1000  # Prompts get the whole description
+    assert database.item_description(dict(item, analysis='not json')) == item['description_excerpt']
+    assert database.get_user_images(1, category='Bottoms') == []
+
+def test_content_hash_backfill_and_lookup():
+    """Existing files are hashed once by the migration and duplicates are found by hash"""
+    upload_dir = tempfile.mkdtemp(prefix='aistylist_uploads_')
+    with open(os.path.join(upload_dir, 'old.jpg'), 'wb') as f:
+        f.write(b'image bytes')
+    database.UPLOAD_DIR = upload_dir
+    database.DB_PATH = os.path.join(tempfile.mkdtemp(prefix='aistylist_test_'), 'test.db')
+    all_migrations = database.MIGRATIONS
+    database.MIGRATIONS = all_migrations[:2]
+    try:
+        database.init_database()
+        with database.transaction(write=True) as conn:
+            conn.executemany(
+                'INSERT INTO uploaded_images (user_id, filename, analysis) VALUES (?, ?, ?)',
+                [(1, 'old.jpg', '{}'), (1, 'missing.jpg', '{}')]
+            )
+    finally:
+        database.MIGRATIONS = all_migrations
+    database.migrate()
+    
+    content_hash = database.file_content_hash(os.path.join(upload_dir, 'old.jpg'))
+    assert database.find_image_by_hash(1, content_hash)['filename'] == 'old.jpg'
+    assert database.find_image_by_hash(2, content_hash) is None
+    database.save_uploaded_image(1, 'new.jpg', 'new.jpg', '/data/clothes/input/new.jpg', '{}', content_hash='abc')
+    assert database.find_image_by_hash(1, 'abc')['filename'] == 'new.jpg'
+
+def test_keyset_pagination_walks_every_row_once():
+    """Following next_cursor returns every row exactly once, newest first, even with timestamp ties"""
+    use_temp_database()
+    with database.transaction(write=True) as conn:
+        conn.executemany(
+            'INSERT INTO collections (user_id, collection_name, created_at) VALUES (?, ?, ?)',
+            [(1, f'look {i}', '2025-01-0%d 09:00:00' % (1 + i // 3)) for i in range(8)] + [(2, 'other user', '2025-01-01 09:00:00')]
+        )
+    
+    seen = []
+    cursor = None
+    while True:
+        page = database.get_user_collections_page(1, cursor=cursor, page_size=3)
+        seen.extend(item['id'] for item in page['items'])
+        cursor = page['next_cursor']
+        if not cursor:
+            break
+    assert seen == [8, 7, 6, 5, 4, 3, 2, 1]
+    
+    try:
+        database.get_user_collections_page(1, cursor='not-a-cursor')
+        assert False, "invalid cursor was accepted"
+    except ValueError:
+        pass
+
+def test_batch_commits_once_and_rolls_back_together():
+    """Helpers inside batch() share one transaction; an error discards every row"""
+    use_temp_database()
+    database.save_outfits_many([
+        {'user_id': 1, 'outfit_name': f'Outfit {i}', 'outfit_data': '{}'} for i in range(3)
+    ])
+    try:
+        with database.batch():
+            database.save_outfit(1, 'Outfit 3', '{}')
+            database.save_collection(1, 'Look', 'manual_save', '/output/look.png', 'desc')
+            raise RuntimeError('abort batch')
+    except RuntimeError:
+        pass
+    assert len(database.get_user_outfits(1)) == 3
+    assert database.get_user_collections(1) == []
+
+def test_failed_commit_leaves_the_connection_usable():
+    """A COMMIT that raises is rolled back, so the thread's next transaction can BEGIN"""
+    use_temp_database()
+    conn = database.get_connection()
+    conn.execute('PRAGMA foreign_keys = ON')
+    with database.transaction(write=True) as conn:
+        conn.execute('CREATE TABLE parent (id INTEGER PRIMARY KEY)')
+        conn.execute('CREATE TABLE child (parent_id INTEGER REFERENCES parent (id) DEFERRABLE INITIALLY DEFERRED)')
+    try:
+        with database.transaction(write=True) as conn:
+            conn.execute('INSERT INTO child (parent_id) VALUES (42)')  # Only checked at COMMIT
+        assert False, "commit did not fail"
+    except database.sqlite3.IntegrityError:
+        pass
+    conn = database.get_connection()
+    assert not conn.in_transaction
+    conn.execute('PRAGMA foreign_keys = OFF')
+    database.save_outfit(1, 'After failed commit', '{}')
+    assert len(database.get_user_outfits(1)) == 1
+
+def test_request_threads_reuse_released_connections():
+    """A connection released at request teardown serves the next request thread; open transactions stay put"""
+    use_temp_database()
+    database.close_idle_connections()
+    seen = []
+    def request():
+        database.get_user_images(1)
+        seen.append(database.get_connection())
+        database.release_connections()
+    for _ in range(3):
+        thread = threading.Thread(target=request)
+        thread.start()
+        thread.join()
+    assert seen[0] is seen[1] is seen[2]
+
+    with database.transaction(write=True):
+        database.release_connections()
+        database.save_outfit(1, 'Kept', '{}')
+    assert [outfit['outfit_name'] for outfit in database.get_user_outfits(1)] == ['Kept']
+    database.release_connections()
+    database.close_idle_connections()
+
+def test_weather_cache_memo_tier():
+    """Repeat lookups are served in-process, expire by max age and are dropped on clear"""
+    use_temp_database()
+    database.clear_weather_cache()
+    database.cache_weather('Tokyo', {'temp': 21})
+    before = database.get_weather_cache_stats()
+    assert database.get_cached_weather('Tokyo') == {'temp': 21}
+    assert database.get_weather_cache_stats()['hits'] == before['hits'] + 1
+    assert database.get_cached_weather('Tokyo', max_age_hours=0) is None
+
+    database.clear_weather_cache('Tokyo')
+    assert database.get_cached_weather('Tokyo') is None
+
+    # A row written by another process is picked up from SQLite and then memoised
+    with database.transaction(write=True) as conn:
+        conn.execute('INSERT INTO weather_cache (location, weather_data) VALUES (?, ?)', ('Osaka', '{"temp": 18}'))
+    assert database.get_cached_weather('Osaka') == {'temp': 18}
+    hits = database.get_weather_cache_stats()['hits']
+    assert database.get_cached_weather('Osaka') == {'temp': 18}
+    assert database.get_weather_cache_stats()['hits'] == hits + 1
+
+def test_full_text_search_stays_in_sync():
+    """Closet and chat search see inserts, updates and deletes through the FTS triggers"""
+    use_temp_database()
+    database.save_uploaded_image(1, 'coat.jpg', 'coat.jpg', '/data/clothes/input/coat.jpg', json.dumps({
+        'item_name': 'Navy Wool Coat', 'category': 'Outerwear', 'color': 'Navy', 'description': 'Warm double-breasted wool coat'
+    }))
+    database.save_uploaded_image(1, 'scarf.jpg', 'scarf.jpg', '/data/clothes/input/scarf.jpg', json.dumps({
+        'item_name': 'Grey Scarf', 'category': 'Accessories', 'color': 'Grey', 'description': 'Soft wool blend, goes with navy'
+    }))
+    database.save_uploaded_image(1, 'broken.jpg', 'broken.jpg', '/data/clothes/input/broken.jpg', 'not json')
+    database.save_uploaded_image(2, 'other.jpg', 'other.jpg', '/data/clothes/input/other.jpg', json.dumps({'item_name': 'Navy Wool Hat'}))
+
+    results = database.search_user_items(1, 'wool navy')
+    assert [item['filename'] for item in results] == ['coat.jpg', 'scarf.jpg']
+    assert [item['filename'] for item in database.search_user_items(1, 'outerw')] == ['coat.jpg']
+    assert database.search_user_items(1, '"*') == []
+
+    database.delete_uploaded_image(1, 'coat.jpg')
+    assert [item['filename'] for item in database.search_user_items(1, 'wool navy')] == ['scarf.jpg']
+
+    database.save_chat_message(1, 'What goes with my linen trousers?', 'Try a white tee')
+    database.save_chat_message(1, 'Is it raining?', 'Yes, take a coat')
+    assert [m['reply'] for m in database.search_chat_messages(1, 'linen')] == ['Try a white tee']
+    # A negative LIMIT means "no limit" to SQLite; searches clamp it to at least one row
+    assert len(database.search_chat_messages(1, 'a')) == 2
+    assert len(database.search_chat_messages(1, 'a', limit=-1)) == 1
+
+def test_query_stats_record_timings_and_slow_queries():
+    """With stats enabled every statement is fingerprinted, timed and counted with its rows"""
+    use_temp_database()
+    database.reset_query_stats()
+    database.enable_query_stats(slow_query_ms=0)
+    try:
+        for i in range(5):
+            database.save_chat_message(1, f'message {i}', f'reply {i}')
+        assert len(database.get_chat_messages(1, limit=3)) == 3
+        assert len(list(database.get_connection().execute('SELECT id FROM chat_messages WHERE user_id = 1'))) == 5
+    finally:
+        database.disable_query_stats()
+    
+    stats = database.get_query_stats()
+    by_sql = {s['sql']: s for s in stats['statements']}
+    insert = next(s for sql, s in by_sql.items() if sql.startswith('INSERT INTO chat_messages'))
+    assert insert['count'] == 5
+    assert by_sql['COMMIT']['count'] >= 5
+    listing = next(s for sql, s in by_sql.items() if 'ORDER BY created_at DESC' in sql and 'chat_messages' in sql)
+    assert listing['rows'] == 3
+    assert by_sql['SELECT id FROM chat_messages WHERE user_id = ?']['rows'] == 5
+    assert all(s['p50_ms'] <= s['p95_ms'] <= s['p99_ms'] for s in stats['statements'])
+    assert stats['slow_queries'], "threshold 0 should log every statement"
+    # Queries are logged once their rows are fetched, with the rows they returned
+    slow = {entry['sql']: entry for entry in stats['slow_queries']}
+    assert slow[listing['sql']]['rows'] == 3
+    assert slow['SELECT id FROM chat_messages WHERE user_id = ?']['rows'] == 5
+    
+    # Disabled again: the thread's connection goes back to a plain sqlite3.Connection
+    count = insert['count']
+    database.save_chat_message(1, 'untimed', 'reply')
+    assert type(database.get_connection()) is database.sqlite3.Connection
+    insert = next(s for s in database.get_query_stats()['statements'] if s['sql'].startswith('INSERT INTO chat_messages'))
+    assert insert['count'] == count
+    database.reset_query_stats()
+
+def test_background_writer_batches_and_applies_backpressure():
+    """Queued rows are written in batches, a full queue blocks and close() drains what is left"""
+    use_temp_database()
+    batches = []
+    started = threading.Event()
+    release = threading.Event()
+    
+    def write_many(rows):
+        started.set()
+        release.wait()
+        batches.append(len(rows))
+        database.save_chat_messages_many(rows)
+    
+    writer = database.BackgroundWriter(write_many, max_queue=5, batch_size=4, name='test-writer')
+    writer.submit({'user_id': 1, 'message': 'first', 'reply': 'ok'})
+    assert started.wait(1)
+    # The writer is stuck on the first batch, so five more rows fill the queue
+    for i in range(5):
+        writer.submit({'user_id': 1, 'message': f'message {i}', 'reply': 'ok'}, timeout=1)
+    try:
+        writer.submit({'user_id': 1, 'message': 'overflow', 'reply': 'ok'}, timeout=0.05)
+        assert False, "full queue accepted another row"
+    except queue.Full:
+        pass
+    
+    release.set()
+    writer.flush()
+    writer.submit({'user_id': 1, 'message': 'last', 'reply': 'ok'})
+    writer.close()
+    assert batches[:3] == [1, 4, 1] and sum(batches) == 7
+    assert writer.written == 7 and writer.failed == 0
+    assert len(database.get_chat_messages(1, limit=50)) == 7
+
+def test_closet_version_bumps_on_every_closet_write():
+    """Uploads, analysis updates and deletes each bump only the owner's closet version"""
+    use_temp_database()
+    assert database.get_closet_version(1) == 0
+    database.save_uploaded_image(1, 'a.jpg', 'a.jpg', '/data/clothes/input/a.jpg', '{}')
+    database.save_uploaded_images_many([
+        {'user_id': 1, 'filename': f'{i}.jpg', 'original_name': f'{i}.jpg', 'url': '', 'analysis': '{}'} for i in range(3)
+    ] + [{'user_id': 2, 'filename': 'b.jpg', 'original_name': 'b.jpg', 'url': '', 'analysis': '{}'}])
+    assert database.get_closet_version(1) == 4
+    assert database.get_closet_version(2) == 1
+    
+    with database.transaction(write=True) as conn:
+        conn.execute("UPDATE uploaded_images SET analysis = ? WHERE filename = 'a.jpg'", (json.dumps({'category': 'Tops'}),))
+    assert database.get_closet_version(1) == 5
+    database.delete_uploaded_image(1, 'a.jpg')
+    assert database.get_closet_version(1) == 6
+    
+    # A failed write rolls the version back with it
+    try:
+        with database.batch():
+            database.save_uploaded_image(2, 'c.jpg', 'c.jpg', '', '{}')
+            raise RuntimeError('abort')
+    except RuntimeError:
+        pass
+    assert database.get_closet_version(2) == 1
+    plan = query_plan('SELECT version FROM closet_versions WHERE user_id = ?', (1,))
+    assert any('INTEGER PRIMARY KEY' in line for line in plan), plan
+
+def test_retention_trims_old_rows_and_shrinks_the_file():
+    """Only the newest N messages per user survive, stale weather goes, and freed pages are released"""
+    use_temp_database()
+    with database.transaction() as conn:
+        assert conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2
+    database.save_chat_messages_many(
+        [{'user_id': 1, 'message': 'x' * 2000, 'reply': f'reply {i}'} for i in range(500)]
+        + [{'user_id': 2, 'message': 'hello', 'reply': 'hi'}]
+    )
+    database.cache_weather('Tokyo', {'temp': 21})
+    database.cache_weather('Paris', {'temp': 12})
+    with database.transaction(write=True) as conn:
+        conn.execute("UPDATE weather_cache SET cached_at = datetime('now', '-2 days') WHERE location = 'Paris'")
+    database.get_connection().execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    size_before = os.path.getsize(database.DB_PATH)
+    
+    result = database.run_retention(chat_messages_per_user=10)
+    assert result['chat_messages'] == 490 and result['weather_cache'] == 1
+    assert [m['reply'] for m in database.get_chat_messages(1, limit=20)] == [f'reply {i}' for i in range(499, 489, -1)]
+    assert len(database.get_chat_messages(2)) == 1
+    assert database.search_chat_messages(1, 'reply') and len(database.search_chat_messages(1, 'reply', limit=100)) == 10
+    assert result['pages_freed'] > 0
+    with database.transaction() as conn:
+        assert conn.execute('PRAGMA freelist_count').fetchone()[0] == 0
+    database.get_connection().execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    assert os.path.getsize(database.DB_PATH) < size_before
+
+def test_online_backup_and_verified_restore():
+    """A backup taken during writes is consistent, and restore rejects a corrupt file"""
+    use_temp_database()
+    database.save_chat_messages_many([{'user_id': 1, 'message': 'x' * 1000, 'reply': f'reply {i}'} for i in range(500)])
+    stop = threading.Event()
+    
+    def keep_writing():
+        while not stop.is_set():
+            database.save_chat_message(2, 'during backup', 'ok')
+    
+    writer = threading.Thread(target=keep_writing)
+    writer.start()
+    try:
+        dest = os.path.join(tempfile.mkdtemp(prefix='aistylist_backup_'), 'backup.db')
+        result = database.backup_database(dest, pages_per_step=16, sleep=0.001)
+    finally:
+        stop.set()
+        writer.join()
+    assert result['bytes'] > 0 and result['steps'] > 1
+    assert database.check_integrity(dest) == []
+    
+    database.save_chat_message(1, 'after backup', 'lost on restore')
+    database.restore_database(dest)
+    replies = [m['reply'] for m in database.get_chat_messages(1, limit=1000)]
+    assert len(replies) == 500 and 'lost on restore' not in replies
+    
+    corrupt = os.path.join(os.path.dirname(dest), 'corrupt.db')
+    with open(dest, 'rb') as f:
+        data = bytearray(f.read())
+    data[5000:9000] = b'\xff' * 4000
+    with open(corrupt, 'wb') as f:
+        f.write(data)
+    try:
+        database.restore_database(corrupt)
+        assert False, "corrupt backup was restored"
+    except ValueError:
+        pass
+    assert len(database.get_chat_messages(1, limit=1000)) == 500
+
+def test_sharded_mode_routes_rows_by_user():
+    """With sharding on, per-user rows land in the user's shard and users stay in the main file"""
+    use_temp_database()
+    database.SHARDED = True
+    database.SHARD_DIR = tempfile.mkdtemp(prefix='aistylist_shards_')
+    connections_per_thread = database.SHARD_CONNECTIONS_PER_THREAD
+    database.SHARD_CONNECTIONS_PER_THREAD = 2
+    try:
+        user_id = database.create_user('a@example.com', 'A')
+        database.save_chat_messages_many([
+            {'user_id': uid, 'message': f'hi from {uid}', 'reply': 'hello'} for uid in (user_id, 2, 3, 2)
+        ])
+        database.save_uploaded_image(2, 'coat.jpg', 'coat.jpg', '', json.dumps({'item_name': 'Navy Coat'}))
+        
+        assert database.shard_user_ids() == [user_id, 2, 3]
+        assert [m['message'] for m in database.get_chat_messages(2)] == ['hi from 2', 'hi from 2']
+        assert database.search_user_items(2, 'navy')[0]['filename'] == 'coat.jpg'
+        assert database.get_closet_version(2) == 1 and database.get_closet_version(3) == 0
+        assert database.get_user_subscription(user_id)['subscription_type'] == 'free'
+        with database.transaction() as conn:
+            assert conn.execute('SELECT COUNT(*) AS n FROM chat_messages').fetchone()['n'] == 0
+        with database.transaction(user_id=3) as conn:
+            assert conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2
+        # Only the two most recently used shard connections stay open on this thread
+        assert len([path for path in database._local.handles if path != database.DB_PATH]) == 2
+        
+        # Users write to their own files concurrently
+        def write_for(uid):
+            for i in range(50):
+                database.save_chat_message(uid, f'message {i}', 'ok')
+            database.close_connection()
+        threads = [threading.Thread(target=write_for, args=(uid,)) for uid in range(10, 14)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert all(len(database.get_chat_messages(uid, limit=100)) == 50 for uid in range(10, 14))
+        assert database.run_retention(chat_messages_per_user=10)['chat_messages'] == 4 * 40
+    finally:
+        database.SHARDED = False
+        database.SHARD_CONNECTIONS_PER_THREAD = connections_per_thread
+        database.close_connection()
+
+def test_sharding_moves_main_rows_and_backs_up_every_shard():
+    """Turning sharding on moves existing rows into shards, and backups cover every shard"""
+    use_temp_database()
+    database.save_chat_message(1, 'before sharding', 'ok')
+    database.save_uploaded_image(2, 'shirt.jpg', 'shirt.jpg', '/u/shirt.jpg', json.dumps({'category': 'top'}))
+    database.SHARDED = True
+    database.SHARD_DIR = tempfile.mkdtemp(prefix='aistylist_shards_')
+    try:
+        database.init_database()
+        assert [m['reply'] for m in database.get_chat_messages(1)] == ['ok']
+        assert [i['filename'] for i in database.get_user_images(2)] == ['shirt.jpg']
+        with database.transaction() as conn:
+            assert conn.execute('SELECT COUNT(*) AS n FROM chat_messages').fetchone()['n'] == 0
+            assert conn.execute('SELECT COUNT(*) AS n FROM uploaded_images').fetchone()['n'] == 0
+        assert database.move_rows_to_shards()['chat_messages'] == 0  # Nothing left to move
+        assert len(database.get_chat_messages(1)) == 1
+        
+        dest = os.path.join(tempfile.mkdtemp(prefix='aistylist_backup_'), 'backup.db')
+        result = database.backup_database(dest, pages_per_step=16, sleep=0)
+        assert result['shards'] == 2
+        database.save_chat_message(1, 'after backup', 'lost on restore')
+        database.save_chat_message(3, 'new user', 'lost on restore')
+        database.restore_database(dest)
+        assert database.shard_user_ids() == [1, 2]
+        assert [m['reply'] for m in database.get_chat_messages(1)] == ['ok']
+        assert database.get_chat_messages(3) == []
+        assert [i['filename'] for i in database.get_user_images(2)] == ['shirt.jpg']
+    finally:
+        database.close_connection()
+        database.SHARDED = False
+
+def test_closet_stats_are_cached_per_closet_version():
+    """Histograms come from SQL, repeat calls hit the cache, and any closet write refreshes them"""
+    use_temp_database()
+    assert database.get_closet_stats(1)['total_items'] == 0
+    database.save_uploaded_images_many([
+        {'user_id': 1, 'filename': f'{i}.jpg', 'original_name': f'{i}.jpg', 'url': '',
+         'analysis': json.dumps({'category': category, 'color': color})}
+        for i, (category, color) in enumerate([('Tops', 'Blue'), ('Tops', 'White'), ('Bottoms', 'Blue'), (None, None)])
+    ])
+    stats = database.get_closet_stats(1)
+    assert stats['total_items'] == 4 and stats['last_upload']
+    assert stats['categories'] == {'Tops': 2, 'Bottoms': 1, 'Uncategorized': 1}
+    assert stats['colors'] == {'Blue': 2, 'Unknown': 1, 'White': 1}
+    
+    stats['categories']['Tops'] = 99
+    assert database.get_closet_stats(1)['categories']['Tops'] == 2
+    database.delete_uploaded_image(1, '0.jpg')
+    assert database.get_closet_stats(1)['categories'] == {'Bottoms': 1, 'Tops': 1, 'Uncategorized': 1}
+
+def test_restore_clears_caches_keyed_by_rewound_versions():
+    """After a restore, a closet reaching a previously cached version again is not served stale stats"""
+    use_temp_database()
+    database.save_uploaded_image(1, 'top.jpg', 'top.jpg', '', json.dumps({'category': 'Tops'}))
+    dest = os.path.join(tempfile.mkdtemp(prefix='aistylist_backup_'), 'backup.db')
+    database.backup_database(dest, sleep=0)
+    database.save_uploaded_image(1, 'jeans.jpg', 'jeans.jpg', '', json.dumps({'category': 'Bottoms'}))
+    assert database.get_closet_stats(1)['categories'] == {'Bottoms': 1, 'Tops': 1}
+    
+    cleared = []
+    database.add_restore_listener(lambda: cleared.append(True))
+    try:
+        database.restore_database(dest)
+    finally:
+        database._restore_listeners.pop()
+    assert cleared == [True]
+    database.save_uploaded_image(1, 'shoes.jpg', 'shoes.jpg', '', json.dumps({'category': 'Shoes'}))
+    assert database.get_closet_stats(1)['categories'] == {'Shoes': 1, 'Tops': 1}
+
+def test_long_text_is_compressed_and_reads_back_transparently():
+    """Long replies/analysis are stored as compressed BLOBs, old plain rows still read, and search sees both"""
+    use_temp_database()
+    long_reply = 'Try pairing the navy blazer with cream chinos. ' * 60
+    analysis = json.dumps({'item_name': 'Navy Blazer', 'description': 'Tailored wool blazer. ' * 120})
+    database.save_chat_message(1, 'what goes with navy?', long_reply)
+    database.save_chat_message(1, 'and shoes?', 'White leather sneakers keep it relaxed. ' * 20)  # A typical reply
+    database.save_uploaded_image(1, 'blazer.jpg', 'blazer.jpg', '', analysis)
+    # Written before compression existed: plain TEXT
+    with database.transaction(write=True) as conn:
+        conn.execute('INSERT INTO chat_messages (user_id, message, reply) VALUES (?, ?, ?)', (1, 'old', 'x' * 2000))
+    
+    with database.transaction() as conn:
+        types = [row[0] for row in conn.execute('SELECT typeof(reply) FROM chat_messages ORDER BY id')]
+        stored = conn.execute('SELECT length(analysis) AS n FROM uploaded_images').fetchone()['n']
+    assert types == ['blob', 'text', 'text']
+    assert stored < len(analysis) / 5
+    
+    assert [m['reply'] for m in database.get_chat_messages(1)][::2] == ['x' * 2000, long_reply]
+    assert database.get_user_images(1)[0]['analysis'] == analysis
+    assert database.search_chat_messages(1, 'chinos')[0]['reply'] == long_reply
+    assert database.search_user_items(1, 'tailored')[0]['filename'] == 'blazer.jpg'
+    assert database.decompress_text(database.compress_text('short')) == 'short'
+
+def main():
+    """Main function"""
+    print("AIstylist Database Test")
+    print("=" * 50)
+    test_migrations_are_recorded_and_idempotent()
+    test_hot_queries_use_indexes()
+    test_item_columns_backfilled_from_analysis()
+    test_content_hash_backfill_and_lookup()
+    test_keyset_pagination_walks_every_row_once()
+    test_batch_commits_once_and_rolls_back_together()
+    test_failed_commit_leaves_the_connection_usable()
+    test_request_threads_reuse_released_connections()
+    test_weather_cache_memo_tier()
+    test_full_text_search_stays_in_sync()
+    test_query_stats_record_timings_and_slow_queries()
+    test_background_writer_batches_and_applies_backpressure()
+    test_closet_version_bumps_on_every_closet_write()
+    test_retention_trims_old_rows_and_shrinks_the_file()
+    test_online_backup_and_verified_restore()
+    test_sharded_mode_routes_rows_by_user()
+    test_sharding_moves_main_rows_and_backs_up_every_shard()
+    test_closet_stats_are_cached_per_closet_version()
+    test_restore_clears_caches_keyed_by_rewound_versions()
+    test_long_text_is_compressed_and_reads_back_transparently()
+    print("=" * 50)
+    print("Test complete")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+"""
+test_payment_service.py
+Checks for payment_service.py subscription status and Stripe webhook handling (no network; Stripe is stubbed)
+"""
+
+import json
+import os
+import tempfile
+from types import SimpleNamespace
+
+import database
+import payment_service
+
+def use_temp_database():
+    """Point database.py at a fresh temporary file, create the schema and empty the status cache"""
+    database.DB_PATH = os.path.join(tempfile.mkdtemp(prefix='aistylist_test_'), 'test.db')
+    database.init_database()
+    payment_service.invalidate_subscription_status()
+
+def stub_stripe():
+    """Swap in a Stripe module whose construct_event just parses the payload (no signature check)"""
+    real = payment_service.stripe
+    payment_service.stripe = SimpleNamespace(
+        Webhook=SimpleNamespace(construct_event=lambda payload, signature, secret: json.loads(payload))
+    )
+    return real
+
+def webhook(event_type, obj, event_id='evt_1'):
+    """Serialise a minimal Stripe event payload"""
+    return json.dumps({'id': event_id, 'type': event_type, 'data': {'object': obj}})
+
+def test_status_is_cached_until_a_webhook_changes_it():
+    """Repeat lookups skip the database; a subscription webhook evicts the user's entry"""
+    use_temp_database()
+    with database.transaction(write=True) as conn:
+        conn.execute(
+            "INSERT INTO subscriptions (user_id, status, stripe_customer_id) VALUES (1, 'past_due', 'cus_1')"
+        )
+    assert payment_service.get_subscription_status(1)['can_use_features'] is False
+
+    # A write that bypasses handle_webhook is not seen until the entry expires
+    with database.transaction(write=True) as conn:
+        conn.execute("UPDATE subscriptions SET status = 'active' WHERE user_id = 1")
+    assert payment_service.get_subscription_status(1)['status'] == 'past_due'
+
+    real = stub_stripe()
+    try:
+        payload = webhook('customer.subscription.updated', {
+            'customer': 'cus_1', 'status': 'canceled', 'current_period_end': 1767225600
+        })
+        assert payment_service.handle_webhook(payload, 'sig') is True
+    finally:
+        payment_service.stripe = real
+    status = payment_service.get_subscription_status(1)
+    assert status['status'] == 'canceled' and status['can_use_features'] is False
+
+    # A user with no subscription row gets the trial defaults
+    assert payment_service.get_subscription_status(2)['is_trial'] is True
+
+# A recorded burst of deliveries, including Stripe's retries of the same event id
+WEBHOOK_BURST = [
+    ('evt_checkout_1', 'checkout.session.completed', {
+        'customer': 'cus_1', 'subscription': 'sub_1', 'metadata': {'user_id': '1'},
+        'subscription_details': {'metadata': {'current_period_end': 1767225600}}
+    }),
+    ('evt_checkout_2', 'checkout.session.completed', {
+        'customer': 'cus_2', 'subscription': 'sub_2', 'metadata': {'user_id': '2'}
+    }),
+    ('evt_checkout_1', 'checkout.session.completed', {
+        'customer': 'cus_1', 'subscription': 'sub_1', 'metadata': {'user_id': '1'},
+        'subscription_details': {'metadata': {'current_period_end': 1767225600}}
+    }),
+    ('evt_updated_1', 'customer.subscription.updated', {
+        'customer': 'cus_1', 'status': 'past_due', 'current_period_end': 1769904000
+    }),
+    ('evt_deleted_2', 'customer.subscription.deleted', {'customer': 'cus_2'}),
+    ('evt_invoice_1', 'invoice.paid', {'customer': 'cus_1'}),
+    ('evt_updated_1', 'customer.subscription.updated', {
+        'customer': 'cus_1', 'status': 'past_due', 'current_period_end': 1769904000
+    }),
+    # Redelivery of the first checkout after the subscription went past due must not reactivate it
+    ('evt_checkout_1', 'checkout.session.completed', {
+        'customer': 'cus_1', 'subscription': 'sub_1', 'metadata': {'user_id': '1'}
+    }),
+]
+
+def check_burst_applied():
+    """Final state after WEBHOOK_BURST: every distinct event applied exactly once, in order"""
+    with database.transaction() as conn:
+        rows = {row['user_id']: dict(row) for row in conn.execute('SELECT * FROM subscriptions')}
+        processed = conn.execute('SELECT COUNT(*) AS n FROM processed_events').fetchone()['n']
+    assert processed == len({event_id for event_id, _, _ in WEBHOOK_BURST})
+    assert rows[1]['status'] == 'past_due' and rows[1]['stripe_subscription_id'] == 'sub_1'
+    assert rows[2]['status'] == 'cancelled'
+    assert payment_service.get_subscription_status(1)['can_use_features'] is False
+    assert payment_service.get_subscription_status(2)['status'] == 'cancelled'
+
+def test_webhook_burst_is_idempotent():
+    """Replaying the burst (and replaying it again) applies each event id once"""
+    use_temp_database()
+    real = stub_stripe()
+    try:
+        for _ in range(2):
+            for event_id, event_type, obj in WEBHOOK_BURST:
+                assert payment_service.handle_webhook(webhook(event_type, obj, event_id), 'sig') is True
+    finally:
+        payment_service.stripe = real
+    check_burst_applied()
+
+def test_async_webhooks_apply_from_queue_in_batches():
+    """Queued events are applied in one transaction per batch with the same result"""
+    use_temp_database()
+    assert payment_service.get_subscription_status(1)['is_trial'] is True
+    real = stub_stripe()
+    writer = database.BackgroundWriter(payment_service.apply_webhook_events, name='test-webhooks')
+    payment_service._webhook_writer = writer
+    try:
+        for event_id, event_type, obj in WEBHOOK_BURST:
+            assert payment_service.handle_webhook(webhook(event_type, obj, event_id), 'sig') is True
+        writer.flush()
+    finally:
+        payment_service._webhook_writer = None
+        payment_service.stripe = real
+        writer.close()
+    assert writer.written == len(WEBHOOK_BURST) and writer.failed == 0
+    check_burst_applied()
+
+def test_bad_event_in_batch_does_not_drop_the_rest():
+    """If one event in a batch fails, the others are still applied individually and it is parked for replay"""
+    use_temp_database()
+    events = [json.loads(webhook(event_type, obj, event_id)) for event_id, event_type, obj in WEBHOOK_BURST[:2]]
+    events.insert(1, {'id': 'evt_broken', 'type': 'checkout.session.completed', 'data': {'object': {}}})
+    payment_service.apply_webhook_events(events)
+    with database.transaction() as conn:
+        ids = [row['event_id'] for row in conn.execute('SELECT event_id FROM processed_events ORDER BY event_id')]
+    assert ids == ['evt_checkout_1', 'evt_checkout_2']
+
+    # The failed event is parked rather than lost, and can be replayed once it is fixable
+    with database.transaction() as conn:
+        parked = [dict(row) for row in conn.execute('SELECT event_id, attempts FROM failed_events')]
+    assert parked == [{'event_id': 'evt_broken', 'attempts': 1}]
+    assert payment_service.replay_failed_events() == {'applied': 0, 'failed': 1}
+    with database.transaction(write=True) as conn:
+        assert conn.execute('SELECT attempts FROM failed_events').fetchone()['attempts'] == 2
+        fixed = {'id': 'evt_broken', 'type': 'checkout.session.completed', 'data': {'object': {
+            'customer': 'cus_3', 'subscription': 'sub_3', 'metadata': {'user_id': '3'}}}}
+        conn.execute('UPDATE failed_events SET payload = ?', (json.dumps(fixed),))
+    assert payment_service.replay_failed_events() == {'applied': 1, 'failed': 0}
+    assert payment_service.get_subscription_status(3)['status'] == 'active'
+    with database.transaction() as conn:
+        assert conn.execute('SELECT COUNT(*) AS n FROM failed_events').fetchone()['n'] == 0
+
+def main():
+    """Main function"""
+    print("AIstylist Payment Service Test")
+    print("=" * 50)
+    test_status_is_cached_until_a_webhook_changes_it()
+    test_webhook_burst_is_idempotent()
+    test_async_webhooks_apply_from_queue_in_batches()
+    test_bad_event_in_batch_does_not_drop_the_rest()
+    print("=" * 50)
+    print("Test complete")
+
+if __name__ == '__main__':
+    main()
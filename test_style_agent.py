@@ -0,0 +1,321 @@
+"""
+test_style_agent.py
+Checks for src/style_agent.py closet loading and selection (uses a throwaway closet directory)
+"""
+
+import itertools
+import os
+import random
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+sys.path.append(os.path.join(os.path.dirname(__file__), 'src'))
+
+import closet_index
+import keyword_tagger
+import style_agent
+
+CLOSET = {
+    'dress1': "A flowy red summer dress in lightweight linen.",
+    'top1': "A white cotton t-shirt, basic and breathable.",
+    'top2': "A thick grey wool sweater with long sleeves.",
+    'bottom1': "Navy denim jeans with a straight leg.",
+    'shoes1': "Black leather ankle boots.",
+    'coat1': "A heavy camel winter coat.",
+    'bag1': "A small tan leather crossbody bag.",
+}
+
+@contextmanager
+def temp_closet(descriptions=CLOSET):
+    """Write an image + description pair per item into a fresh directory, with the index cache isolated for the block"""
+    closet_dir = tempfile.mkdtemp(prefix='aistylist_closet_')
+    index_dir = closet_index.INDEX_DIR
+    closet_index.INDEX_DIR = tempfile.mkdtemp(prefix='aistylist_index_')
+    closet_index.clear_closet_index()
+    try:
+        for name, desc in descriptions.items():
+            open(os.path.join(closet_dir, f"{name}.jpg"), 'wb').close()
+            with open(os.path.join(closet_dir, f"{name}.txt"), 'w', encoding='utf-8') as f:
+                f.write(desc)
+        yield closet_dir
+    finally:
+        closet_index.INDEX_DIR = index_dir
+        closet_index.clear_closet_index()
+
+def test_closet_index_refreshes_incrementally():
+    """Unchanged descriptions are reused from the index; only new or edited files are parsed again"""
+    with temp_closet() as closet_dir:
+        before = closet_index.get_closet_index_stats()
+        items = {item['file']: item for item in style_agent.load_closet_txts(closet_dir)}
+        assert closet_index.get_closet_index_stats()['parsed'] - before['parsed'] == len(CLOSET)
+        assert items['top2.txt']['category'] == 'Tops' and items['bottom1.txt']['category'] == 'Bottoms'
+        assert items['coat1.txt']['colors'] == ['brown'] and items['top2.txt']['materials'] == ['Wool']
+        assert items['top2.txt']['warmth'] == 'warm' and items['dress1.txt']['warmth'] == 'light'
+        assert items['dress1.txt']['image'] == '/data/clothes/input/dress1.jpg'
+
+        # A fresh process only reads the persisted index
+        closet_index.clear_closet_index()
+        before = closet_index.get_closet_index_stats()
+        assert len(style_agent.load_closet_txts(closet_dir)) == len(CLOSET)
+        after = closet_index.get_closet_index_stats()
+        assert after['parsed'] == before['parsed'] and after['writes'] == before['writes']
+
+        # Edit one description, delete another and add an image still waiting for analysis
+        with open(os.path.join(closet_dir, 'bag1.txt'), 'w', encoding='utf-8') as f:
+            f.write("A black canvas backpack.")
+        os.remove(os.path.join(closet_dir, 'shoes1.txt'))
+        os.remove(os.path.join(closet_dir, 'shoes1.jpg'))
+        open(os.path.join(closet_dir, 'new1.png'), 'wb').close()
+        before = closet_index.get_closet_index_stats()
+        items = {item['file']: item for item in style_agent.load_closet_txts(closet_dir)}
+        assert closet_index.get_closet_index_stats()['parsed'] - before['parsed'] == 1
+        assert items['bag1.txt']['colors'] == ['black'] and 'shoes1.txt' not in items
+        assert items['new1.txt']['category'] == 'Pending'
+
+def test_indexed_weather_filter_matches_keyword_scan():
+    """filter_by_weather gives the same result from indexed flags as from scanning the raw text"""
+    with temp_closet() as closet_dir:
+        indexed = style_agent.load_closet_txts(closet_dir)
+        raw = [{'file': item['file'], 'desc': item['desc'], 'category': item['category']} for item in indexed]
+        for weather in ['warm', 'cold', 'rainy', None]:
+            expected = [item['file'] for item in style_agent.filter_by_weather(raw, weather)]
+            assert [item['file'] for item in style_agent.filter_by_weather(indexed, weather)] == expected
+        warm = {item['file'] for item in style_agent.filter_by_weather(indexed, 'warm')}
+        assert 'coat1.txt' not in warm and 'top1.txt' in warm
+
+def test_keyword_tagger_matches_substring_chains():
+    """One scan gives the same first-match-wins tags as `keyword in text` chains, overlaps included"""
+    texts = [
+        "a redress of the stop-gap: navy a-line skirt with a thin leather belt",
+        "royal blue crop top, tank top underneath; athletic shoes",
+        "chunky knit cardigan\tin heather grey with\nlong sleeves",
+        "polka dot maxi dress",
+        "",
+    ]
+    for text in texts:
+        found = keyword_tagger.scan(text)
+        for name, vocab in keyword_tagger.VOCABULARIES.items():
+            expected = [tag for tag, keywords in vocab.items() if any(keyword in text for keyword in keywords)]
+            assert keyword_tagger.all_tags(name, found) == expected, (name, text)
+            assert keyword_tagger.first_tag(name, found) == (expected[0] if expected else None), (name, text)
+    assert keyword_tagger.detect_category("a redress") == 'Dresses'
+    assert keyword_tagger.detect_category("plain") == 'Accessories'
+
+def legacy_color_harmony(colors1, colors2):
+    """The old nested-loop harmony of two color lists (3 same, 2 harmonious, 0.5 otherwise)"""
+    score = 0
+    for color1 in colors1:
+        for color2 in colors2:
+            if color1 == color2:
+                score += 3
+            elif color2 in style_agent.HARMONY_RULES.get(color1, []):
+                score += 2
+            else:
+                score += 0.5
+    return score
+
+def legacy_coordination_score(item, outfit_items, category):
+    """The old per-candidate coordination loop (with real outfit colors)"""
+    score = 0
+    for outfit_item in outfit_items:
+        score += legacy_color_harmony(style_agent.extract_colors(item['desc']),
+                                      style_agent.extract_colors(outfit_item['desc']))
+    desc = item['desc'].lower()
+    if category == 'Tops':
+        if any(word in desc for word in ['basic', 'solid', 'neutral', 'white', 'black', 'gray']):
+            score += 2
+        if any(word in desc for word in ['tank', 'camisole', 't-shirt', 'blouse']):
+            score += 1
+    elif category == 'Outerwear':
+        if any(word in desc for word in ['blazer', 'cardigan', 'jacket']):
+            score += 1
+    elif category == 'Accessories':
+        score += 0.5
+    return score
+
+def test_vectorized_coordination_matches_per_item_loop():
+    """Matrix scoring equals the old nested loops; selection only draws from the stable top 3"""
+    with temp_closet() as closet_dir:
+        items = style_agent.load_closet_txts(closet_dir)
+        raw = [{'file': item['file'], 'desc': item['desc']} for item in items]
+        items_by_file = {item['file']: item for item in items}
+        outfit = ['bottom1.txt', 'shoes1.txt']
+        outfit_items = [items_by_file[name] for name in outfit]
+        for category in ['Tops', 'Outerwear', 'Accessories', 'Any']:
+            expected = [legacy_coordination_score(item, outfit_items, category) for item in raw]
+            assert list(style_agent.coordination_scores(items, outfit, category, items_by_file)) == expected
+            assert list(style_agent.coordination_scores(raw, outfit, category, items_by_file)) == expected
+
+        # Selection draws from the stable top 3, weighted by score; a seeded rng repeats its pick
+        expected = [legacy_coordination_score(item, outfit_items, 'Tops') for item in raw]
+        ranked = sorted(range(len(raw)), key=lambda i: expected[i], reverse=True)[:3]
+        scores = style_agent.coordination_scores(items, outfit, 'Tops', items_by_file)
+        picks = [style_agent.pick_top(items, scores, random.Random(seed))['file'] for seed in range(200)]
+        assert set(picks) <= {raw[i]['file'] for i in ranked} and len(set(picks)) > 1
+        assert style_agent.pick_top(items, scores, random.Random(5)) == style_agent.pick_top(items, scores, random.Random(5))
+        assert style_agent.pick_top(items, scores)['file'] == raw[ranked[0]]['file']
+
+def test_outfit_search_finds_best_and_varied_outfits():
+    """The first outfit is the best complete combination; later ones differ and runs are repeatable"""
+    with temp_closet(dict(CLOSET, top3="A black silk camisole.", shoes2="White canvas sneakers.")) as closet_dir:
+        items = style_agent.load_closet_txts(closet_dir)
+        by_category = {}
+        for item in items:
+            by_category.setdefault(item['category'], []).append(item)
+
+        best = max(
+            style_agent.score_outfit(list(base) + [shoes, coat, bag])
+            for base in [(dress,) for dress in by_category['Dresses']] +
+                        list(itertools.product(by_category['Tops'], by_category['Bottoms']))
+            for shoes in by_category['Shoes'] for coat in by_category['Outerwear'] for bag in by_category['Accessories']
+        )
+        results = style_agent.search_outfits(by_category, k=3, beam_width=50)
+        assert abs(results[0]['score'] - best) < 1e-6
+        items_by_file = {item['file']: item for item in items}
+        for result in results:
+            categories = sorted(items_by_file[name]['category'] for name in result['files'])
+            assert categories in (['Accessories', 'Dresses', 'Outerwear', 'Shoes'],
+                                  ['Accessories', 'Bottoms', 'Outerwear', 'Shoes', 'Tops'])
+            assert abs(style_agent.score_outfit([items_by_file[name] for name in result['files']]) - result['score']) < 1e-6
+        assert len({frozenset(result['files']) for result in results}) == 3
+
+        outfits = style_agent.select_multiple_outfits(num=3, closet_dir=closet_dir, criteria={'weather': 'cold'})
+        assert outfits == style_agent.select_multiple_outfits(num=3, closet_dir=closet_dir, criteria={'weather': 'cold'})
+        assert outfits and all('dress1.txt' not in outfit for outfit in outfits)  # Linen summer dress filtered out
+        # The wool sweater gets a base layer underneath when it is cold
+        sweaters = [outfit for outfit in outfits if 'top2.txt' in outfit]
+        assert sweaters and all(outfit[0] in ('top1.txt', 'top3.txt') for outfit in sweaters)
+
+def test_outfit_search_scales_to_a_large_closet():
+    """Several hundred items per category: the search keeps to its time budget, stays varied and repeats per seed"""
+    rng = random.Random(0)
+    garments = {'Tops': 'blouse', 'Bottoms': 'trousers', 'Shoes': 'sneakers', 'Outerwear': 'jacket', 'Accessories': 'scarf'}
+    colors = ['black', 'white', 'navy', 'red', 'green', 'beige', 'grey', 'pink']
+    by_category = {}
+    for n in range(5 * 300):
+        desc = f"A {rng.choice(colors)} {rng.choice(['cotton', 'wool', 'linen'])} {list(garments.values())[n % 5]}, item {n}."
+        item = dict(style_agent.describe_item(desc), file=f"item_{n}.txt", desc=desc)
+        by_category.setdefault(item['category'], []).append(item)
+    assert all(len(by_category[category]) == 300 for category in garments)
+
+    budget = 0.5
+    start = time.perf_counter()
+    results = style_agent.search_outfits(by_category, k=4, time_budget=budget, rng=random.Random(7))
+    # The budget is checked between outfits, so allow one outfit's search beyond it
+    assert time.perf_counter() - start < budget + 0.5
+    assert len(results) == 4 and len({frozenset(result['files']) for result in results}) == 4
+    assert [result['files'] for result in results] == \
+        [result['files'] for result in style_agent.search_outfits(by_category, k=4, time_budget=budget, rng=random.Random(7))]
+
+def test_seeded_recommendations_are_reproducible_and_memoised():
+    """Same closet, weather, occasion, num and seed reuse one result; editing the closet recomputes"""
+    with temp_closet(dict(CLOSET, top3="A black silk camisole.", shoes2="White canvas sneakers.")) as closet_dir:
+        style_agent.clear_recommendation_cache()
+        criteria = {'weather': 'cold', 'occasion': 'casual'}
+        first = style_agent.select_multiple_outfits(num=2, closet_dir=closet_dir, criteria=criteria, seed=7)
+        before = style_agent.get_recommendation_cache_stats()
+        assert style_agent.select_multiple_outfits(num=2, closet_dir=closet_dir, criteria=criteria, seed=7) == first
+        assert style_agent.get_recommendation_cache_stats()['hits'] == before['hits'] + 1
+        # A search cut short by a tiny time budget is not served for the default budget
+        assert style_agent.select_multiple_outfits(num=2, closet_dir=closet_dir, criteria=criteria, seed=7, time_budget=0) == []
+        assert style_agent.select_multiple_outfits(num=2, closet_dir=closet_dir, criteria=criteria, seed=7) == first
+
+        # The seed alone reproduces the result without the memo
+        style_agent.clear_recommendation_cache()
+        assert style_agent.select_multiple_outfits(num=2, closet_dir=closet_dir, criteria=criteria, seed=7) == first
+        # The seed drives the search jitter: other seeds surface other outfits
+        assert any(style_agent.select_multiple_outfits(num=2, closet_dir=closet_dir, criteria=criteria, seed=seed) != first
+                   for seed in range(8, 20))
+
+        # One-off seeds are searched without touching the memo
+        style_agent.clear_recommendation_cache()
+        once = style_agent.select_multiple_outfits(num=2, closet_dir=closet_dir, criteria=criteria, seed=7, memoise=False)
+        assert once == first
+        assert style_agent.get_recommendation_cache_stats()['entries'] == 0
+
+        with open(os.path.join(closet_dir, 'top3.txt'), 'w', encoding='utf-8') as f:
+            f.write("A black silk camisole with lace trim.")
+        before = style_agent.get_recommendation_cache_stats()
+        style_agent.select_multiple_outfits(num=2, closet_dir=closet_dir, criteria=criteria, seed=7)
+        assert style_agent.get_recommendation_cache_stats()['misses'] == before['misses'] + 1
+
+def test_indexed_layering_skips_used_items():
+    """Bitset availability keeps used items out; a sweater gets an untaken base layer whose colors go with it"""
+    separates = {name: desc for name, desc in CLOSET.items() if name != 'dress1'}
+    with temp_closet(dict(separates, top2="A red chunky knit sweater.", top3="A black silk camisole.",
+                          top4="A bright yellow tank top.")) as closet_dir:
+        by_category = {}
+        for item in style_agent.load_closet_txts(closet_dir):
+            by_category.setdefault(item['category'], []).append(item)
+        outfit = ['top2.txt', 'bottom1.txt', 'shoes1.txt']
+        layered = style_agent.add_layering_items(outfit, by_category, set(), 'cold')
+        assert layered[0] in ('top1.txt', 'top3.txt') and layered[1:] == outfit
+        other = ({'top1.txt', 'top3.txt'} - {layered[0]}).pop()
+        assert style_agent.add_layering_items(outfit, by_category, {layered[0]}, 'cold') == [other] + outfit
+        # Yellow does not go with red, so the tank top is never put underneath
+        assert style_agent.add_layering_items(outfit, by_category, {'top1.txt', 'top3.txt'}, 'cold') == outfit
+        assert style_agent.add_layering_items(['top1.txt', 'bottom1.txt'], by_category, set(), 'warm') == ['top1.txt', 'bottom1.txt']
+
+        # One index serves every outfit, with the same results as building it per call
+        index = style_agent.AssemblyIndex(by_category)
+        assert list(index.available({'top1.txt', 'missing.txt'})) == [item['file'] != 'top1.txt' for item in index.items]
+        assert style_agent.add_layering_items(outfit, by_category, {layered[0]}, 'cold', index=index) == [other] + outfit
+
+        # Mask rules agree with the color-name rules for every pair of families
+        def by_names(base, outer):
+            if not base or not outer or {base, outer} & style_agent.NEUTRAL_COLORS:
+                return True
+            return (base, outer) in style_agent.COMPLEMENTARY_PAIRS or (outer, base) in style_agent.COMPLEMENTARY_PAIRS
+        families = [None] + style_agent.COLOR_FAMILIES
+        for outer in families:
+            outer_mask = style_agent.colors_to_mask([outer] if outer else [])
+            masks = [style_agent.colors_to_mask([base] if base else []) for base in families]
+            assert list(style_agent.coordinates_well(masks, outer_mask)) == [by_names(base, outer) for base in families]
+
+def test_forecast_filter_ranks_items_by_numeric_warmth():
+    """Warmth, breathability and water resistance are indexed; forecasts filter and rank on them"""
+    with temp_closet() as closet_dir:
+        items = style_agent.load_closet_txts(closet_dir)
+        by_file = {item['file']: item for item in items}
+        assert by_file['top2.txt']['warmth_score'] > by_file['bottom1.txt']['warmth_score'] > by_file['top1.txt']['warmth_score']
+        assert by_file['dress1.txt']['breathability'] > by_file['coat1.txt']['breathability']
+        assert by_file['shoes1.txt']['water_resistance'] > by_file['top2.txt']['water_resistance']
+
+        cold_rain = {'temperature': 2, 'humidity': 70, 'wind_speed': 30, 'condition': 'Light rain'}
+        ranked = [item['file'] for item in style_agent.filter_by_forecast(items, cold_rain)]
+        assert ranked[:2] == ['coat1.txt', 'top2.txt'] and 'dress1.txt' not in ranked and 'top1.txt' not in ranked
+        hot_humid = {'temperature': 31, 'humidity': 80, 'wind_speed': 5, 'condition': 'Sunny'}
+        ranked = [item['file'] for item in style_agent.filter_by_forecast(items, hot_humid)]
+        assert ranked[0] == 'dress1.txt' and 'coat1.txt' not in ranked and 'top2.txt' not in ranked
+        # Unindexed items are scored from their description
+        raw = [{'file': item['file'], 'desc': item['desc']} for item in items]
+        assert [item['file'] for item in style_agent.filter_by_forecast(raw, hot_humid)] == ranked
+
+        style_agent.clear_recommendation_cache()
+        outfits = style_agent.select_multiple_outfits(num=2, closet_dir=closet_dir, criteria=dict(cold_rain))
+        assert outfits and all('dress1.txt' not in outfit for outfit in outfits)
+        # A forecast asking the same of clothes reuses the memoised result
+        before = style_agent.get_recommendation_cache_stats()
+        assert style_agent.select_multiple_outfits(num=2, closet_dir=closet_dir, criteria=dict(cold_rain, humidity=75)) == outfits
+        assert style_agent.get_recommendation_cache_stats()['hits'] == before['hits'] + 1
+
+def main():
+    """Main function"""
+    print("AIstylist Style Agent Test")
+    print("=" * 50)
+    test_closet_index_refreshes_incrementally()
+    test_indexed_weather_filter_matches_keyword_scan()
+    test_keyword_tagger_matches_substring_chains()
+    test_vectorized_coordination_matches_per_item_loop()
+    test_outfit_search_finds_best_and_varied_outfits()
+    test_outfit_search_scales_to_a_large_closet()
+    test_seeded_recommendations_are_reproducible_and_memoised()
+    test_indexed_layering_skips_used_items()
+    test_forecast_filter_ranks_items_by_numeric_warmth()
+    print("=" * 50)
+    print("Test complete")
+
+if __name__ == '__main__':
+    main()